@@ -0,0 +1,286 @@
+"""Versioned JSON API (/api/v1) for the timeline, profiles and messages.
+
+Mirrors the HTML pages for clients that only need the data:
+
+- queries select just the columns a response needs, never whole rows
+- lists page with keyset cursors: pass a response's `next_cursor` back as
+  ?cursor=... (with an optional ?limit=..., at most MAX_LIMIT)
+- bodies are encoded with orjson when it is installed
+- responses of MIN_COMPRESS_SIZE bytes or more are compressed with brotli
+  (when installed) or gzip, if the client accepts it
+
+Authentication is the same session cookie the site uses.
+"""
+
+import gzip
+import json
+
+from flask import Blueprint, Response, abort, g, request
+
+import follow_state
+import timeline
+from models import db, Follows, Likes, Message, User
+from pagination import keyset_page
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+blueprint = Blueprint('api', __name__, url_prefix='/api/v1')
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MIN_COMPRESS_SIZE = 1024
+
+MESSAGE_COLUMNS = (
+    Message.id,
+    Message.text,
+    Message.timestamp,
+    Message.user_id,
+    User.username,
+    User.image_url,
+)
+
+MESSAGE_ORDER = (Message.timestamp, Message.id)
+
+USER_SUMMARY_COLUMNS = (
+    User.id,
+    User.username,
+    User.image_url,
+    User.bio,
+)
+
+PROFILE_COLUMNS = USER_SUMMARY_COLUMNS + (
+    User.header_image_url,
+    User.location,
+    User.messages_count,
+    User.following_count,
+    User.followers_count,
+    User.likes_count,
+)
+
+
+##############################################################################
+# Encoding
+
+
+def dumps(data):
+    """Serialize to compact JSON bytes."""
+
+    if orjson is not None:
+        return orjson.dumps(data)
+
+    return json.dumps(data, separators=(',', ':'), default=str).encode('UTF-8')
+
+
+def respond(data, status=200):
+    return Response(dumps(data), status=status, mimetype='application/json')
+
+
+def error(message, status):
+    return respond({'error': message}, status)
+
+
+@blueprint.after_request
+def compress(response):
+    """Compress large bodies with the best encoding the client accepts."""
+
+    if (response.direct_passthrough or
+            'Content-Encoding' in response.headers or
+            not 200 <= response.status_code < 300):
+        return response
+
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_SIZE:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(body, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@blueprint.errorhandler(404)
+def not_found(e):
+    return error("Not found.", 404)
+
+
+##############################################################################
+# Helpers
+
+
+def login_required():
+    """Abort with 401 unless someone is logged in."""
+
+    if not g.user:
+        abort(error("Access unauthorized.", 401))
+
+
+def page_args():
+    """The (cursor, limit) a list request asked for."""
+
+    try:
+        limit = int(request.args.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        limit = DEFAULT_LIMIT
+
+    return request.args.get('cursor'), max(1, min(limit, MAX_LIMIT))
+
+
+def message_query():
+    return db.session.query(*MESSAGE_COLUMNS).join(User, User.id == Message.user_id)
+
+
+def serialize_message(row, liked_ids=()):
+    data = {
+        'id': row.id,
+        'text': row.text,
+        'timestamp': row.timestamp.isoformat(),
+        'user': {
+            'id': row.user_id,
+            'username': row.username,
+            'image_url': row.image_url,
+        },
+    }
+    if g.user:
+        data['liked'] = row.id in liked_ids
+    return data
+
+
+def message_list(page):
+    """A page of message rows, with the viewer's liked flags."""
+
+    liked_ids = g.user.liked_ids_among(row.id for row in page.items) if g.user else ()
+    return respond({
+        'data': [serialize_message(row, liked_ids) for row in page.items],
+        'next_cursor': page.next_cursor,
+    })
+
+
+def user_list(query):
+    """A page of user summaries from `query`, in id order."""
+
+    cursor, limit = page_args()
+    page = keyset_page(query, (User.id,), cursor=cursor, limit=limit, descending=False)
+    follow_state.prime(row.id for row in page.items)
+
+    data = []
+    for row in page.items:
+        user = {name: getattr(row, name) for name in row.keys()}
+        if g.user:
+            user['is_following'] = follow_state.is_following(row.id)
+        data.append(user)
+
+    return respond({'data': data, 'next_cursor': page.next_cursor})
+
+
+def require_user(user_id):
+    if not db.session.query(User.query.filter(User.id == user_id).exists()).scalar():
+        abort(404)
+
+
+##############################################################################
+# Endpoints
+
+
+@blueprint.route('/timeline')
+def home_timeline():
+    """The logged-in user's home timeline, newest first."""
+
+    login_required()
+    cursor, limit = page_args()
+
+    page = timeline.home_page(g.user, cursor=cursor, limit=limit, query=message_query())
+    return message_list(page)
+
+
+@blueprint.route('/users/<int:user_id>')
+def user_profile(user_id):
+    """A user's profile and counts."""
+
+    row = db.session.query(*PROFILE_COLUMNS).filter(User.id == user_id).first()
+    if row is None:
+        abort(404)
+
+    data = {name: getattr(row, name) for name in row.keys()}
+    if g.user:
+        data['is_following'] = follow_state.is_following(user_id)
+
+    return respond({'data': data})
+
+
+@blueprint.route('/users/<int:user_id>/messages')
+def user_messages(user_id):
+    """A user's messages, newest first."""
+
+    require_user(user_id)
+    cursor, limit = page_args()
+
+    page = keyset_page(message_query().filter(Message.user_id == user_id),
+                       MESSAGE_ORDER, cursor=cursor, limit=limit)
+    return message_list(page)
+
+
+@blueprint.route('/users/<int:user_id>/following')
+def user_following(user_id):
+    """Users this user follows."""
+
+    login_required()
+    require_user(user_id)
+
+    return user_list(db.session
+                     .query(*USER_SUMMARY_COLUMNS)
+                     .join(Follows, Follows.user_being_followed_id == User.id)
+                     .filter(Follows.user_following_id == user_id))
+
+
+@blueprint.route('/users/<int:user_id>/followers')
+def user_followers(user_id):
+    """Users following this user."""
+
+    login_required()
+    require_user(user_id)
+
+    return user_list(db.session
+                     .query(*USER_SUMMARY_COLUMNS)
+                     .join(Follows, Follows.user_following_id == User.id)
+                     .filter(Follows.user_being_followed_id == user_id))
+
+
+@blueprint.route('/users/<int:user_id>/likes')
+def user_likes(user_id):
+    """Messages this user liked, newest message first."""
+
+    login_required()
+    require_user(user_id)
+    cursor, limit = page_args()
+
+    page = keyset_page(message_query()
+                       .join(Likes, Likes.message_id == Message.id)
+                       .filter(Likes.user_id == user_id),
+                       MESSAGE_ORDER, cursor=cursor, limit=limit)
+    return message_list(page)
+
+
+@blueprint.route('/messages/<int:message_id>')
+def message(message_id):
+    """One message."""
+
+    row = message_query().filter(Message.id == message_id).first()
+    if row is None:
+        abort(404)
+
+    liked_ids = g.user.liked_ids_among([row.id]) if g.user else ()
+    return respond({'data': serialize_message(row, liked_ids)})
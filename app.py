@@ -1,11 +1,31 @@
+import hmac
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+from flask import (Flask, render_template, request, flash, redirect, session, g,
+                   url_for, abort, jsonify)
 from flask_debugtoolbar import DebugToolbarExtension
+from flask_migrate import Migrate
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 from forms import UserAddForm, UserEditForm, LoginForm, MessageForm
-from models import db, connect_db, User, Message, Likes
+import api
+import conditional
+import counters
+import follow_state
+import fragments
+import hashing
+import identity
+import instrumentation
+import live
+import recent
+import replicas
+import timeline
+import writebehind
+from models import db, connect_db, User, Message, Likes, Follows
+from pagination import keyset_window
+from search import search_users
 
 CURR_USER_KEY = "curr_user"
 
@@ -16,13 +36,79 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
 
+# Comma-separated read replica URLs; reads on GET requests go to them.
+app.config['DATABASE_REPLICA_URLS'] = [
+    url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+app.config['REPLICA_STICKY_SECONDS'] = float(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+
+# Connection pools (per engine, per process); unset means SQLAlchemy's default
+app.config['SQLALCHEMY_POOL_SIZE'] = (int(os.environ['DATABASE_POOL_SIZE'])
+                                      if os.environ.get('DATABASE_POOL_SIZE') else None)
+app.config['SQLALCHEMY_MAX_OVERFLOW'] = (int(os.environ['DATABASE_MAX_OVERFLOW'])
+                                         if os.environ.get('DATABASE_MAX_OVERFLOW') else None)
+app.config['SQLALCHEMY_POOL_TIMEOUT'] = (float(os.environ['DATABASE_POOL_TIMEOUT'])
+                                         if os.environ.get('DATABASE_POOL_TIMEOUT') else None)
+app.config['SQLALCHEMY_POOL_RECYCLE'] = int(os.environ.get('DATABASE_POOL_RECYCLE', 1800))
+app.config['SQLALCHEMY_POOL_PRE_PING'] = (
+    os.environ.get('DATABASE_POOL_PRE_PING', 'true').lower() == 'true')
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
-
+app.config['TIMELINE_PAGE_SIZE'] = int(os.environ.get('TIMELINE_PAGE_SIZE', 20))
+app.config['TIMELINE_FANOUT'] = os.environ.get('TIMELINE_FANOUT', 'false').lower() == 'true'
+app.config['TIMELINE_MAX_LENGTH'] = int(os.environ.get('TIMELINE_MAX_LENGTH', 800))
+app.config['TIMELINE_CELEBRITY_FOLLOWERS'] = int(
+    os.environ.get('TIMELINE_CELEBRITY_FOLLOWERS', 10000))
+app.config['USERS_PER_PAGE'] = int(os.environ.get('USERS_PER_PAGE', 24))
+app.config['IDENTITY_CACHE_URL'] = os.environ.get('IDENTITY_CACHE_URL')
+app.config['IDENTITY_CACHE_TTL'] = int(os.environ.get('IDENTITY_CACHE_TTL', 30))
+app.config['IDENTITY_CACHE_SIZE'] = int(os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_MAX_QUEUE'] = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', 64))
+app.config['PASSWORD_HASH_QUEUE_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5))
+app.config['FRAGMENT_CACHE_URL'] = os.environ.get('FRAGMENT_CACHE_URL')
+app.config['FRAGMENT_CACHE_TTL'] = int(os.environ.get('FRAGMENT_CACHE_TTL', 600))
+app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', 20000))
+app.config['RECENT_MESSAGES_PER_AUTHOR'] = int(os.environ.get('RECENT_MESSAGES_PER_AUTHOR', 100))
+app.config['RECENT_MESSAGES_CACHE_URL'] = os.environ.get('RECENT_MESSAGES_CACHE_URL')
+app.config['RECENT_MESSAGES_CACHE_BYTES'] = int(
+    os.environ.get('RECENT_MESSAGES_CACHE_BYTES', 64 * 1024 * 1024))
+app.config['RECENT_MESSAGES_TTL'] = int(os.environ.get('RECENT_MESSAGES_TTL', 3600))
+app.config['LIVE_BROKER_URL'] = os.environ.get('LIVE_BROKER_URL')
+app.config['LIVE_HISTORY'] = int(os.environ.get('LIVE_HISTORY', 1000))
+app.config['LIVE_POLL_SECONDS'] = float(os.environ.get('LIVE_POLL_SECONDS', 25))
+app.config['LIVE_OVERLAP_SECONDS'] = float(os.environ.get('LIVE_OVERLAP_SECONDS', 10))
+app.config['WRITE_BEHIND'] = os.environ.get('WRITE_BEHIND', 'false').lower() == 'true'
+app.config['WRITE_BEHIND_WINDOW'] = float(os.environ.get('WRITE_BEHIND_WINDOW', 0.5))
+app.config['WRITE_BEHIND_JOURNAL_DIR'] = os.environ.get('WRITE_BEHIND_JOURNAL_DIR')
+app.config['WRITE_BEHIND_FSYNC'] = os.environ.get('WRITE_BEHIND_FSYNC', 'false').lower() == 'true'
+app.config['SLOW_QUERY_MS'] = (float(os.environ['SLOW_QUERY_MS'])
+                               if os.environ.get('SLOW_QUERY_MS') else None)
+app.config['QUERY_STATS_HEADERS'] = os.environ.get('QUERY_STATS_HEADERS', 'true').lower() == 'true'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+# the toolbar adds work (and exposes internals) on every page; dev only
+if app.debug:
+    toolbar = DebugToolbarExtension(app)
+
+replicas.init_app(app)
 connect_db(app)
+migrate = Migrate(app, db)
+instrumentation.init_app(app)
+identity.init_app(app)
+hashing.init_app(app)
+fragments.init_app(app)
+conditional.init_app(app)
+recent.init_app(app)
+live.init_app(app)
+timeline.init_app(app)
+writebehind.init_app(app)
+app.register_blueprint(api.blueprint)
+
+app.add_template_global(follow_state.is_following)
 
 
 ##############################################################################
@@ -31,15 +117,38 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    g.user is a cached identity.CurrentUser; use g.user.model for the full
+    User row.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = identity.load(session[CURR_USER_KEY])
 
     else:
         g.user = None
 
 
+def viewer_state(user_id):
+    """What about the viewer changes how `user_id`'s pages look: who they
+    are (and their navbar details), and whether they follow that user."""
+
+    if not g.user:
+        return (None,)
+
+    return (g.user.id, g.user.version, follow_state.is_following(user_id))
+
+
+def wants_json():
+    """Did the client ask for a JSON response rather than a page?"""
+
+    best = request.accept_mimetypes.best_match(['application/json', 'text/html'])
+    return request.is_json or (best == 'application/json' and
+                               request.accept_mimetypes[best] >
+                               request.accept_mimetypes['text/html'])
+
+
 def do_login(user):
     """Log in user."""
 
@@ -100,6 +209,9 @@ def login():
                                  form.password.data)
 
         if user:
+            # authenticate may have upgraded the password hash
+            db.session.commit()
+
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -121,38 +233,113 @@ def logout():
 ##############################################################################
 # General user routes:
 
+# Columns needed to render a user card (fragments/user_card.html)
+USER_CARD_COLUMNS = (
+    User.id,
+    User.username,
+    User.image_url,
+    User.header_image_url,
+    User.bio,
+    User.version,
+)
+
+
 @app.route('/users')
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Without a search, lists every user alphabetically; 'after'/'before'
+    params in querystring are cursors for the next/previous page.
+
+    Can take a 'q' param in querystring to search by that username, and a
+    'page' param to page through the search results.
     """
 
     search = request.args.get('q')
+    per_page = app.config['USERS_PER_PAGE']
+
+    # only load what a user card shows (never password hashes)
+    cards = db.session.query(*USER_CARD_COLUMNS)
+    prev_url = next_url = None
 
     if not search:
-        users = User.query.all()
+        window = keyset_window(cards,
+                               (User.username,),
+                               after=request.args.get('after'),
+                               before=request.args.get('before'),
+                               limit=per_page)
+        users = window.items
+
+        if window.prev_cursor:
+            prev_url = url_for('list_users', before=window.prev_cursor)
+        if window.next_cursor:
+            next_url = url_for('list_users', after=window.next_cursor)
+
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        page = max(request.args.get('page', 1, type=int), 1)
+        users, has_next = search_users(search, page=page, per_page=per_page, query=cards)
+
+        if page > 1:
+            prev_url = url_for('list_users', q=search, page=page - 1)
+        if has_next:
+            next_url = url_for('list_users', q=search, page=page + 1)
 
-    return render_template('users/index.html', users=users)
+    follow_state.prime(user.id for user in users)
+
+    return render_template('users/index.html',
+                           users=users,
+                           prev_url=prev_url,
+                           next_url=next_url)
+
+
+# How many of their newest messages a profile lists
+PROFILE_MESSAGES = 100
 
 
 @app.route('/users/<int:user_id>')
 def users_show(user_id):
-    """Show user profile."""
+    """Show user profile.
+
+    Answers 304 Not Modified when the profile, its counts, its newest
+    message and the viewer's view of it are all unchanged.
+    """
+
+    newest_message_id = (select([Message.id])
+                         .where(Message.user_id == User.id)
+                         .order_by(Message.timestamp.desc(), Message.id.desc())
+                         .limit(1)
+                         .as_scalar()
+                         .label('newest_message_id'))
+    validator = (db.session
+                 .query(User.version,
+                        User.messages_count,
+                        User.following_count,
+                        User.followers_count,
+                        User.likes_count,
+                        newest_message_id)
+                 .filter(User.id == user_id)
+                 .first())
+    if validator is None:
+        abort(404)
+
+    etag = conditional.page_etag('users_show', user_id, tuple(validator), *viewer_state(user_id))
+    if conditional.is_fresh(etag):
+        return conditional.not_modified(etag)
 
     user = User.query.get_or_404(user_id)
 
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    # hot profiles come from the recent-messages cache
+    messages = recent.messages(user_id, limit=PROFILE_MESSAGES,
+                               newest_id=validator.newest_message_id)
+    if messages is None:
+        messages = (Message
+                    .query
+                    .filter(Message.user_id == user_id)
+                    .order_by(Message.timestamp.desc(), Message.id.desc())
+                    .limit(PROFILE_MESSAGES)
+                    .all())
+    return conditional.tagged(
+        render_template('users/show.html', user=user, messages=messages), etag)
 
 
 @app.route('/users/<int:user_id>/following')
@@ -164,6 +351,8 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
+    follow_state.prime(followed.id for followed in user.following)
+
     return render_template('users/following.html', user=user)
 
 
@@ -176,6 +365,8 @@ def users_followers(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
+    follow_state.prime(follower.id for follower in user.followers)
+
     return render_template('users/followers.html', user=user)
 
 
@@ -188,7 +379,16 @@ def users_likes(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/likes.html', user=user)    
+
+    messages = (Message
+                .query
+                .options(joinedload(Message.user))
+                .join(Likes, Likes.message_id == Message.id)
+                .filter(Likes.user_id == user_id)
+                .order_by(Message.timestamp.desc())
+                .all())
+
+    return render_template('users/likes.html', user=user, messages=messages)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -200,8 +400,16 @@ def add_follow(follow_id):
         return redirect("/")
 
     followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+
+    if writebehind.enabled():
+        writebehind.queue.set(writebehind.FOLLOW, g.user.id, followed_user.id, True)
+
+    elif not g.user.is_following(followed_user):
+        db.session.add(Follows(user_being_followed_id=followed_user.id,
+                               user_following_id=g.user.id))
+        counters.follow_added(g.user.id, followed_user.id)
+        timeline.add_author(g.user.id, followed_user.id)
+        db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -214,9 +422,20 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
-    db.session.commit()
+    if writebehind.enabled():
+        writebehind.queue.set(writebehind.FOLLOW, g.user.id, follow_id, False)
+        return redirect(f"/users/{g.user.id}/following")
+
+    removed = (Follows
+               .query
+               .filter_by(user_being_followed_id=follow_id,
+                          user_following_id=g.user.id)
+               .delete())
+
+    if removed:
+        counters.follow_removed(g.user.id, follow_id)
+        timeline.remove_author(g.user.id, follow_id)
+        db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -229,7 +448,7 @@ def profile():
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
-    user = g.user
+    user = g.user.model
     form = UserEditForm(obj=user)
 
     if form.validate_on_submit():
@@ -240,8 +459,10 @@ def profile():
             user.header_image_url = form.header_image_url.data or User.header_image_url.default.arg
             user.bio = form.bio.data
             user.location = form.location.data
+            user.version = User.version + 1
 
             db.session.commit()
+            identity.invalidate(user.id)
             return redirect(f"/users/{user.id}")
 
         flash("Incorrect password. Please try again.", 'danger')
@@ -259,8 +480,11 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    counters.user_deleted(g.user.id)
+    db.session.delete(g.user.model)
     db.session.commit()
+    identity.invalidate(g.user.id)
+    recent.forget(g.user.id)
 
     return redirect("/signup")
 
@@ -282,9 +506,14 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        counters.adjust(g.user.id, messages_count=1)
+        db.session.flush()
+        timeline.fan_out(msg)
         db.session.commit()
+        recent.add(msg)
+        live.publish(msg)
 
         return redirect(f"/users/{g.user.id}")
 
@@ -293,31 +522,68 @@ def messages_add():
 
 @app.route('/messages/<int:message_id>', methods=["GET"])
 def messages_show(message_id):
-    """Show a message."""
+    """Show a message.
+
+    Messages never change, so the page only changes with its author's
+    profile and the viewer; answers 304 Not Modified otherwise.
+    """
+
+    validator = (db.session
+                 .query(Message.user_id, User.version)
+                 .join(User, User.id == Message.user_id)
+                 .filter(Message.id == message_id)
+                 .first())
+    if validator is None:
+        abort(404)
+
+    author_id, author_version = validator
+    etag = conditional.page_etag('messages_show', message_id, author_version,
+                                 *viewer_state(author_id))
+    if conditional.is_fresh(etag):
+        return conditional.not_modified(etag)
 
     msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
+    return conditional.tagged(render_template('messages/show.html', message=msg), etag)
 
 
 @app.route('/messages/<int:message_id>/like', methods=['POST'])
 def toggle_like(message_id):
-    """Toggle like on a message."""
+    """Toggle like on a message.
+
+    With WRITE_BEHIND on, the like is queued and written in the next batch.
+
+    Clients that ask for JSON (Accept: application/json) get back
+    {"message_id": ..., "liked": ...} instead of a redirect home.
+    """
 
     if not g.user:
+        if wants_json():
+            return jsonify(error="Access unauthorized."), 401
+
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    liked_messages = [message.id for message in g.user.likes]
-    
-    if message_id in liked_messages:
-        message = Likes.query.filter_by(message_id=message_id).first()
-        db.session.delete(message)
-    
+    if writebehind.enabled():
+        if not db.session.query(Message.query.filter_by(id=message_id).exists()).scalar():
+            abort(404)
+
+        liked = message_id not in g.user.liked_ids_among([message_id])
+        writebehind.queue.set(writebehind.LIKE, g.user.id, message_id, liked)
+
     else:
-        new_like = Likes(user_id=g.user.id, message_id=message_id)
-        db.session.add(new_like)
+        try:
+            liked, changed = Likes.toggle(g.user.id, message_id)
+            if changed:
+                counters.adjust(g.user.id, likes_count=1 if liked else -1)
+            db.session.commit()
 
-    db.session.commit()
+        except IntegrityError:
+            # no such message
+            db.session.rollback()
+            abort(404)
+
+    if wants_json():
+        return jsonify(message_id=message_id, liked=liked)
 
     return redirect("/")
 
@@ -331,8 +597,13 @@ def messages_delete(message_id):
         return redirect("/")
     
     msg = Message.query.get(message_id)
+    author_id, author_version = msg.user_id, msg.user.version
+    counters.message_deleted(msg)
+    timeline.remove_message(message_id)
     db.session.delete(msg)
     db.session.commit()
+    fragments.forget_message(message_id, author_version)
+    recent.remove(author_id, message_id)
 
     return redirect(f"/users/{g.user.id}")
 
@@ -345,46 +616,146 @@ def messages_delete(message_id):
 def homepage():
     """Show homepage:
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, one page at a time
+
+    Can take a 'before' param in querystring: the cursor of the last message
+    on the previous page.
     """
 
     if g.user:
-        following_ids = [f.id for f in g.user.following] + [g.user.id]
+        cursor = request.args.get('before')
+        limit = app.config['TIMELINE_PAGE_SIZE']
 
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        page = timeline.home_page(g.user, cursor=cursor, limit=limit)
+
+        liked_msg_ids = g.user.liked_ids_among(msg.id for msg in page.items)
 
-        liked_msg_ids = [msg.id for msg in g.user.likes]
+        # the first page polls /timeline/updates for anything newer
+        updates_since = live.cursor_for(page.items) if not cursor else None
 
-        return render_template('home.html', messages=messages, likes=liked_msg_ids)
+        return render_template('home.html',
+                               messages=page.items,
+                               next_cursor=page.next_cursor,
+                               updates_since=updates_since,
+                               likes=liked_msg_ids)
 
     else:
         return render_template('home-anon.html')
 
 
+@app.route('/timeline/updates')
+def timeline_updates():
+    """Messages newer than the cursor in ?since= from people the user
+    follows, newest first, with their timeline cards, as JSON.
+
+    When there are none yet, waits up to LIVE_POLL_SECONDS (or ?wait=
+    seconds, if shorter) for one. The response's cursor is the `since` to
+    poll with next.
+
+    Reads the primary: a replica may not have the messages the broker
+    announces yet, and the cursor moves past them either way.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    replicas.pin_to_primary(db.session())
+
+    decoded = live.decode_cursor(request.args.get('since', ''))
+    if decoded is None:
+        return jsonify(error="Bad cursor."), 400
+    after, seen = decoded
+
+    max_wait = app.config['LIVE_POLL_SECONDS']
+    wait = max(0, min(request.args.get('wait', max_wait, type=float), max_wait))
+
+    author_ids = set(g.user.following_ids()) | {g.user.id}
+    message_ids, next_cursor = live.updates(author_ids, after, seen, timeout=wait)
+
+    messages = []
+    if message_ids:
+        by_id = {msg.id: msg for msg in (Message
+                                         .query
+                                         .options(joinedload(Message.user))
+                                         .filter(Message.id.in_(message_ids)))}
+        liked_msg_ids = g.user.liked_ids_among(message_ids)
+
+        messages = [{'id': msg.id,
+                     'html': str(fragments.message_card(msg,
+                                                        like_button=msg.user_id != g.user.id,
+                                                        liked=msg.id in liked_msg_ids))}
+                    for msg in (by_id[i] for i in message_ids if i in by_id)]
+
+    return jsonify(messages=messages, cursor=next_cursor)
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     """404 Page Not Found"""
 
     return render_template('404.html'), 404
 
+
+@app.errorhandler(hashing.HashingOverloaded)
+def hashing_overloaded(e):
+    """Too many logins/signups queued up for password hashing."""
+
+    flash("We're handling a lot of sign-ins right now. Please try again.", 'danger')
+    return redirect(request.path)
+
+##############################################################################
+# Admin
+
+
+@app.route('/admin/metrics')
+def admin_metrics():
+    """Per-endpoint SQL stats, cache hit rates, password hashing queue,
+    timeline paths, write-behind queue and database connection pools.
+
+    Needs `Authorization: Bearer <METRICS_TOKEN>`; without a configured
+    token it only answers in debug mode.
+    """
+
+    token = app.config['METRICS_TOKEN']
+    if token:
+        given = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(given.encode(), f"Bearer {token}".encode()):
+            abort(404)
+    elif not app.debug:
+        abort(404)
+
+    return jsonify(endpoints=instrumentation.stats.snapshot(),
+                   identity_cache=identity.cache.stats(),
+                   recent_messages_cache=recent.cache.stats(),
+                   password_hashing=hashing.pool.stats(),
+                   timeline=timeline.stats.snapshot(),
+                   write_behind=writebehind.queue.stats(),
+                   database_pools=replicas.pool_stats(app))
+
+
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+# Maintenance commands (run like `FLASK_APP=app.py flask rebuild-timelines`)
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines_command():
+    """Backfill materialized home timelines from follows and messages."""
+
+    count = timeline.rebuild()
+    print(f"Rebuilt {count} timelines.")
+
+
+@app.cli.command('trim-timelines')
+def trim_timelines_command():
+    """Cut materialized timelines back to TIMELINE_MAX_LENGTH entries."""
+
+    count = timeline.trim_all()
+    print(f"Trimmed {count} timelines.")
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Repair drifted message/follow/like counters on users."""
+
+    repaired = counters.reconcile()
+    db.session.commit()
+    print(f"Repaired counters for {repaired} users.")
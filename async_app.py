@@ -0,0 +1,281 @@
+"""Async read path for the busiest JSON endpoints.
+
+The Flask app handles one request per worker thread, so a slow query ties
+up a whole worker. This is a small Quart (asyncio) app serving the
+read-heavy API endpoints (the home timeline, profiles and single messages)
+from an asyncpg connection pool, so one process can keep many requests
+waiting on the database at once. Responses, URLs and cursors match
+api.py's, so a proxy can send these paths here and everything else to the
+Flask app:
+
+    GET /api/v1/timeline
+    GET /api/v1/users/<id>
+    GET /api/v1/messages/<id>
+
+It reads the same database (the schema in models.py) and logs users in
+with the same session cookie, so SECRET_KEY must match the Flask app's.
+Install requirements-async.txt and run it next to the Flask app:
+
+    hypercorn async_app:app --bind 0.0.0.0:5001
+"""
+
+import os
+
+import asyncpg
+from quart import Quart, Response, request, session
+
+from api import DEFAULT_LIMIT, MAX_LIMIT, dumps
+from models import Message
+from pagination import decode_cursor, encode_cursor
+from timeline import Entry, merge_newest
+
+# must match app.CURR_USER_KEY
+CURR_USER_KEY = "curr_user"
+
+MESSAGE_ORDER = (Message.timestamp, Message.id)
+
+app = Quart(__name__)
+
+app.config['DATABASE_URL'] = os.environ.get('DATABASE_URL', 'postgresql:///warbler')
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+app.config['TIMELINE_FANOUT'] = os.environ.get('TIMELINE_FANOUT', 'false').lower() == 'true'
+app.config['TIMELINE_CELEBRITY_FOLLOWERS'] = int(
+    os.environ.get('TIMELINE_CELEBRITY_FOLLOWERS', 10000))
+app.config['ASYNC_POOL_MIN_SIZE'] = int(os.environ.get('ASYNC_POOL_MIN_SIZE', 5))
+app.config['ASYNC_POOL_MAX_SIZE'] = int(os.environ.get('ASYNC_POOL_MAX_SIZE', 20))
+
+pool = None
+
+
+@app.before_serving
+async def open_pool():
+    global pool
+
+    pool = await asyncpg.create_pool(app.config['DATABASE_URL'],
+                                     min_size=app.config['ASYNC_POOL_MIN_SIZE'],
+                                     max_size=app.config['ASYNC_POOL_MAX_SIZE'])
+
+
+@app.after_serving
+async def close_pool():
+    await pool.close()
+
+
+##############################################################################
+# Queries
+
+MESSAGE_FIELDS = """
+    m.id, m.text, m.timestamp, m.user_id, u.username, u.image_url
+"""
+
+# $1: viewer id; $2/$3: cursor (timestamp, id) or nulls; $4: limit
+PULL_TIMELINE_SQL = f"""
+    SELECT {MESSAGE_FIELDS}
+    FROM messages m JOIN users u ON u.id = m.user_id
+    WHERE (m.user_id = $1 OR m.user_id IN (SELECT user_being_followed_id
+                                          FROM follows
+                                          WHERE user_following_id = $1))
+      AND ($2::timestamp IS NULL OR (m.timestamp, m.id) < ($2, $3::int))
+    ORDER BY m.timestamp DESC, m.id DESC
+    LIMIT $4
+"""
+
+# hybrid timelines (see timeline.py): pushed entries, plus the recent
+# messages of followed celebrities, merged here
+
+# $1: viewer id; $2: celebrity follower threshold
+CELEBRITIES_SQL = """
+    SELECT f.user_being_followed_id
+    FROM follows f JOIN users u ON u.id = f.user_being_followed_id
+    WHERE f.user_following_id = $1
+      AND f.user_being_followed_id <> $1
+      AND u.followers_count >= $2
+"""
+
+# $1: viewer id; $2/$3: cursor; $4: limit
+PUSHED_ENTRIES_SQL = """
+    SELECT timestamp, message_id
+    FROM timeline_entries
+    WHERE user_id = $1
+      AND ($2::timestamp IS NULL OR (timestamp, message_id) < ($2, $3::int))
+    ORDER BY timestamp DESC, message_id DESC
+    LIMIT $4
+"""
+
+# $1: author id; $2/$3: cursor; $4: limit
+AUTHOR_ENTRIES_SQL = """
+    SELECT timestamp, id AS message_id
+    FROM messages
+    WHERE user_id = $1
+      AND ($2::timestamp IS NULL OR (timestamp, id) < ($2, $3::int))
+    ORDER BY timestamp DESC, id DESC
+    LIMIT $4
+"""
+
+MESSAGES_BY_ID_SQL = f"""
+    SELECT {MESSAGE_FIELDS}
+    FROM messages m JOIN users u ON u.id = m.user_id
+    WHERE m.id = ANY($1::int[])
+"""
+
+LIKED_SQL = """
+    SELECT message_id FROM likes WHERE user_id = $1 AND message_id = ANY($2::int[])
+"""
+
+# $1: profile id; $2: viewer id or null
+PROFILE_SQL = """
+    SELECT id, username, image_url, bio, header_image_url, location,
+           messages_count, following_count, followers_count, likes_count,
+           EXISTS (SELECT 1 FROM follows
+                   WHERE user_following_id = $2::int
+                     AND user_being_followed_id = users.id) AS is_following
+    FROM users
+    WHERE id = $1
+"""
+
+MESSAGE_SQL = f"""
+    SELECT {MESSAGE_FIELDS}
+    FROM messages m JOIN users u ON u.id = m.user_id
+    WHERE m.id = $1
+"""
+
+
+##############################################################################
+# Helpers
+
+
+def respond(data, status=200):
+    return Response(dumps(data), status=status, mimetype='application/json')
+
+
+def error(message, status):
+    return respond({'error': message}, status)
+
+
+def viewer_id():
+    """The logged-in user's id, from the Flask app's session cookie."""
+
+    return session.get(CURR_USER_KEY)
+
+
+def page_args():
+    try:
+        limit = int(request.args.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        limit = DEFAULT_LIMIT
+
+    return request.args.get('cursor'), max(1, min(limit, MAX_LIMIT))
+
+
+def serialize_message(row, liked_ids, logged_in):
+    data = {
+        'id': row['id'],
+        'text': row['text'],
+        'timestamp': row['timestamp'].isoformat(),
+        'user': {
+            'id': row['user_id'],
+            'username': row['username'],
+            'image_url': row['image_url'],
+        },
+    }
+    if logged_in:
+        data['liked'] = row['id'] in liked_ids
+    return data
+
+
+async def liked_ids_among(conn, user_id, message_ids):
+    if not user_id or not message_ids:
+        return set()
+
+    rows = await conn.fetch(LIKED_SQL, user_id, list(message_ids))
+    return {row['message_id'] for row in rows}
+
+
+async def hybrid_timeline(conn, user_id, timestamp, message_id, limit):
+    """Message rows for a materialized timeline page, with followed
+    celebrities' messages merged in (like timeline.timeline_page)."""
+
+    cursor = (timestamp, message_id, limit)
+    sources = [await conn.fetch(PUSHED_ENTRIES_SQL, user_id, *cursor)]
+
+    threshold = app.config['TIMELINE_CELEBRITY_FOLLOWERS']
+    if threshold:
+        for row in await conn.fetch(CELEBRITIES_SQL, user_id, threshold):
+            sources.append(await conn.fetch(AUTHOR_ENTRIES_SQL, row[0], *cursor))
+
+    entries = merge_newest([[Entry(*row) for row in rows] for rows in sources], limit)
+    ids = [entry.message_id for entry in entries]
+
+    by_id = {row['id']: row for row in await conn.fetch(MESSAGES_BY_ID_SQL, ids)}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+##############################################################################
+# Endpoints
+
+
+@app.route('/api/v1/timeline')
+async def home_timeline():
+    """The logged-in user's home timeline, newest first."""
+
+    user_id = viewer_id()
+    if not user_id:
+        return error("Access unauthorized.", 401)
+
+    cursor, limit = page_args()
+    after = decode_cursor(cursor, MESSAGE_ORDER) if cursor else None
+    timestamp, message_id = after or (None, None)
+
+    async with pool.acquire() as conn:
+        if app.config['TIMELINE_FANOUT']:
+            rows = await hybrid_timeline(conn, user_id, timestamp, message_id, limit + 1)
+        else:
+            # one extra row tells us whether there is another page
+            rows = await conn.fetch(PULL_TIMELINE_SQL, user_id, timestamp, message_id,
+                                    limit + 1)
+        items = rows[:limit]
+        liked_ids = await liked_ids_among(conn, user_id, [row['id'] for row in items])
+
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor([items[-1]['timestamp'], items[-1]['id']])
+
+    return respond({
+        'data': [serialize_message(row, liked_ids, True) for row in items],
+        'next_cursor': next_cursor,
+    })
+
+
+@app.route('/api/v1/users/<int:user_id>')
+async def user_profile(user_id):
+    """A user's profile and counts."""
+
+    viewer = viewer_id()
+
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(PROFILE_SQL, user_id, viewer)
+
+    if row is None:
+        return error("Not found.", 404)
+
+    data = dict(row)
+    if not viewer:
+        del data['is_following']
+
+    return respond({'data': data})
+
+
+@app.route('/api/v1/messages/<int:message_id>')
+async def message(message_id):
+    """One message."""
+
+    viewer = viewer_id()
+
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(MESSAGE_SQL, message_id)
+        if row is None:
+            return error("Not found.", 404)
+
+        liked_ids = await liked_ids_among(conn, viewer, [message_id])
+
+    return respond({'data': serialize_message(row, liked_ids, bool(viewer))})
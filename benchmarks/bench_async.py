@@ -0,0 +1,173 @@
+"""Compare the sync (Flask) and async (Quart) read paths under concurrency.
+
+Opens N concurrent keep-alive connections to each server and has them
+request the timeline, profile and message endpoints for --duration
+seconds, then reports throughput and latency per concurrency level.
+
+Seed BENCH_DATABASE_URL first (e.g. with benchmarks/bench_routes.py), then
+start both servers on it with the same SECRET_KEY, e.g.:
+
+    export BENCH_DATABASE_URL=postgresql:///warbler-bench
+    DATABASE_URL=$BENCH_DATABASE_URL FLASK_APP=app.py flask run --port 5000 --with-threads
+    DATABASE_URL=$BENCH_DATABASE_URL hypercorn async_app:app --bind 127.0.0.1:5001
+    python benchmarks/bench_async.py --concurrency 1 10 50 200
+
+The Flask dev server is a stand-in; for a fair comparison run the sync app
+under the production WSGI server and worker count you actually deploy.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from benchdb import use_bench_database  # noqa: E402
+
+use_bench_database()
+
+from app import app, CURR_USER_KEY  # noqa: E402
+from models import db, User, Message  # noqa: E402
+
+
+def session_cookie(user_id):
+    """A session cookie logging in `user_id`, valid for both apps."""
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    return f"session={serializer.dumps({CURR_USER_KEY: user_id})}"
+
+
+class Connection:
+    """A minimal keep-alive HTTP/1.1 client connection."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def get(self, path, cookie):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        self.writer.write(f"GET {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                          f"Cookie: {cookie}\r\nAccept: application/json\r\n\r\n".encode())
+
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        status = int(head.split(b" ", 2)[1])
+        headers = {}
+        for line in head.decode('latin-1').split("\r\n")[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        await self.reader.readexactly(int(headers.get('content-length', 0)))
+
+        # HTTP/1.0 servers (like Flask's dev server) close unless told otherwise
+        keep_alive = head.startswith(b"HTTP/1.1") or \
+            headers.get('connection', '').lower() == 'keep-alive'
+        if not keep_alive or headers.get('connection', '').lower() == 'close':
+            self.close()
+
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def run_level(base_url, concurrency, duration, paths, cookies):
+    """Hammer one server with `concurrency` connections for `duration`."""
+
+    url = urlsplit(base_url)
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client(index):
+        nonlocal errors
+        rng = random.Random(index)
+        conn = Connection(url.hostname, url.port or 80)
+        try:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    status = await conn.get(rng.choice(paths), rng.choice(cookies))
+                except (OSError, asyncio.IncompleteReadError):
+                    conn.close()
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+                if status >= 400:
+                    errors += 1
+        finally:
+            conn.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    pick = (lambda pct: latencies[min(len(latencies) - 1, int(len(latencies) * pct / 100))]
+            if latencies else 0.0)
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed,
+        'p50_ms': pick(50),
+        'p95_ms': pick(95),
+        'p99_ms': pick(99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sync-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--async-url', default='http://127.0.0.1:5001')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 200])
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help="seconds per server per concurrency level")
+    parser.add_argument('--users', type=int, default=100,
+                        help="how many different users to log in as")
+    parser.add_argument('--out', help="save results to this JSON file")
+    args = parser.parse_args()
+
+    with app.app_context():
+        max_user = db.session.query(db.func.max(User.id)).scalar()
+        max_message = db.session.query(db.func.max(Message.id)).scalar()
+
+    rng = random.Random(0)
+    cookies = [session_cookie(rng.randint(1, max_user)) for _ in range(args.users)]
+    paths = ["/api/v1/timeline"] * 2 + [
+        f"/api/v1/users/{rng.randint(1, max_user)}" for _ in range(50)
+    ] + [
+        f"/api/v1/messages/{rng.randint(1, max_message)}" for _ in range(50)
+    ]
+
+    results = {'paths': len(paths), 'levels': []}
+    print(f"{'conns':>6}  {'server':<6}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'p99 ms':>9}{'errors':>8}")
+
+    for concurrency in args.concurrency:
+        level = {'concurrency': concurrency}
+        for name, url in (('sync', args.sync_url), ('async', args.async_url)):
+            r = asyncio.run(run_level(url, concurrency, args.duration, paths, cookies))
+            level[name] = r
+            print(f"{concurrency:>6}  {name:<6}{r['rps']:10.1f}{r['p50_ms']:9.2f}"
+                  f"{r['p95_ms']:9.2f}{r['p99_ms']:9.2f}{r['errors']:8}")
+        results['levels'].append(level)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved {args.out}")
+
+
+if __name__ == '__main__':
+    main()
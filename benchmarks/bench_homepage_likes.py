@@ -0,0 +1,126 @@
+"""Benchmark homepage latency as the reader's total likes grow.
+
+The homepage only looks up liked state for the messages on the page, so
+its latency should stay flat whether the reader has liked 10 messages or
+100k. For each like count this adds likes up to that total and times GET /
+through the Flask test client.
+
+It wipes the database it runs against: BENCH_DATABASE_URL (default
+postgresql:///warbler-bench), whose name must end in -bench. E.g.:
+
+    createdb warbler-bench
+    python benchmarks/bench_homepage_likes.py
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from benchdb import require_bench_database, use_bench_database  # noqa: E402
+
+use_bench_database()
+
+from app import app, CURR_USER_KEY  # noqa: E402
+from models import db, User, Message, Follows, Likes  # noqa: E402
+import counters  # noqa: E402
+
+READER_ID = 1
+AUTHOR_ID = 2
+STRANGER_ID = 3
+BATCH_SIZE = 10000
+
+
+def setup(timeline_size):
+    """Start from empty tables: a reader following one author who has a
+    full timeline page, plus a stranger whose messages the reader likes."""
+
+    require_bench_database(db.engine.url)
+    db.drop_all()
+    db.create_all()
+
+    db.session.execute(User.__table__.insert(), [
+        {'id': uid, 'username': f"bench{uid}", 'email': f"bench{uid}@bench.test",
+         'password': 'unused'}
+        for uid in (READER_ID, AUTHOR_ID, STRANGER_ID)
+    ])
+    db.session.add(Follows(user_being_followed_id=AUTHOR_ID, user_following_id=READER_ID))
+    insert_messages(AUTHOR_ID, 1, timeline_size)
+    db.session.commit()
+
+
+def insert_messages(user_id, first_id, count):
+    start = datetime(2020, 1, 1)
+    for offset in range(0, count, BATCH_SIZE):
+        ids = range(first_id + offset, first_id + min(offset + BATCH_SIZE, count))
+        db.session.execute(Message.__table__.insert(), [
+            {'id': i, 'text': f"warble {i}", 'user_id': user_id,
+             'timestamp': start + timedelta(seconds=i)}
+            for i in ids
+        ])
+
+
+def add_likes(have, want):
+    """Have the reader like the stranger's messages until there are `want`."""
+
+    first_id = 1000000 + have
+    insert_messages(STRANGER_ID, first_id, want - have)
+    for offset in range(0, want - have, BATCH_SIZE):
+        ids = range(first_id + offset, first_id + min(offset + BATCH_SIZE, want - have))
+        db.session.execute(Likes.__table__.insert(), [
+            {'user_id': READER_ID, 'message_id': i} for i in ids
+        ])
+    counters.reconcile()
+    db.session.commit()
+
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute("ANALYZE")
+        db.session.commit()
+
+
+def time_homepage(repeat):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = READER_ID
+
+    client.get("/")  # warm up caches and connections
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        resp = client.get("/")
+        times.append((time.perf_counter() - start) * 1000)
+        assert resp.status_code == 200
+
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--likes', type=int, nargs='+',
+                        default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with app.app_context():
+        setup(app.config['TIMELINE_PAGE_SIZE'])
+
+        print(f"GET / ({db.engine.dialect.name}, {args.repeat} runs each)")
+        print(f"{'likes':>10}{'p50 ms':>10}{'p95 ms':>10}")
+
+        have = 0
+        for want in sorted(args.likes):
+            add_likes(have, want)
+            have = want
+
+            times = sorted(time_homepage(args.repeat))
+            p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+            print(f"{want:>10}{statistics.median(times):10.2f}{p95:10.2f}")
+
+
+if __name__ == '__main__':
+    main()
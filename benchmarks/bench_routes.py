@@ -0,0 +1,342 @@
+"""Load-test Warbler's routes and save the numbers as JSON.
+
+Seeds a scratch database with a synthetic dataset (generator/create_csvs.py
++ bulk_load.py) at the chosen scale, then drives each route through the
+Flask test client as randomly chosen logged-in users. For each route it
+reports latency percentiles (p50/p95/p99), throughput, and the SQL queries
+and rows fetched per request.
+
+Queries and rows come from the X-DB-Stats header that instrumentation.py
+adds to every response. Rows are only known on PostgreSQL (they show as null
+on SQLite).
+
+It runs against BENCH_DATABASE_URL (default postgresql:///warbler-bench),
+which seeding wipes, so its name must end in -bench. E.g.:
+
+    createdb warbler-bench
+    python benchmarks/bench_routes.py \\
+        --users 10000 --messages 100000 --follows 200000 --likes 100000 \\
+        --out results/$(git rev-parse --short HEAD).json
+
+Reuse the seeded data for later runs with --no-seed, and compare two runs
+with --compare:
+
+    python benchmarks/bench_routes.py --no-seed --out after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'generator'))
+
+from benchdb import require_bench_database, use_bench_database  # noqa: E402
+
+use_bench_database()
+os.environ['QUERY_STATS_HEADERS'] = 'true'
+
+from app import app, CURR_USER_KEY  # noqa: E402
+from models import db, User, Message  # noqa: E402
+import bulk_load  # noqa: E402
+import counters  # noqa: E402
+import create_csvs  # noqa: E402
+import timeline  # noqa: E402
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+JSON = {'Accept': 'application/json'}
+
+
+##############################################################################
+# Seeding
+
+
+def seed(args):
+    """Replace the database's contents with a generated dataset."""
+
+    opts = dict(users=args.users, messages=args.messages, follows=args.follows,
+                likes=args.likes, alpha=args.alpha, seed=args.seed,
+                until=datetime(2020, 1, 1), out=tempfile.mkdtemp(prefix='warbler-'))
+
+    print(f"Generating {args.users} users, {args.messages} messages, "
+          f"{args.follows} follows, {args.likes} likes...")
+    create_csvs.generate(opts, processes=args.processes)
+
+    require_bench_database(db.engine.url)
+    db.drop_all()
+    db.create_all()
+    with open(os.devnull, 'w') as quiet:
+        bulk_load.load(opts['out'], batch_size=50000, out=quiet)
+    shutil.rmtree(opts['out'])
+    counters.reconcile()
+    db.session.commit()
+
+    if timeline.enabled():
+        print("Building timelines...")
+        timeline.rebuild()
+        db.session.commit()
+
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute("ANALYZE")
+        db.session.commit()
+
+
+##############################################################################
+# Scenarios: each makes one request as a logged-in user
+
+
+def scenario_homepage(client, rng, user_id, ids):
+    return client.get("/")
+
+
+def scenario_users(client, rng, user_id, ids):
+    return client.get("/users")
+
+
+def scenario_users_search(client, rng, user_id, ids):
+    return client.get(f"/users?q={rng.choice(ids.search_terms)}")
+
+
+def scenario_user_show(client, rng, user_id, ids):
+    return client.get(f"/users/{rng.randint(1, ids.users)}")
+
+
+def scenario_following(client, rng, user_id, ids):
+    return client.get(f"/users/{rng.randint(1, ids.users)}/following")
+
+
+def scenario_followers(client, rng, user_id, ids):
+    return client.get(f"/users/{rng.randint(1, ids.users)}/followers")
+
+
+def scenario_likes(client, rng, user_id, ids):
+    return client.get(f"/users/{rng.randint(1, ids.users)}/likes")
+
+
+def scenario_message_show(client, rng, user_id, ids):
+    return client.get(f"/messages/{rng.randint(1, ids.messages)}")
+
+
+def scenario_toggle_like(client, rng, user_id, ids):
+    return client.post(f"/messages/{rng.randint(1, ids.messages)}/like", headers=JSON)
+
+
+def scenario_post_message(client, rng, user_id, ids):
+    return client.post("/messages/new", data={'text': f"load test {rng.random()}"})
+
+
+def scenario_login(client, rng, user_id, ids):
+    return client.post("/login", data={'username': ids.usernames[user_id],
+                                       'password': 'password'})
+
+
+SCENARIOS = {
+    'homepage': scenario_homepage,
+    'users': scenario_users,
+    'users_search': scenario_users_search,
+    'user_show': scenario_user_show,
+    'following': scenario_following,
+    'followers': scenario_followers,
+    'likes': scenario_likes,
+    'message_show': scenario_message_show,
+    'toggle_like': scenario_toggle_like,
+    'post_message': scenario_post_message,
+    'login': scenario_login,
+}
+
+
+class Ids:
+    """What scenarios need to know about the seeded data."""
+
+    def __init__(self, rng, sample_size=1000):
+        self.users = db.session.query(db.func.max(User.id)).scalar() or 0
+        self.messages = db.session.query(db.func.max(Message.id)).scalar() or 0
+
+        sample = (db.session
+                  .query(User.id, User.username)
+                  .filter(User.id.in_([rng.randint(1, self.users)
+                                       for _ in range(sample_size)]))
+                  .all())
+        self.user_ids = [user_id for user_id, _ in sample]
+        self.usernames = dict(sample)
+        self.search_terms = [username[:3] for _, username in sample]
+
+
+##############################################################################
+# Measuring
+
+
+def db_stats(resp):
+    """Parse the X-DB-Stats header: {'queries': 4, 'time_ms': 3.18, ...}."""
+
+    fields = (item.split('=') for item in resp.headers['X-DB-Stats'].split(', '))
+    return {key: float(value) for key, value in fields}
+
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_scenario(name, requests, threads, ids, seed):
+    """Make `requests` requests for one scenario, spread over `threads`."""
+
+    scenario = SCENARIOS[name]
+    samples = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(index, count):
+        rng = random.Random(f"{seed}:{name}:{index}")
+        client = app.test_client()
+        mine = []
+        failed = 0
+
+        for _ in range(count):
+            user_id = rng.choice(ids.user_ids)
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            started = time.perf_counter()
+            resp = scenario(client, rng, user_id, ids)
+            elapsed = time.perf_counter() - started
+
+            if resp.status_code >= 400:
+                failed += 1
+            stats = db_stats(resp)
+            mine.append((elapsed * 1000, stats['queries'], stats.get('rows')))
+
+        with lock:
+            samples.extend(mine)
+            errors.append(failed)
+
+    per_thread = [requests // threads + (i < requests % threads) for i in range(threads)]
+    workers = [threading.Thread(target=worker, args=(i, n)) for i, n in enumerate(per_thread)]
+
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    wall = time.perf_counter() - started
+
+    latencies = sorted(ms for ms, _, _ in samples)
+    rows = [r for _, _, r in samples]
+
+    return {
+        'requests': len(samples),
+        'errors': sum(errors),
+        'rps': len(samples) / wall if wall else 0,
+        'mean_ms': sum(latencies) / len(latencies),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'queries_per_request': sum(q for _, q, _ in samples) / len(samples),
+        'max_queries': int(max(q for _, q, _ in samples)),
+        'rows_per_request': (None if None in rows else sum(rows) / len(rows)),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+##############################################################################
+# Reporting
+
+
+def print_results(results, baseline=None):
+    base = (baseline or {}).get('routes', {})
+
+    print(f"{'route':<14}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}"
+          f"{'queries':>9}{'rows':>9}{'errors':>8}")
+
+    for name, r in results['routes'].items():
+        rows = '-' if r['rows_per_request'] is None else f"{r['rows_per_request']:.0f}"
+        print(f"{name:<14}{r['p50_ms']:9.2f}{r['p95_ms']:9.2f}{r['p99_ms']:9.2f}"
+              f"{r['rps']:9.1f}{r['queries_per_request']:9.1f}{rows:>9}{r['errors']:8}")
+
+        if name in base:
+            b = base[name]
+            change = ["{}{:+.0%}".format(key.split('_')[0], r[key] / b[key] - 1)
+                      for key in ('p50_ms', 'p95_ms', 'p99_ms') if b[key]]
+            change.append(f"queries {r['queries_per_request'] - b['queries_per_request']:+.1f}")
+            print(f"{'':<14}vs {baseline.get('commit') or 'baseline'}: {', '.join(change)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--follows', type=int, default=20000)
+    parser.add_argument('--likes', type=int, default=10000)
+    parser.add_argument('--alpha', type=float, default=1.0)
+    parser.add_argument('--processes', type=int, default=1,
+                        help="processes for generating the dataset")
+    parser.add_argument('--no-seed', action='store_true',
+                        help="reuse the data already in the database")
+    parser.add_argument('--routes', nargs='+', choices=sorted(SCENARIOS),
+                        default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200,
+                        help="requests per route")
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="save results to this JSON file")
+    parser.add_argument('--compare', help="JSON file from an earlier run to compare with")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if not args.no_seed:
+            seed(args)
+
+        ids = Ids(random.Random(args.seed))
+        dataset = {'users': ids.users, 'messages': ids.messages}
+
+    results = {
+        'commit': git_commit(),
+        'run_at': datetime.utcnow().isoformat(),
+        'database': db.engine.dialect.name,
+        'dataset': dataset,
+        'threads': args.threads,
+        'requests_per_route': args.requests,
+        'config': {key: app.config[key]
+                   for key in ('TIMELINE_FANOUT', 'TIMELINE_PAGE_SIZE',
+                               'USERS_PER_PAGE', 'BCRYPT_LOG_ROUNDS')},
+        'routes': {},
+    }
+
+    for name in args.routes:
+        # one untimed request first, to warm connections and caches
+        run_scenario(name, 1, 1, ids, args.seed)
+        results['routes'][name] = run_scenario(name, args.requests, args.threads,
+                                               ids, args.seed)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print_results(results, baseline)
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Benchmark username search: indexed, ranked search vs. the old LIKE scan.
+
+Fills the users table up to --users rows (1M by default) and times both
+search paths for a set of search terms taken from real usernames.
+
+It writes to BENCH_DATABASE_URL (default postgresql:///warbler-bench),
+whose name must end in -bench. E.g.:
+
+    createdb warbler-bench
+    python benchmarks/bench_user_search.py
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from benchdb import require_bench_database, use_bench_database  # noqa: E402
+
+use_bench_database()
+
+from app import app  # noqa: E402
+from models import db, User  # noqa: E402
+from search import search_users  # noqa: E402
+
+BATCH_SIZE = 10000
+
+
+def fill_users(target):
+    """Insert synthetic users until there are `target` of them."""
+
+    existing = User.query.count()
+    if existing >= target:
+        return
+
+    print(f"Adding {target - existing} users...")
+
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(
+            "INSERT INTO users (username, email, password) "
+            "SELECT 'u' || substr(md5(i::text), 1, 10) || i, "
+            "       'u' || i || '@bench.test', 'unused' "
+            "FROM generate_series(:start, :stop) AS i",
+            {'start': existing + 1, 'stop': target})
+    else:
+        users = User.__table__
+        for start in range(existing + 1, target + 1, BATCH_SIZE):
+            stop = min(start + BATCH_SIZE, target + 1)
+            db.session.execute(users.insert(), [
+                {'username': f"u{random.getrandbits(40):010x}{i}",
+                 'email': f"u{i}@bench.test",
+                 'password': 'unused'}
+                for i in range(start, stop)
+            ])
+
+    db.session.commit()
+
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute("ANALYZE users")
+        db.session.commit()
+
+
+def pick_terms(count, seed):
+    """Pick search terms: pieces of real usernames, plus some misses."""
+
+    rng = random.Random(seed)
+    sample = [username for (username,) in
+              db.session.query(User.username).limit(count * 10)]
+
+    terms = []
+    for username in rng.sample(sample, min(count, len(sample))):
+        start = rng.randrange(0, max(len(username) - 4, 1))
+        terms.append(username[start:start + rng.randint(3, 5)])
+
+    terms += ['zzzzzz', 'no-such-user']
+    return terms
+
+
+def time_it(fn, repeat):
+    """Run fn `repeat` times; return each run's time in milliseconds."""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--terms', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with app.app_context():
+        require_bench_database(db.engine.url)
+        db.create_all()
+        fill_users(args.users)
+        terms = pick_terms(args.terms, args.seed)
+
+        def old_like(term):
+            return User.query.filter(User.username.like(f"%{term}%")).all()
+
+        results = {'LIKE scan (old)': [], 'search_users (new)': []}
+        for term in terms:
+            results['LIKE scan (old)'] += time_it(lambda: old_like(term), args.repeat)
+            results['search_users (new)'] += time_it(lambda: search_users(term), args.repeat)
+
+        print(f"{User.query.count()} users, {len(terms)} terms, "
+              f"{args.repeat} runs each ({db.engine.dialect.name})")
+        print(f"{'':22}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        for name, times in results.items():
+            print(f"{name:22}{statistics.median(times):10.1f}"
+                  f"{percentile(times, 95):10.1f}{max(times):10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""The scratch database for benchmarks that wipe theirs.
+
+Seeding benchmarks drop everything in the database they run against, so
+they never inherit DATABASE_URL (which may well point at a dev database).
+They take BENCH_DATABASE_URL instead, default postgresql:///warbler-bench,
+and refuse to run unless the database's name ends in -bench or _bench.
+"""
+
+import os
+import sys
+
+from sqlalchemy.engine.url import make_url
+
+DEFAULT_URL = 'postgresql:///warbler-bench'
+SUFFIXES = ('-bench', '_bench')
+
+
+def is_bench_database(url):
+    """Is `url`'s database clearly a throwaway benchmark one?"""
+
+    name = make_url(str(url)).database or ''
+    name = os.path.splitext(os.path.basename(name))[0]
+    return name.endswith(SUFFIXES)
+
+
+def require_bench_database(url):
+    """Exit unless `url` names a benchmark database."""
+
+    if not is_bench_database(url):
+        sys.exit(f"Refusing to wipe {make_url(str(url))!r}: benchmark databases "
+                 f"must be named *-bench (set BENCH_DATABASE_URL).")
+
+
+def use_bench_database():
+    """Point the app at BENCH_DATABASE_URL; call before importing app."""
+
+    url = os.environ.get('BENCH_DATABASE_URL', DEFAULT_URL)
+    require_bench_database(url)
+    os.environ['DATABASE_URL'] = url
+    return url
@@ -0,0 +1,198 @@
+"""Check that no route's queries fall back to sequential scans.
+
+Builds the schema with the migrations on a scratch PostgreSQL database,
+seeds it with a large synthetic dataset, then requests each route through
+the Flask test client while recording every SELECT it runs. Each recorded
+statement is EXPLAINed with its real parameters; if any plan has a Seq Scan
+on one of the big tables, the check prints the offending plans and exits 1.
+
+    createdb warbler-bench
+    python benchmarks/check_query_plans.py
+
+The database is wiped first, so it only runs against BENCH_DATABASE_URL
+(default postgresql:///warbler-bench), whose name must end in -bench.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from benchdb import require_bench_database, use_bench_database  # noqa: E402
+
+use_bench_database()
+
+from flask_migrate import upgrade  # noqa: E402
+
+from app import app, CURR_USER_KEY  # noqa: E402
+from models import db  # noqa: E402
+import counters  # noqa: E402
+
+BIG_TABLES = {'users', 'messages', 'follows', 'likes', 'timeline_entries'}
+
+VIEWER_ID = 1
+PROFILE_ID = 2
+
+
+def routes():
+    """Every page to check: (label, url)."""
+
+    return [
+        ('homepage', '/'),
+        ('user directory', '/users'),
+        ('user search', '/users?q=user12'),
+        ('profile', f'/users/{PROFILE_ID}'),
+        ('following', f'/users/{VIEWER_ID}/following'),
+        ('followers', f'/users/{PROFILE_ID}/followers'),
+        ('likes', f'/users/{VIEWER_ID}/likes'),
+        ('message', '/messages/1'),
+    ]
+
+
+def seed(num_users, num_messages, follows_per_user, likes_per_user):
+    """Rebuild the schema from migrations and fill it with synthetic data."""
+
+    require_bench_database(db.engine.url)
+    db.session.execute("DROP SCHEMA public CASCADE")
+    db.session.execute("CREATE SCHEMA public")
+    db.session.commit()
+    upgrade()
+
+    params = {'users': num_users, 'messages': num_messages,
+              'follows': follows_per_user, 'likes': likes_per_user}
+
+    print(f"Seeding {num_users} users, {num_messages} messages, "
+          f"{follows_per_user} follows and {likes_per_user} likes per user...")
+
+    db.session.execute("""
+        INSERT INTO users (username, email, password)
+        SELECT 'user' || i, 'user' || i || '@bench.test', 'unused'
+        FROM generate_series(1, :users) AS i
+    """, params)
+
+    db.session.execute("""
+        INSERT INTO messages (text, timestamp, user_id)
+        SELECT 'warble ' || i,
+               now() - i * interval '1 minute',
+               1 + (i * 7919) % :users
+        FROM generate_series(1, :messages) AS i
+    """, params)
+
+    db.session.execute("""
+        INSERT INTO follows (user_being_followed_id, user_following_id)
+        SELECT 1 + (i + j * 7919) % :users, i
+        FROM generate_series(1, :users) AS i, generate_series(1, :follows) AS j
+        WHERE 1 + (i + j * 7919) % :users != i
+        ON CONFLICT DO NOTHING
+    """, params)
+
+    db.session.execute("""
+        INSERT INTO likes (user_id, message_id)
+        SELECT i, 1 + (i * 31 + j * 104729) % :messages
+        FROM generate_series(1, :users) AS i, generate_series(1, :likes) AS j
+        ON CONFLICT DO NOTHING
+    """, params)
+
+    counters.reconcile()
+    db.session.commit()
+
+    db.session.execute("ANALYZE")
+    db.session.commit()
+
+
+def capture_selects(url):
+    """Request `url` as the viewer; return the (statement, params) of every
+    SELECT it ran."""
+
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = VIEWER_ID
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        resp = client.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    if resp.status_code != 200:
+        raise RuntimeError(f"{url} returned {resp.status_code}")
+
+    return captured
+
+
+def seq_scans(plan):
+    """Big tables the plan (EXPLAIN FORMAT JSON node) scans sequentially."""
+
+    found = []
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') in BIG_TABLES:
+        found.append(plan['Relation Name'])
+
+    for child in plan.get('Plans', []):
+        found += seq_scans(child)
+
+    return found
+
+
+def explain(statement, parameters):
+    conn = db.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        (result,) = cursor.fetchone()
+        if isinstance(result, str):
+            result = json.loads(result)
+        return result[0]['Plan']
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--follows-per-user', type=int, default=20)
+    parser.add_argument('--likes-per-user', type=int, default=10)
+    parser.add_argument('--no-seed', action='store_true',
+                        help="reuse the data from a previous run")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            sys.exit("Query plan checks need PostgreSQL.")
+
+        if not args.no_seed:
+            seed(args.users, args.messages, args.follows_per_user, args.likes_per_user)
+
+        failures = 0
+        for label, url in routes():
+            statements = capture_selects(url)
+            bad = [(statement, parameters, scans)
+                   for statement, parameters in statements
+                   for scans in [seq_scans(explain(statement, parameters))]
+                   if scans]
+
+            status = "FAIL" if bad else "ok"
+            print(f"{status:5}{label:16}{url:28}{len(statements)} queries")
+
+            for statement, parameters, scans in bad:
+                failures += 1
+                print(f"      Seq Scan on {', '.join(scans)}:")
+                print("      " + " ".join(statement.split()))
+                print(f"      params: {parameters}")
+
+        if failures:
+            sys.exit(f"{failures} queries scan big tables sequentially.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""Bulk-load Warbler's CSV files into the database.
+
+Streams each CSV in batches instead of reading it whole, and writes each
+batch in its own transaction: with PostgreSQL's COPY when available, or an
+executemany INSERT elsewhere (SQLite). Values are converted to their column
+types (ids, timestamps) before they reach the database.
+
+Progress is recorded in a `bulk_load_progress` table in the same
+transaction as each batch, so after a failure `--resume` picks up at the
+first batch that didn't commit, without loading any row twice.
+
+Users and messages get their ids from their row number in the CSV (unless
+the CSV has an id column), which is what the user_id / message_id columns
+in the other CSVs refer to.
+
+Run it like:
+
+    python bulk_load.py --dir generator --batch-size 50000
+    python bulk_load.py --dir generator --resume    # after a failure
+"""
+
+import argparse
+import csv
+import io
+import os
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import Column, Integer, MetaData, Table, Text
+
+from models import db
+
+# Kept out of the app's metadata: it's bookkeeping for this tool, not part
+# of Warbler's schema.
+progress_table = Table(
+    'bulk_load_progress', MetaData(),
+    Column('source', Text, primary_key=True),
+    Column('rows_done', Integer, nullable=False),
+)
+
+
+def parse_timestamp(value):
+    """Parse the timestamps the CSV generator writes (str(datetime))."""
+
+    for fmt in ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S",
+                "%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+
+    raise ValueError(f"Unrecognized timestamp: {value!r}")
+
+
+Source = namedtuple('Source', ['table', 'filename', 'numbered', 'columns'])
+
+# Load order matters: later files refer to rows of earlier ones.
+SOURCES = [
+    Source('users', 'users.csv', True, [
+        ('email', str), ('username', str), ('image_url', str), ('password', str),
+        ('bio', str), ('header_image_url', str), ('location', str),
+    ]),
+    Source('messages', 'messages.csv', True, [
+        ('text', str), ('timestamp', parse_timestamp), ('user_id', int),
+    ]),
+    Source('follows', 'follows.csv', False, [
+        ('user_being_followed_id', int), ('user_following_id', int),
+    ]),
+    Source('likes', 'likes.csv', False, [
+        ('user_id', int), ('message_id', int),
+    ]),
+]
+
+
+def read_rows(path, source, skip=0):
+    """Yield type-converted row dicts from a CSV, skipping the first `skip`."""
+
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        has_id = 'id' in (reader.fieldnames or [])
+
+        for number, record in enumerate(islice(reader, skip, None), skip + 1):
+            row = {name: convert(record[name]) for name, convert in source.columns}
+            if source.numbered:
+                row['id'] = int(record['id']) if has_id else number
+            yield row
+
+
+def batches(rows, size):
+    """Group an iterator of rows into lists of up to `size`."""
+
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def copy_rows(conn, table, names, batch):
+    """Write a batch with PostgreSQL's COPY ... FROM STDIN."""
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in batch:
+        writer.writerow(['\\N' if row[name] is None else row[name] for name in names])
+    buf.seek(0)
+
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table.name} ({', '.join(names)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+        buf)
+
+
+def insert_rows(conn, table, names, batch):
+    """Write a batch with a plain executemany INSERT."""
+
+    conn.execute(table.insert(), batch)
+
+
+def save_progress(conn, source, rows_done):
+    updated = conn.execute(progress_table.update()
+                           .where(progress_table.c.source == source)
+                           .values(rows_done=rows_done)).rowcount
+    if not updated:
+        conn.execute(progress_table.insert().values(source=source, rows_done=rows_done))
+
+
+def load_progress(conn):
+    return {row.source: row.rows_done for row in conn.execute(progress_table.select())}
+
+
+def reset_sequences(conn):
+    """Move serial id sequences past the explicit ids we loaded (PostgreSQL)."""
+
+    for table in ('users', 'messages'):
+        conn.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                     f"coalesce((SELECT max(id) FROM {table}), 0) + 1, false)")
+
+
+def load(directory, batch_size=10000, resume=False, out=sys.stdout):
+    """Load every CSV in `directory` that a Source describes.
+
+    Returns a dict of rows loaded per table.
+    """
+
+    engine = db.engine
+    use_copy = engine.dialect.name == 'postgresql'
+    write = copy_rows if use_copy else insert_rows
+    loaded = {}
+
+    progress_table.create(engine, checkfirst=True)
+
+    with engine.connect() as conn:
+        if not resume:
+            conn.execute(progress_table.delete())
+        progress = load_progress(conn)
+
+        for source in SOURCES:
+            path = os.path.join(directory, source.filename)
+            if not os.path.exists(path):
+                continue
+
+            table = db.metadata.tables[source.table]
+            names = (['id'] if source.numbered else []) + [n for n, _ in source.columns]
+            done = progress.get(source.filename, 0)
+            if done:
+                print(f"{source.table}: resuming after row {done}", file=out)
+
+            started = time.monotonic()
+            count = 0
+            for batch in batches(read_rows(path, source, skip=done), batch_size):
+                with conn.begin():
+                    write(conn, table, names, batch)
+                    done += len(batch)
+                    save_progress(conn, source.filename, done)
+
+                count += len(batch)
+                elapsed = time.monotonic() - started
+                print(f"{source.table}: {done} rows "
+                      f"({count / elapsed if elapsed else 0:,.0f} rows/sec)", file=out)
+
+            loaded[source.table] = count
+
+        if use_copy:
+            with conn.begin():
+                reset_sequences(conn)
+
+    return loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load Warbler's CSV files.")
+    parser.add_argument('--dir', default='generator',
+                        help="directory holding users.csv, messages.csv, ...")
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--resume', action='store_true',
+                        help="continue a load that failed part way through")
+    parser.add_argument('--no-reconcile', action='store_true',
+                        help="skip recomputing user counters afterwards")
+    args = parser.parse_args()
+
+    from app import app
+    import counters
+
+    with app.app_context():
+        started = time.monotonic()
+        loaded = load(args.dir, batch_size=args.batch_size, resume=args.resume)
+
+        if not args.no_reconcile:
+            print("Recomputing user counters...")
+            counters.reconcile()
+            db.session.commit()
+
+        total = sum(loaded.values())
+        elapsed = time.monotonic() - started
+        print(f"Loaded {total} rows in {elapsed:.1f}s "
+              f"({total / elapsed if elapsed else 0:,.0f} rows/sec)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Small caching layer shared by Warbler's caches.
+
+A Cache is a namespaced view onto a backend that keeps hit/miss counters.
+Backends store keys with an optional TTL (in seconds):
+
+- LocalBackend: an in-process LRU bounded by key count and, optionally,
+  by the pickled size of its values (the default)
+- RedisBackend: shared across worker processes; needs the `redis` package
+
+Anything with the same get/set/delete/clear methods can be plugged in.
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalBackend:
+    """Thread-safe in-process LRU cache holding at most `max_size` keys and,
+    if `max_bytes` is set, at most that many bytes of (pickled) values."""
+
+    def __init__(self, max_size=10000, max_bytes=None):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value for `key`, or None if missing or expired."""
+
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+
+            value, expires, size = item
+            if expires is not None and expires <= time.monotonic():
+                self._remove(key)
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store `value` under `key`, evicting the least recently used keys."""
+
+        expires = time.monotonic() + ttl if ttl else None
+        size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)) if self.max_bytes else 0
+
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (value, expires, size)
+            self.bytes += size
+            while len(self._data) > self.max_size or (
+                    self.max_bytes and self.bytes > self.max_bytes and len(self._data) > 1):
+                self._remove(next(iter(self._data)))
+
+    def _remove(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.bytes -= item[2]
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self, prefix=''):
+        """Remove every key starting with `prefix`."""
+
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                self._remove(key)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisBackend:
+    """Cache backend shared by every worker process through Redis."""
+
+    def __init__(self, url):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._redis.get(key)
+        return None if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self._redis.set(key, pickle.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self._redis.delete(key)
+
+    def clear(self, prefix=''):
+        for key in self._redis.scan_iter(match=f"{prefix}*"):
+            self._redis.delete(key)
+
+
+def make_backend(url=None, max_size=10000, max_bytes=None):
+    """Build a backend from a URL: redis://... for Redis, empty for local.
+
+    Size limits only apply to local backends; bound Redis with its own
+    `maxmemory` and an LRU `maxmemory-policy`.
+    """
+
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+
+    return LocalBackend(max_size=max_size, max_bytes=max_bytes)
+
+
+class Cache:
+    """A namespace of keys in a backend, with hit/miss counters."""
+
+    def __init__(self, namespace, backend=None, ttl=None):
+        self.namespace = namespace
+        self.backend = backend if backend is not None else LocalBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def get(self, key):
+        value = self.backend.get(self._key(key))
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(self._key(key), value, ttl if ttl is not None else self.ttl)
+
+    def delete(self, key):
+        self.backend.delete(self._key(key))
+
+    def clear(self, prefix=''):
+        """Drop every key in this namespace (that starts with `prefix`)."""
+
+        self.backend.clear(prefix=f"{self.namespace}:{prefix}")
+
+    def stats(self):
+        """Hit/miss counters for this cache, e.g. for a metrics page."""
+
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
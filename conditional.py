@@ -0,0 +1,138 @@
+"""HTTP caching: conditional page requests and fingerprinted static files.
+
+Pages that can be validated cheaply compute an ETag from the versions of
+the rows they show (plus who is looking) before doing any real work:
+
+    etag = conditional.page_etag('user', user.id, user.version, ...)
+    if conditional.is_fresh(etag):
+        return conditional.not_modified(etag)
+    ...
+    return conditional.tagged(render_template(...), etag)
+
+A matching If-None-Match gets an empty 304 without loading or rendering
+anything else. ETags also cover the templates, so a deploy that changes
+them invalidates every tag.
+
+Static files linked through `static_url()` carry a content hash (?v=...)
+and are served as immutable for a year; everything else is revalidated.
+"""
+
+import hashlib
+import os
+
+from flask import current_app, make_response, request, session, url_for
+
+# Pages are per-viewer: browsers may keep them, shared caches may not, and
+# both must check back (with the ETag) before reusing them.
+PAGE_CACHE_CONTROL = 'private, no-cache'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, no-cache'
+
+_fingerprints = {}
+_templates_digest = None
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def templates_digest():
+    """Hash of every template, so ETags change when the templates do."""
+
+    global _templates_digest
+
+    if _templates_digest is None:
+        digest = hashlib.sha1()
+        root = os.path.join(current_app.root_path, current_app.template_folder)
+        for folder, _, files in sorted(os.walk(root)):
+            for name in sorted(files):
+                digest.update(_file_digest(os.path.join(folder, name)).encode())
+        _templates_digest = digest.hexdigest()
+
+    return _templates_digest
+
+
+def page_etag(*parts):
+    """An ETag for a page built from `parts` (ids, versions, viewer...)."""
+
+    digest = hashlib.sha1(templates_digest().encode())
+    digest.update(repr(parts).encode())
+    return digest.hexdigest()
+
+
+def is_fresh(etag):
+    """Does the client already have this version of the page?
+
+    Never true while flash messages are waiting: the page would show them.
+    """
+
+    return '_flashes' not in session and etag in request.if_none_match
+
+
+def not_modified(etag):
+    response = make_response('', 304)
+    return tagged(response, etag)
+
+
+def tagged(response, etag):
+    """Attach the ETag (and page cache policy) to a response."""
+
+    response = make_response(response)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = PAGE_CACHE_CONTROL
+    return response
+
+
+##############################################################################
+# Static files
+
+
+def fingerprint(filename):
+    """Short content hash of a static file, recomputed when it changes."""
+
+    path = os.path.join(current_app.static_folder, filename)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    key = (filename, stat.st_mtime, stat.st_size)
+    if key not in _fingerprints:
+        _fingerprints[key] = _file_digest(path)[:12]
+
+    return _fingerprints[key]
+
+
+def static_url(filename):
+    """URL of a static file that changes whenever its content does."""
+
+    version = fingerprint(filename)
+    if version is None:
+        return url_for('static', filename=filename)
+
+    return url_for('static', filename=filename, v=version)
+
+
+def set_cache_policy(response):
+    """Cache fingerprinted static files for good; revalidate the rest."""
+
+    if request.endpoint == 'static':
+        version = request.args.get('v')
+        immutable = (version is not None and response.status_code in (200, 304) and
+                     version == fingerprint(request.view_args['filename']))
+        response.headers['Cache-Control'] = (IMMUTABLE_CACHE_CONTROL if immutable
+                                             else REVALIDATE_CACHE_CONTROL)
+
+    elif 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = PAGE_CACHE_CONTROL
+
+    return response
+
+
+def init_app(app):
+    app.add_template_global(static_url)
+    app.after_request(set_cache_policy)
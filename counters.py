@@ -0,0 +1,163 @@
+"""Denormalized per-user counters.
+
+User.messages_count, following_count, followers_count and likes_count are
+adjusted with atomic `SET col = col + n` updates by the routes that change
+the underlying rows. Anything that writes to those tables behind the app's
+back (seed scripts, bulk deletes, manual SQL) can make them drift;
+`reconcile()` recomputes them from the source tables.
+
+None of these functions commit; they run inside the caller's transaction.
+Every user whose counters they touch has their cached identity dropped
+once that transaction commits.
+"""
+
+from sqlalchemy import func, or_, select
+
+import identity
+from models import db, Follows, Likes, Message, User
+
+COUNTER_COLUMNS = (
+    'messages_count',
+    'following_count',
+    'followers_count',
+    'likes_count',
+)
+
+
+def adjust(user_id, **deltas):
+    """Atomically add `deltas` to a user's counters.
+
+    adjust(5, followers_count=1, likes_count=-1)
+    """
+
+    _update(User.id == user_id, deltas)
+    identity.invalidate_after_commit([user_id])
+
+
+def follow_added(follower_id, followed_id):
+    """Count a new follow."""
+
+    adjust(follower_id, following_count=1)
+    adjust(followed_id, followers_count=1)
+
+
+def follow_removed(follower_id, followed_id):
+    """Count a removed follow."""
+
+    adjust(follower_id, following_count=-1)
+    adjust(followed_id, followers_count=-1)
+
+
+def message_deleted(message):
+    """Count a message about to be deleted, along with the likes it takes
+    with it."""
+
+    likers = [uid for (uid,) in (db.session
+                                 .query(Likes.user_id)
+                                 .filter(Likes.message_id == message.id))]
+
+    if likers:
+        _update(User.id.in_(likers), {'likes_count': -1})
+        identity.invalidate_after_commit(likers)
+    adjust(message.user_id, messages_count=-1)
+
+
+def user_deleted(user_id):
+    """Count a user about to be deleted.
+
+    Deleting a user cascades to their follows, messages and the likes on
+    those messages, so the counters of everyone on the other end of those
+    rows have to come down too.
+    """
+
+    followed = [uid for (uid,) in (db.session
+                                   .query(Follows.user_being_followed_id)
+                                   .filter(Follows.user_following_id == user_id))]
+    followers = [uid for (uid,) in (db.session
+                                    .query(Follows.user_following_id)
+                                    .filter(Follows.user_being_followed_id == user_id))]
+    likers = [uid for (uid,) in (db.session
+                                 .query(Likes.user_id)
+                                 .join(Message)
+                                 .filter(Message.user_id == user_id)
+                                 .filter(Likes.user_id != user_id)
+                                 .distinct())]
+
+    if followed:
+        _update(User.id.in_(followed), {'followers_count': -1})
+    if followers:
+        _update(User.id.in_(followers), {'following_count': -1})
+
+    if likers:
+        likes_lost = (select([func.count(Likes.id)])
+                      .select_from(Likes.__table__.join(Message.__table__))
+                      .where(Likes.user_id == User.id)
+                      .where(Message.user_id == user_id)
+                      .as_scalar())
+
+        (User
+         .query
+         .filter(User.id.in_(likers))
+         .update({User.likes_count: User.likes_count - likes_lost},
+                 synchronize_session=False))
+
+    identity.invalidate_after_commit(followed + followers + likers)
+
+
+def reconcile():
+    """Recompute every user's counters from the source tables.
+
+    Only rows that have drifted are rewritten. Returns how many users were
+    repaired.
+    """
+
+    actual = _actual_counts()
+    drifted = or_(*[getattr(User, name) != actual[name]
+                    for name in COUNTER_COLUMNS])
+
+    repaired = (User
+                .query
+                .filter(drifted)
+                .update({getattr(User, name): actual[name]
+                         for name in COUNTER_COLUMNS},
+                        synchronize_session=False))
+
+    if repaired:
+        identity.cache.clear()
+
+    return repaired
+
+
+def _actual_counts():
+    """Correlated subqueries counting each user's rows in the source tables."""
+
+    return {
+        'messages_count': (select([func.count(Message.id)])
+                           .where(Message.user_id == User.id)
+                           .as_scalar()),
+        'following_count': (select([func.count()])
+                            .select_from(Follows.__table__)
+                            .where(Follows.user_following_id == User.id)
+                            .as_scalar()),
+        'followers_count': (select([func.count()])
+                            .select_from(Follows.__table__)
+                            .where(Follows.user_being_followed_id == User.id)
+                            .as_scalar()),
+        'likes_count': (select([func.count(Likes.id)])
+                        .where(Likes.user_id == User.id)
+                        .as_scalar()),
+    }
+
+
+def _update(criterion, deltas):
+    """Apply counter deltas to every user matching `criterion`."""
+
+    for name in deltas:
+        if name not in COUNTER_COLUMNS:
+            raise ValueError(f"Unknown counter: {name}")
+
+    values = {getattr(User, name): getattr(User, name) + delta
+              for name, delta in deltas.items() if delta}
+
+    if values:
+        User.query.filter(criterion).update(values, synchronize_session=False)
@@ -0,0 +1,35 @@
+"""Per-request memo of whether the logged-in user follows other users.
+
+Pages that show a Follow/Unfollow button on every user card call `prime()`
+once with all the ids on the page, so the whole page costs one query. The
+`is_following()` template helper then answers from the memo, fetching any
+id it hasn't seen yet.
+"""
+
+from flask import g
+
+
+def prime(user_ids):
+    """Look up follow state for every not-yet-seen id in one query."""
+
+    if not g.get('user'):
+        return
+
+    memo = g.setdefault('follow_state', {})
+    unseen = {user_id for user_id in user_ids if user_id not in memo}
+
+    if unseen:
+        followed = g.user.following_ids_among(unseen)
+        for user_id in unseen:
+            memo[user_id] = user_id in followed
+
+
+def is_following(user):
+    """Is the logged-in user following `user` (a user or a user id)?"""
+
+    if not g.get('user'):
+        return False
+
+    user_id = getattr(user, 'id', user)
+    prime([user_id])
+    return g.follow_state[user_id]
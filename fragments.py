@@ -0,0 +1,91 @@
+"""Cached HTML fragments for message and user cards.
+
+Cards are rendered from their own templates (templates/fragments/) and kept
+in a Cache keyed on everything they show:
+
+- the object's id
+- the version of whatever user data they display (User.version, bumped on
+  profile edits, so edited profiles get new keys instead of stale cards)
+- the viewer-relative flags (liked, following, own message...), so one
+  viewer's buttons are never shown to another
+
+Messages can't be edited, so a message card only goes stale when the
+message is deleted: `forget_message()` drops it then. Liking or following
+changes a flag and so picks a different key.
+
+Card templates must only use what they are passed, never `g`.
+"""
+
+from flask import render_template
+from markupsafe import Markup
+
+from cache import Cache, make_backend
+
+cache = Cache('fragments')
+
+# Viewer relationships a message page can render with (see message_detail)
+MESSAGE_VIEWERS = ('anon', 'own', 'following', 'other')
+
+
+def init_app(app):
+    """Set up the fragment cache from the app's config."""
+
+    cache.backend = make_backend(app.config.get('FRAGMENT_CACHE_URL'),
+                                 max_size=app.config.get('FRAGMENT_CACHE_SIZE', 20000))
+    cache.ttl = app.config.get('FRAGMENT_CACHE_TTL', 600)
+
+    for helper in (message_card, message_detail, user_card):
+        app.add_template_global(helper)
+
+
+def _render(key, template, **context):
+    html = cache.get(key)
+    if html is None:
+        html = render_template(template, **context)
+        cache.set(key, html)
+
+    return Markup(html)
+
+
+def _message_card_key(message_id, author_version, like_button, liked):
+    return f"message:{message_id}:{author_version}:{int(like_button)}{int(liked)}"
+
+
+def _message_detail_key(message_id, author_version, viewer):
+    return f"message-detail:{message_id}:{author_version}:{viewer}"
+
+
+def message_card(msg, author=None, like_button=False, liked=False):
+    """A message as listed in timelines; `author` defaults to msg.user."""
+
+    author = author or msg.user
+    liked = like_button and liked
+    return _render(_message_card_key(msg.id, author.version, like_button, liked),
+                   'fragments/message_card.html',
+                   msg=msg, author=author, like_button=like_button, liked=liked)
+
+
+def message_detail(msg, viewer):
+    """A message on its own page; `viewer` is one of MESSAGE_VIEWERS."""
+
+    return _render(_message_detail_key(msg.id, msg.user.version, viewer),
+                   'fragments/message_detail.html',
+                   msg=msg, author=msg.user, viewer=viewer)
+
+
+def user_card(user, follow_button=None):
+    """A user card; `follow_button` is 'follow', 'unfollow' or None."""
+
+    return _render(f"user:{user.id}:{user.version}:{follow_button}",
+                   'fragments/user_card.html',
+                   user=user, follow_button=follow_button)
+
+
+def forget_message(message_id, author_version):
+    """Drop every cached card of a message (e.g. when it is deleted)."""
+
+    for like_button, liked in ((False, False), (True, False), (True, True)):
+        cache.delete(_message_card_key(message_id, author_version, like_button, liked))
+
+    for viewer in MESSAGE_VIEWERS:
+        cache.delete(_message_detail_key(message_id, author_version, viewer))
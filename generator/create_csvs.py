@@ -2,14 +2,34 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. a big dataset for load
+testing:
+
+    python generator/create_csvs.py --users 1000000 --messages 10000000 \\
+        --follows 20000000 --likes 20000000 --processes 8 --out /tmp/warbler-big
+    python bulk_load.py --dir /tmp/warbler-big
+
+Everything is generated offline from a seeded RNG, so the same flags always
+produce the same files, however many processes share the work. Rows are
+streamed to disk in fixed-size chunks; nothing proportional to the number of
+users is held in memory (in particular, not the list of all user pairs).
+
+Popularity follows a power law: a few users get most of the followers, post
+most of the messages, and a few messages get most of the likes.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import shutil
+from datetime import datetime
+from math import gcd
+from multiprocessing import Pool
+from random import Random
+
 from faker import Faker
+from faker.providers.lorem.en_US import Provider as LoremProvider
+
 from helpers import get_random_datetime
 
 MAX_WARBLER_LENGTH = 140
@@ -17,14 +37,18 @@ MAX_WARBLER_LENGTH = 140
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+# bcrypt hash of "password"
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-fake = Faker()
+# Rows generated per unit of work; fixed so the output doesn't depend on
+# how many processes there are.
+CHUNK_SIZE = 50000
 
-# Generate random profile image URLs to use for users
+WORDS = LoremProvider.word_list
+
+# Profile image URLs (not fetched; browsers load them when pages render)
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +56,230 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+# Header images that ship with the app, so generating needs no network
 
 header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+    "/static/images/warbler-hero.jpg",
+    "/static/images/signed-out-home.jpg",
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+
+##############################################################################
+# Power-law sampling
+
+
+def sample_rank(rng, n, alpha):
+    """Pick a popularity rank in 1..n, where rank r has weight ~ 1/r**alpha.
+
+    Uses the inverse CDF of the continuous (bounded Pareto) approximation,
+    so it needs no table of weights.
+    """
+
+    u = rng.random()
+    if alpha == 1:
+        rank = n ** u
+    else:
+        rank = ((n ** (1 - alpha) - 1) * u + 1) ** (1 / (1 - alpha))
+
+    return min(int(rank), n)
+
+
+def scatter(rank, n, salt):
+    """Map a popularity rank to an id in 1..n, so popular ids aren't just 1, 2, 3...
+
+    Multiplying by a step coprime to n visits every id exactly once.
+    """
+
+    step = 7919 + salt
+    while gcd(step, n) != 1:
+        step += 1
+
+    return (rank - 1) * step % n + 1
+
+
+def popular_id(rng, n, alpha, salt):
+    return scatter(sample_rank(rng, n, alpha), n, salt)
+
+
+##############################################################################
+# Chunk generators: each writes rows [start, stop) of one file, no header
+
+
+def chunk_rng(opts, table, index):
+    """An RNG for one chunk, derived only from the seed and chunk position."""
+
+    return Random(f"{opts['seed']}:{table}:{index}")
+
+
+def users_chunk(writer, rng, opts, start, stop):
+    fake = Faker()
+    fake.seed_instance(rng.getrandbits(32))
+
+    for user_id in range(start, stop):
+        username = f"{fake.user_name()}{user_id}"
+        writer.writerow([
+            f"{username}@{fake.free_email_domain()}",
+            username,
+            rng.choice(image_urls),
+            PASSWORD_HASH,
+            fake.sentence(),
+            rng.choice(header_image_urls),
+            fake.city(),
+        ])
+
+
+def messages_chunk(writer, rng, opts, start, stop):
+    for _ in range(start, stop):
+        words = rng.choices(WORDS, k=rng.randint(4, 24))
+        text = (" ".join(words).capitalize() + ".")[:MAX_WARBLER_LENGTH]
+        writer.writerow([
+            text,
+            get_random_datetime(rng=rng, now=opts['until']),
+            popular_id(rng, opts['users'], opts['alpha'], salt=1),
+        ])
+
+
+def pairs_chunk(writer, rng, quota, pick_pair):
+    """Write `quota` distinct pairs made by `pick_pair(rng)`.
+
+    Only this chunk's pairs are remembered, which is enough: chunks own
+    disjoint ranges of the first id, so they can't produce the same pair.
+    """
+
+    seen = set()
+    attempts = 0
+    while len(seen) < quota and attempts < quota * 20:
+        attempts += 1
+        pair = pick_pair(rng)
+        if pair is not None and pair not in seen:
+            seen.add(pair)
+            writer.writerow(pair)
+
+
+def share(total, start, stop, n):
+    """This chunk's share of `total` rows, split evenly over ids 1..n."""
+
+    return total * (stop - 1) // n - total * (start - 1) // n
+
+
+def follows_chunk(writer, rng, opts, start, stop):
+    n = opts['users']
+
+    def pick_pair(rng):
+        follower = rng.randrange(start, stop)
+        followed = popular_id(rng, n, opts['alpha'], salt=0)
+        return None if followed == follower else (followed, follower)
+
+    pairs_chunk(writer, rng, share(opts['follows'], start, stop, n), pick_pair)
+
+
+def likes_chunk(writer, rng, opts, start, stop):
+    def pick_pair(rng):
+        return (rng.randrange(start, stop),
+                popular_id(rng, opts['messages'], opts['alpha'], salt=2))
+
+    pairs_chunk(writer, rng, share(opts['likes'], start, stop, opts['users']), pick_pair)
+
+
+# table: (filename, headers, chunk generator, how many ids the chunks split)
+TABLES = {
+    'users': ('users.csv', USERS_CSV_HEADERS, users_chunk, 'users'),
+    'messages': ('messages.csv', MESSAGES_CSV_HEADERS, messages_chunk, 'messages'),
+    'follows': ('follows.csv', FOLLOWS_CSV_HEADERS, follows_chunk, 'users'),
+    'likes': ('likes.csv', LIKES_CSV_HEADERS, likes_chunk, 'users'),
+}
+
+
+def generate_chunk(task):
+    """Write one chunk of one table to its own part file."""
+
+    table, index, start, stop, opts, part_path = task
+    generate = TABLES[table][2]
+
+    with open(part_path, 'w', newline='') as part:
+        generate(csv.writer(part), chunk_rng(opts, table, index), opts, start, stop)
+
+    return part_path
+
+
+##############################################################################
+# Driver
+
+
+def plan(table, opts, parts_dir):
+    """Split a table into chunk tasks over ids 1..n."""
+
+    n = opts[TABLES[table][3]]
+    return [
+        (table, index, start, min(start + CHUNK_SIZE, n + 1), opts,
+         os.path.join(parts_dir, f"{table}.{index:06d}.csv"))
+        for index, start in enumerate(range(1, n + 1, CHUNK_SIZE))
+    ]
+
+
+def generate(opts, processes=1):
+    """Generate every requested CSV into opts['out']."""
+
+    out = opts['out']
+    parts_dir = os.path.join(out, '.parts')
+    os.makedirs(parts_dir, exist_ok=True)
+
+    tables = ['users', 'messages', 'follows'] + (['likes'] if opts['likes'] else [])
+
+    pool = Pool(processes) if processes > 1 else None
+    try:
+        for table in tables:
+            filename, headers = TABLES[table][:2]
+            tasks = plan(table, opts, parts_dir)
+            parts = pool.imap(generate_chunk, tasks) if pool else map(generate_chunk, tasks)
+
+            with open(os.path.join(out, filename), 'w', newline='') as f:
+                csv.writer(f).writerow(headers)
+                for part_path in parts:
+                    with open(part_path, newline='') as part:
+                        shutil.copyfileobj(part, f)
+                    os.remove(part_path)
+
+            print(f"Wrote {os.path.join(out, filename)}")
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate CSVs of random data for Warbler.")
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=5000)
+    parser.add_argument('--likes', type=int, default=0,
+                        help="also write likes.csv with this many likes")
+    parser.add_argument('--alpha', type=float, default=1.0,
+                        help="power-law exponent for popularity (higher is more skewed)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--until', default=datetime.utcnow().strftime('%Y-%m-%d'),
+                        help="latest message date (YYYY-MM-DD, UTC); fix it for repeatable output")
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--out', default='generator')
+    args = parser.parse_args()
+
+    if args.follows > args.users * (args.users - 1):
+        parser.error("more follows requested than there are pairs of users")
+
+    opts = dict(
+        users=args.users,
+        messages=args.messages,
+        follows=args.follows,
+        likes=args.likes,
+        alpha=args.alpha,
+        seed=args.seed,
+        until=datetime.strptime(args.until, '%Y-%m-%d'),
+        out=args.out,
+    )
+
+    generate(opts, processes=args.processes)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,17 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+import random
+from datetime import datetime, timedelta
 
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+def get_random_datetime(year_gap=2, rng=random, now=None):
+    """Get a random naive UTC datetime within the last few years.
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+    Pass a seeded `rng` and a fixed `now` for repeatable results; the
+    machine's timezone doesn't enter into it.
+    """
 
-    return datetime.fromtimestamp(random_timestamp)
+    now = now or datetime.utcnow()
+    span = timedelta(days=365 * year_gap).total_seconds()
+
+    return now - timedelta(seconds=rng.uniform(0, span))
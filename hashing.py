@@ -0,0 +1,144 @@
+"""Password hashing on a bounded worker pool.
+
+bcrypt is deliberately slow, CPU-bound work. Running it inline on request
+threads lets a burst of logins starve every other request, so hashes and
+checks run on a small dedicated pool instead:
+
+- at most PASSWORD_HASH_WORKERS hashes run at once
+- at most PASSWORD_HASH_MAX_QUEUE more wait for a worker; past that (or after
+  waiting PASSWORD_HASH_QUEUE_TIMEOUT seconds for a slot) callers get
+  HashingOverloaded instead of piling up
+- BCRYPT_LOG_ROUNDS sets the work factor for new hashes; `needs_rehash()`
+  spots hashes made with a different one so they can be upgraded at login
+
+`stats()` reports queue depth and wait/hash latency.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_bcrypt import Bcrypt
+
+bcrypt = Bcrypt()
+
+DEFAULT_ROUNDS = 12
+
+
+class HashingOverloaded(Exception):
+    """Too many password hashes are already queued."""
+
+
+class HashingPool:
+    """A capped thread pool for bcrypt, with queue and latency metrics."""
+
+    def __init__(self, workers=2, max_queue=64, queue_timeout=5, rounds=DEFAULT_ROUNDS):
+        self.rounds = rounds
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.total_hash = 0.0
+        self.max_wait = 0.0
+
+    def run(self, fn, *args):
+        """Run `fn(*args)` on the pool and wait for its result."""
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HashingOverloaded()
+
+        with self._lock:
+            self.queued += 1
+        submitted = time.monotonic()
+
+        def timed():
+            started = time.monotonic()
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+            try:
+                return fn(*args)
+            finally:
+                finished = time.monotonic()
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+                    wait = started - submitted
+                    self.total_wait += wait
+                    self.max_wait = max(self.max_wait, wait)
+                    self.total_hash += finished - started
+
+        try:
+            return self._executor.submit(timed).result()
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        """Queue depth and latency numbers, e.g. for a metrics page."""
+
+        with self._lock:
+            done = self.completed or 1
+            return {
+                'workers': self.workers,
+                'rounds': self.rounds,
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_wait_ms': self.total_wait / done * 1000,
+                'max_wait_ms': self.max_wait * 1000,
+                'avg_hash_ms': self.total_hash / done * 1000,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+pool = HashingPool()
+
+
+def init_app(app):
+    """Size the hashing pool and set the work factor from the app's config."""
+
+    global pool
+
+    pool.shutdown()
+    pool = HashingPool(workers=app.config.get('PASSWORD_HASH_WORKERS', 2),
+                       max_queue=app.config.get('PASSWORD_HASH_MAX_QUEUE', 64),
+                       queue_timeout=app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5),
+                       rounds=app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS))
+
+
+def hash_password(password):
+    """Hash a password at the configured work factor."""
+
+    hashed = pool.run(bcrypt.generate_password_hash, password, pool.rounds)
+    return hashed.decode('UTF-8')
+
+
+def check_password(hashed, password):
+    """Does `password` match the bcrypt hash `hashed`?"""
+
+    return pool.run(bcrypt.check_password_hash, hashed, password)
+
+
+def needs_rehash(hashed):
+    """Was `hashed` made with a different work factor than the configured one?
+
+    bcrypt hashes look like $2b$12$<salt+hash>, where 12 is the work factor.
+    """
+
+    try:
+        return int(hashed.split('$')[2]) != pool.rounds
+    except (IndexError, ValueError):
+        return True
@@ -0,0 +1,131 @@
+"""Cached identity of the logged-in user.
+
+`add_user_to_g` runs before every request, so instead of loading the full
+User row each time it loads a CurrentUser: a snapshot of just the fields
+templates render, kept in a short-TTL cache keyed by user id.
+
+Anything else (relationships, writes) goes through `CurrentUser.model`, the
+real User row, which is only loaded when a route asks for it.
+
+Like and follow lookups include the user's own changes still waiting in
+the write-behind queue (see writebehind.py).
+
+Writes that change a user's row mark it with `invalidate_after_commit`, so
+the cached copy is dropped once the new values are visible. Dropping it
+before the commit would let a concurrent request cache the old row again.
+"""
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import writebehind
+from cache import Cache, make_backend
+from models import db, User
+
+IDENTITY_COLUMNS = (
+    User.id,
+    User.username,
+    User.email,
+    User.image_url,
+    User.header_image_url,
+    User.bio,
+    User.location,
+    User.messages_count,
+    User.following_count,
+    User.followers_count,
+    User.likes_count,
+    User.version,
+)
+
+cache = Cache('identity')
+
+PENDING_KEY = 'identity_invalidations'
+
+
+def init_app(app):
+    """Set up the identity cache from the app's config."""
+
+    cache.backend = make_backend(app.config.get('IDENTITY_CACHE_URL'),
+                                 max_size=app.config.get('IDENTITY_CACHE_SIZE', 10000))
+    cache.ttl = app.config.get('IDENTITY_CACHE_TTL', 30)
+
+
+class CurrentUser:
+    """Snapshot of the logged-in user's identity and display fields."""
+
+    # these lookups only need our id, so borrow them from User
+    is_following = User.is_following
+
+    def following_ids(self):
+        return list(writebehind.overlay(writebehind.FOLLOW, self.id,
+                                        User.following_ids(self)))
+
+    def following_ids_among(self, user_ids):
+        user_ids = set(user_ids)
+        return writebehind.overlay(writebehind.FOLLOW, self.id,
+                                   User.following_ids_among(self, user_ids), user_ids)
+
+    def liked_ids_among(self, message_ids):
+        message_ids = set(message_ids)
+        return writebehind.overlay(writebehind.LIKE, self.id,
+                                   User.liked_ids_among(self, message_ids), message_ids)
+
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+        self._model = None
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}: {self.username}>"
+
+    @property
+    def model(self):
+        """The full User row, loaded on first use."""
+
+        if self._model is None:
+            self._model = User.query.get(self.id)
+        return self._model
+
+
+def load(user_id):
+    """Get the CurrentUser for `user_id`, or None if there's no such user."""
+
+    fields = cache.get(user_id)
+
+    if fields is None:
+        row = (db.session
+               .query(*IDENTITY_COLUMNS)
+               .filter(User.id == user_id)
+               .first())
+
+        if row is None:
+            return None
+
+        fields = dict(zip([c.key for c in IDENTITY_COLUMNS], row))
+        cache.set(user_id, fields)
+
+    return CurrentUser(fields)
+
+
+def invalidate(user_id):
+    """Forget a cached identity after the user's row changes."""
+
+    cache.delete(user_id)
+
+
+def invalidate_after_commit(user_ids):
+    """Forget the cached identities of `user_ids` once the current
+    transaction commits."""
+
+    db.session.info.setdefault(PENDING_KEY, set()).update(user_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def after_commit(session):
+    for user_id in session.info.pop(PENDING_KEY, ()):
+        invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def after_rollback(session):
+    # nothing changed, so the cached copies are still good
+    session.info.pop(PENDING_KEY, None)
@@ -0,0 +1,229 @@
+"""Per-request SQL instrumentation.
+
+SQLAlchemy cursor events time every statement. Inside a request the
+numbers go to a RequestStats on `g`; when the request ends they are added to
+per-endpoint totals (`stats`) and summarized in response headers:
+
+    X-DB-Stats: queries=4, time_ms=3.18, rows=27
+    Server-Timing: db;dur=3.18
+
+Rows are the DB-API cursor's rowcount for SELECTs, which PostgreSQL reports
+and SQLite doesn't (rows are left out there).
+
+Statements slower than SLOW_QUERY_MS are logged to the
+`warbler.slow_queries` logger, with their endpoint. The overhead is a couple
+of perf_counter() calls per statement, so it stays on in production.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+slow_log = logging.getLogger('warbler.slow_queries')
+
+# Longest statement text kept for the slowest-statement report
+STATEMENT_PREVIEW = 500
+
+
+class RequestStats:
+    """SQL numbers for one request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.rows_known = True
+        self.slowest = None
+        self.slowest_time = 0.0
+
+    def record(self, statement, elapsed, rows):
+        self.queries += 1
+        self.db_time += elapsed
+        if rows is None:
+            self.rows_known = False
+        else:
+            self.rows += rows
+        if elapsed >= self.slowest_time:
+            self.slowest = statement
+            self.slowest_time = elapsed
+
+    def header(self):
+        value = f"queries={self.queries}, time_ms={self.db_time * 1000:.2f}"
+        if self.rows_known:
+            value += f", rows={self.rows}"
+        return value
+
+
+class EndpointStats:
+    """Running totals for every request to one endpoint."""
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.slowest = None
+        self.slowest_time = 0.0
+
+    def add(self, req):
+        self.requests += 1
+        self.queries += req.queries
+        self.max_queries = max(self.max_queries, req.queries)
+        self.db_time += req.db_time
+        self.rows += req.rows
+        if req.slowest is not None and req.slowest_time >= self.slowest_time:
+            self.slowest = req.slowest[:STATEMENT_PREVIEW]
+            self.slowest_time = req.slowest_time
+
+    def as_dict(self):
+        n = self.requests or 1
+        return {
+            'requests': self.requests,
+            'queries_per_request': self.queries / n,
+            'max_queries': self.max_queries,
+            'db_ms_per_request': self.db_time / n * 1000,
+            'rows_per_request': self.rows / n,
+            'slowest_ms': self.slowest_time * 1000,
+            'slowest_statement': self.slowest,
+        }
+
+
+class Stats:
+    """Thread-safe per-endpoint totals."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def add(self, endpoint, req):
+        with self._lock:
+            self._endpoints.setdefault(endpoint, EndpointStats()).add(req)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: ep.as_dict() for name, ep in sorted(self._endpoints.items())}
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+stats = Stats()
+
+# Set from the app's config by init_app. None turns the slow-query log off.
+slow_query_seconds = None
+send_headers = True
+
+
+def current():
+    """The RequestStats for the current request, or None outside one."""
+
+    if has_request_context():
+        return g.get('query_stats')
+    return None
+
+
+##############################################################################
+# SQLAlchemy events (on every engine)
+
+
+# Start times go on the statement's execution context, so a statement that
+# fails (and never reaches after_cursor_execute) leaves nothing behind on the
+# pooled connection. A few internal statements (dialect setup) run without a
+# context; those use a single slot on the connection instead.
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+    else:
+        conn.info['query_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        started = context._query_started
+    else:
+        started = conn.info.pop('query_started')
+    elapsed = time.perf_counter() - started
+
+    rows = 0
+    if statement.lstrip()[:6].upper() == 'SELECT':
+        rows = cursor.rowcount if cursor.rowcount >= 0 else None
+
+    req = current()
+    if req is not None:
+        req.record(statement, elapsed, rows)
+
+    if slow_query_seconds is not None and elapsed >= slow_query_seconds:
+        slow_log.warning("%.1f ms [%s] %s", elapsed * 1000,
+                         request.endpoint if has_request_context() else '-',
+                         statement)
+
+
+@contextmanager
+def capture_queries(engine):
+    """Collect the SQL statements `engine` runs inside the block.
+
+        with capture_queries(db.engine) as queries:
+            ...
+        print(len(queries))
+    """
+
+    statements = []
+
+    def collect(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', collect)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', collect)
+
+
+##############################################################################
+# Flask hooks
+
+
+def start_request():
+    g.query_stats = RequestStats()
+
+
+def finish_request(response):
+    req = current()
+    if req is None:
+        return response
+
+    stats.add(request.endpoint or 'unmatched', req)
+
+    if send_headers:
+        response.headers['X-DB-Stats'] = req.header()
+        response.headers.add('Server-Timing', f"db;dur={req.db_time * 1000:.2f}")
+
+    return response
+
+
+def init_app(app):
+    """Collect per-request SQL stats for `app`, configured by:
+
+    - SLOW_QUERY_MS: log statements at least this slow (unset: don't)
+    - QUERY_STATS_HEADERS: add X-DB-Stats/Server-Timing headers (default on)
+    """
+
+    global slow_query_seconds, send_headers
+
+    threshold = app.config.get('SLOW_QUERY_MS')
+    slow_query_seconds = None if threshold is None else threshold / 1000
+    send_headers = app.config.get('QUERY_STATS_HEADERS', True)
+
+    app.before_request(start_request)
+    app.after_request(finish_request)
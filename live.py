@@ -0,0 +1,249 @@
+"""Live timeline updates: who posted what, pushed to waiting clients.
+
+The homepage long-polls /timeline/updates with the cursor of the newest
+message it shows, and gets back just the messages posted since then by
+people it follows. Instead of re-running the timeline query on every
+refresh, each poll is answered from a broker's recent history, or waits
+there (holding no database connection) until something arrives.
+
+Brokers:
+
+- LocalBroker: in-process; only sees messages posted through this process
+- RedisBroker: every process publishes to and listens on a Redis channel;
+  needs the `redis` package
+
+Each keeps the last LIVE_HISTORY new-message events. A client that fell
+further behind than that is caught up from the database.
+
+Messages are stamped when they're inserted but published once committed,
+so one can turn up after a newer one was already delivered. Each poll
+therefore also looks LIVE_OVERLAP_SECONDS back from its cursor, and the
+cursor carries the messages it already delivered from that stretch so
+they aren't sent twice.
+"""
+
+import json
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import tuple_
+
+import pagination
+from models import db, Message
+from pagination import CURSOR_DATETIME_FORMAT
+
+CHANNEL = 'warbler:messages'
+
+# A new message; timelines order (and cursors point) by (timestamp, message_id)
+Event = namedtuple('Event', ['timestamp', 'message_id', 'author_id'])
+
+
+class LocalBroker:
+    """Thread-safe in-process pub/sub with a bounded history of events."""
+
+    def __init__(self, history=1000):
+        self._events = deque(maxlen=history)
+        self._changed = threading.Condition()
+        # the history has every event after this cursor (until it overflows)
+        self._covers_from = (datetime.utcnow(), 0)
+
+    def publish(self, event):
+        self.deliver(event)
+
+    def deliver(self, event):
+        """Add an event to the history and wake every waiting client."""
+
+        with self._changed:
+            if len(self._events) == self._events.maxlen:
+                self._covers_from = max(self._covers_from, self._events[0][:2])
+            self._events.append(event)
+            self._changed.notify_all()
+
+    def since(self, after, author_ids, overlap=timedelta(0), seen=()):
+        """Events by `author_ids` after the (timestamp, id) `after`, newest
+        first; None if the history doesn't reach back that far.
+
+        With an `overlap`, also events stamped up to that long before
+        `after`, except for the (timestamp, id) pairs in `seen`.
+        """
+
+        with self._changed:
+            return self._since(after, author_ids, overlap, seen)
+
+    def _since(self, after, author_ids, overlap, seen):
+        if after < self.covers_from():
+            return None
+
+        low = max((after[0] - overlap, 0) if overlap else after, self.covers_from())
+        return sorted((e for e in self._events
+                       if e.author_id in author_ids and (e.timestamp, e.message_id) > low
+                       and (e.timestamp, e.message_id) not in seen),
+                      reverse=True)
+
+    def covers_from(self):
+        """The earliest cursor the history is complete after."""
+
+        return self._covers_from
+
+    def wait(self, after, author_ids, timeout, overlap=timedelta(0), seen=()):
+        """Like `since`, but block up to `timeout` seconds for an event."""
+
+        deadline = time.monotonic() + timeout
+
+        with self._changed:
+            while True:
+                events = self._since(after, author_ids, overlap, seen)
+                remaining = deadline - time.monotonic()
+                if events != [] or remaining <= 0:
+                    return events
+                self._changed.wait(remaining)
+
+
+class RedisBroker(LocalBroker):
+    """Pub/sub shared by every worker process through a Redis channel."""
+
+    def __init__(self, url, history=1000):
+        import redis
+
+        super().__init__(history)
+        self._redis = redis.Redis.from_url(url)
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{CHANNEL: self._receive})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def publish(self, event):
+        self._redis.publish(CHANNEL, json.dumps(
+            [event.timestamp.strftime(CURSOR_DATETIME_FORMAT), event.message_id,
+             event.author_id]))
+
+    def _receive(self, raw):
+        timestamp, message_id, author_id = json.loads(raw['data'])
+        self.deliver(Event(datetime.strptime(timestamp, CURSOR_DATETIME_FORMAT),
+                           message_id, author_id))
+
+
+def make_broker(url=None, history=1000):
+    """Build a broker from a URL: redis://... for Redis, empty for local."""
+
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBroker(url, history=history)
+
+    return LocalBroker(history=history)
+
+
+broker = LocalBroker()
+
+
+def init_app(app):
+    """Set up the broker from the app's config."""
+
+    global broker
+    broker = make_broker(app.config.get('LIVE_BROKER_URL'),
+                         history=app.config.get('LIVE_HISTORY', 1000))
+
+
+def publish(message):
+    """Announce a new (committed) message."""
+
+    broker.publish(Event(message.timestamp, message.id, message.user_id))
+
+
+def overlap():
+    """How far back before its cursor each poll looks for late commits."""
+
+    return timedelta(seconds=current_app.config.get('LIVE_OVERLAP_SECONDS', 10))
+
+
+def in_overlap(keys, after):
+    """The (timestamp, id) `keys` within the overlap before `after`."""
+
+    low = after[0] - overlap()
+    return {tuple(key) for key in keys if key[0] > low and tuple(key) <= tuple(after)}
+
+
+def encode_cursor(after, seen=()):
+    """An updates cursor: the newest (timestamp, id) delivered, plus the
+    ones delivered from the overlap before it."""
+
+    return pagination.encode_cursor(list(after) + [
+        [[timestamp.strftime(CURSOR_DATETIME_FORMAT), message_id]
+         for timestamp, message_id in sorted(seen)]])
+
+
+def decode_cursor(cursor):
+    """(after, seen) from an updates cursor; None if it's malformed.
+
+    Plain (timestamp, id) timeline cursors are accepted too.
+    """
+
+    parts = pagination.decode_parts(cursor)
+    if parts is None or len(parts) not in (2, 3):
+        return None
+
+    try:
+        after = (datetime.strptime(parts[0], CURSOR_DATETIME_FORMAT), int(parts[1]))
+        seen = {(datetime.strptime(timestamp, CURSOR_DATETIME_FORMAT), int(message_id))
+                for timestamp, message_id in (parts[2] if len(parts) == 3 else [])}
+    except (ValueError, TypeError):
+        return None
+
+    return after, seen
+
+
+def cursor_for(messages):
+    """The updates cursor for a page showing `messages`, newest first."""
+
+    if not messages:
+        return encode_cursor((datetime.utcnow(), 0))
+
+    keys = [(message.timestamp, message.id) for message in messages]
+    return encode_cursor(keys[0], in_overlap(keys, keys[0]))
+
+
+def updates(author_ids, after, seen=(), timeout=0, limit=100):
+    """Messages by `author_ids` newer than the cursor `after` (or late
+    commits in the overlap before it, other than those in `seen`).
+
+    Answers from the broker's history, or from the database if the client is
+    further behind than that. If there's nothing new, waits up to `timeout`
+    seconds for something, with the session's connection back in the pool.
+    When there's more than `limit`, the oldest come first.
+
+    Returns (ids newest first, the cursor to ask from next time).
+    """
+
+    seen = set(seen)
+    events = broker.since(after, author_ids, overlap(), seen)
+
+    if events is None:
+        rows = (db.session
+                .query(Message.timestamp, Message.id)
+                .filter(Message.user_id.in_(author_ids),
+                        tuple_(Message.timestamp, Message.id) > tuple_(after[0] - overlap(), 0))
+                .order_by(Message.timestamp, Message.id)
+                .limit(limit + len(seen))
+                .all())
+        keys = [tuple(row) for row in rows if tuple(row) not in seen][:limit]
+        if keys:
+            return next_page(keys[::-1], after, seen)
+
+        # caught up; anything newer is in the history from here on
+        after = max(after, broker.covers_from())
+        events = []
+
+    if not events and timeout > 0:
+        db.session.close()
+        events = broker.wait(after, author_ids, timeout, overlap(), seen) or []
+
+    return next_page([(e.timestamp, e.message_id) for e in events[-limit:]], after, seen)
+
+
+def next_page(keys, after, seen):
+    """(ids, next cursor) for delivering the newest-first `keys`."""
+
+    after = max([after] + keys)
+    return [message_id for _, message_id in keys], encode_cursor(
+        after, in_overlap(seen | set(keys), after))
@@ -0,0 +1,71 @@
+"""user counters, materialized timelines, per-user likes key, username search index
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:20:05.118364
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+COUNTERS = ('messages_count', 'following_count', 'followers_count', 'likes_count')
+
+
+def upgrade():
+    for name in COUNTERS:
+        op.add_column('users', sa.Column(name, sa.Integer(), server_default='0', nullable=False))
+
+    # backfill counters for existing users
+    op.execute("""
+        UPDATE users SET
+            messages_count = (SELECT count(*) FROM messages WHERE messages.user_id = users.id),
+            following_count = (SELECT count(*) FROM follows WHERE follows.user_following_id = users.id),
+            followers_count = (SELECT count(*) FROM follows WHERE follows.user_being_followed_id = users.id),
+            likes_count = (SELECT count(*) FROM likes WHERE likes.user_id = users.id)
+    """)
+
+    # likes were unique per message (only one user could like it); make
+    # them unique per (user, message)
+    op.drop_constraint('likes_message_id_key', 'likes', type_='unique')
+    op.create_unique_constraint('uq_likes_user_message', 'likes', ['user_id', 'message_id'])
+
+    op.create_table('timeline_entries',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['author_id'], ['users.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('user_id', 'message_id')
+    )
+    op.create_index('ix_timeline_entries_user_author', 'timeline_entries', ['user_id', 'author_id'], unique=False)
+    op.create_index('ix_timeline_entries_user_timestamp', 'timeline_entries', ['user_id', 'timestamp', 'message_id'], unique=False)
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE INDEX ix_users_username_trgm ON users USING gin (username gin_trgm_ops)")
+
+
+def downgrade():
+    op.drop_index('ix_users_username_trgm', table_name='users')
+
+    op.drop_index('ix_timeline_entries_user_timestamp', table_name='timeline_entries')
+    op.drop_index('ix_timeline_entries_user_author', table_name='timeline_entries')
+    op.drop_table('timeline_entries')
+
+    # can't go back to one like per message while more than one user likes it
+    op.execute("""
+        DELETE FROM likes WHERE id NOT IN (SELECT min(id) FROM likes GROUP BY message_id)
+    """)
+    op.drop_constraint('uq_likes_user_message', 'likes', type_='unique')
+    op.create_unique_constraint('likes_message_id_key', 'likes', ['message_id'])
+
+    for name in reversed(COUNTERS):
+        op.drop_column('users', name)
@@ -0,0 +1,45 @@
+"""indexes for the timeline, profile, follow and like queries
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 09:34:52.660971
+
+Built CONCURRENTLY so big tables stay writable while the indexes build.
+
+- messages (user_id, timestamp, id): homepage timeline and profile pages,
+  messages by author(s) newest first, in keyset order
+- follows (user_following_id, user_being_followed_id): following page,
+  follow-state lookups and the homepage's followed-ids query (the primary
+  key already covers followers of a user)
+- likes (message_id): likes of a message, for message deletes (the
+  (user_id, message_id) unique key already covers a user's likes)
+- timeline_entries (message_id): removing a deleted message from timelines
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_messages_user_timestamp', 'messages', ['user_id', 'timestamp', 'id']),
+    ('ix_follows_following_followed', 'follows', ['user_following_id', 'user_being_followed_id']),
+    ('ix_likes_message_id', 'likes', ['message_id']),
+    ('ix_timeline_entries_message_id', 'timeline_entries', ['message_id']),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,24 @@
+"""user version, for cached fragment keys
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 10:02:41.532907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'version')
@@ -2,11 +2,13 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects import postgresql
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+import hashing
+from replicas import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
 
 
 class Follows(db.Model):
@@ -14,6 +16,12 @@ class Follows(db.Model):
 
     __tablename__ = 'follows'
 
+    # the primary key covers "who follows X"; this covers "who does X follow"
+    __table_args__ = (
+        db.Index('ix_follows_following_followed',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
     user_being_followed_id = db.Column(
         db.Integer,
         db.ForeignKey('users.id', ondelete="cascade"),
@@ -32,6 +40,12 @@ class Likes(db.Model):
 
     __tablename__ = 'likes' 
 
+    # the unique key also serves lookups of a user's likes
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id', name='uq_likes_user_message'),
+        db.Index('ix_likes_message_id', 'message_id'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True
@@ -45,9 +59,40 @@ class Likes(db.Model):
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
     )
-        
+
+    @classmethod
+    def toggle(cls, user_id, message_id):
+        """Like the message if the user doesn't already, else unlike it.
+
+        Costs at most two single-row statements on the (user_id, message_id)
+        key, no matter how many likes the user has, and is safe to race:
+        a like that already exists is left alone.
+
+        Returns (liked, changed): whether the message is now liked, and
+        whether this call actually added or removed a row.
+        """
+
+        likes = cls.__table__
+
+        removed = db.session.execute(
+            likes.delete().where((likes.c.user_id == user_id) &
+                                 (likes.c.message_id == message_id))).rowcount
+        if removed:
+            return False, True
+
+        if db.engine.dialect.name == 'postgresql':
+            insert = (postgresql.insert(likes)
+                      .values(user_id=user_id, message_id=message_id)
+                      .on_conflict_do_nothing(index_elements=['user_id', 'message_id']))
+        else:
+            insert = (likes.insert()
+                      .values(user_id=user_id, message_id=message_id)
+                      .prefix_with('OR IGNORE', dialect='sqlite'))
+
+        added = db.session.execute(insert).rowcount
+        return True, bool(added)
+
 
 class User(db.Model):
     """User in the system."""
@@ -96,6 +141,45 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Denormalized counts, kept up to date by counters.py so profile pages
+    # don't have to load whole collections just to count them.
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Bumped whenever profile fields change; part of cached fragment keys.
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1,
+        server_default='1',
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -123,14 +207,59 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return self.id in other_user.following_ids_among([self.id])
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in self.following_ids_among([other_user.id])
+
+    def following_ids(self):
+        """Ids of every user this user follows, without loading the users."""
+
+        rows = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == self.id))
+
+        return [user_id for (user_id,) in rows]
+
+    def liked_ids_among(self, message_ids):
+        """Which of `message_ids` does this user like?
+
+        Only looks up the given messages (e.g. the ones on the page being
+        rendered), so the cost doesn't grow with how many messages the
+        user has ever liked. Returns a set of ids.
+        """
+
+        message_ids = set(message_ids)
+        if not message_ids:
+            return set()
+
+        rows = (db.session
+                .query(Likes.message_id)
+                .filter(Likes.user_id == self.id,
+                        Likes.message_id.in_(message_ids)))
+
+        return {message_id for (message_id,) in rows}
+
+    def following_ids_among(self, user_ids):
+        """Which of `user_ids` is this user following?
+
+        Answers for a whole batch of users with one query against the
+        follows primary key, instead of loading `self.following`.
+        Returns a set of ids.
+        """
+
+        user_ids = set(user_ids)
+        if not user_ids:
+            return set()
+
+        rows = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == self.id,
+                        Follows.user_being_followed_id.in_(user_ids)))
+
+        return {user_id for (user_id,) in rows}
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -139,7 +268,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hashing.hash_password(password)
 
         user = User(
             username=username,
@@ -160,23 +289,51 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the user's hash was made with a different work factor than the
+        one configured now, it is replaced with a fresh hash (the caller
+        commits).
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hashing.check_password(user.password, password)
             if is_auth:
+                if hashing.needs_rehash(user.password):
+                    user.password = hashing.hash_password(password)
                 return user
 
         return False
 
 
+# Trigram index so username search (search.py) can use an index for
+# substring matches. PostgreSQL only; other databases scan.
+
+event.listen(
+    User.__table__,
+    'before_create',
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect='postgresql'),
+)
+
+event.listen(
+    User.__table__,
+    'after_create',
+    DDL("CREATE INDEX ix_users_username_trgm "
+        "ON users USING gin (username gin_trgm_ops)").execute_if(dialect='postgresql'),
+)
+
+
 class Message(db.Model):
     """An individual message ("warble")."""
 
     __tablename__ = 'messages'
 
+    # timelines and profiles: messages by author(s), newest first
+    __table_args__ = (
+        db.Index('ix_messages_user_timestamp', 'user_id', 'timestamp', 'id'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -190,7 +347,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -202,6 +359,45 @@ class Message(db.Model):
     user = db.relationship('User')
 
 
+class TimelineEntry(db.Model):
+    """A message materialized into a follower's home timeline.
+
+    Only used when fan-out-on-write is turned on (see timeline.py).
+    """
+
+    __tablename__ = 'timeline_entries'
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+        db.Index('ix_timeline_entries_user_author', 'user_id', 'author_id'),
+        db.Index('ix_timeline_entries_message_id', 'message_id'),
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
@@ -0,0 +1,124 @@
+"""Keyset (cursor) pagination helpers for Warbler."""
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+CURSOR_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+WindowPage = namedtuple('WindowPage', ['items', 'prev_cursor', 'next_cursor'])
+
+
+def encode_cursor(values):
+    """Encode a tuple of sort-key values as an opaque, URL-safe string."""
+
+    parts = [v.strftime(CURSOR_DATETIME_FORMAT) if isinstance(v, datetime) else v
+             for v in values]
+    raw = json.dumps(parts, separators=(',', ':')).encode('UTF-8')
+    return urlsafe_b64encode(raw).decode('ascii').rstrip("=")
+
+
+def decode_parts(cursor):
+    """The raw JSON list inside a cursor, or None if it's malformed."""
+
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        parts = json.loads(urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError):
+        return None
+
+    return parts if isinstance(parts, list) else None
+
+
+def decode_cursor(cursor, columns):
+    """Decode a cursor made by `encode_cursor` back into typed values.
+
+    Values are converted to the python type of the matching column.
+    Returns None if the cursor is malformed.
+    """
+
+    parts = decode_parts(cursor)
+    if parts is None or len(parts) != len(columns):
+        return None
+
+    try:
+        values = []
+        for part, column in zip(parts, columns):
+            python_type = column.type.python_type
+            if python_type is datetime:
+                values.append(datetime.strptime(part, CURSOR_DATETIME_FORMAT))
+            else:
+                values.append(python_type(part))
+
+        return tuple(values)
+
+    except (ValueError, TypeError, UnicodeError):
+        return None
+
+
+def keyset_page(query, columns, cursor=None, limit=20, descending=True):
+    """Fetch one page of `query`, ordered by `columns`, after `cursor`.
+
+    `columns` must uniquely order the rows (end with a primary key) so the
+    cursor can resume exactly where the previous page stopped. Unlike
+    OFFSET, every page costs the same no matter how deep the client scrolls.
+
+    Returns a Page of (items, next_cursor); next_cursor is None on the last
+    page.
+    """
+
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        if values is not None:
+            if descending:
+                query = query.filter(tuple_(*columns) < tuple_(*values))
+            else:
+                query = query.filter(tuple_(*columns) > tuple_(*values))
+
+    order = [c.desc() for c in columns] if descending else list(columns)
+
+    # grab one extra row to find out if there is another page
+    rows = query.order_by(*order).limit(limit + 1).all()
+    items = rows[:limit]
+
+    next_cursor = cursor_for(items[-1], columns) if len(rows) > limit else None
+
+    return Page(items, next_cursor)
+
+
+def keyset_window(query, columns, after=None, before=None, limit=20):
+    """Fetch one page of `query` in ascending `columns` order, moving either
+    forwards (`after` a cursor) or backwards (`before` a cursor).
+
+    Returns a WindowPage of (items, prev_cursor, next_cursor); each cursor is
+    None when there is no page in that direction.
+    """
+
+    if before:
+        # walk backwards from the cursor, then flip the page the right way up
+        page = keyset_page(query, columns, cursor=before, limit=limit, descending=True)
+        items = list(reversed(page.items))
+        has_prev, has_next = page.next_cursor is not None, True
+
+    else:
+        page = keyset_page(query, columns, cursor=after, limit=limit, descending=False)
+        items = page.items
+        has_prev, has_next = after is not None, page.next_cursor is not None
+
+    if not items:
+        return WindowPage([], None, None)
+
+    return WindowPage(items,
+                      cursor_for(items[0], columns) if has_prev else None,
+                      cursor_for(items[-1], columns) if has_next else None)
+
+
+def cursor_for(item, columns):
+    """Make the cursor pointing at `item` (a model or a row of columns)."""
+
+    return encode_cursor([getattr(item, c.key) for c in columns])
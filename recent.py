@@ -0,0 +1,168 @@
+"""Per-author cache of recent messages.
+
+Profiles list an author's newest messages, and hybrid timelines merge in
+celebrities' newest messages (see timeline.py). Both read them from here:
+for each author, a ring of their RECENT_MESSAGES_PER_AUTHOR newest
+messages (id, timestamp and text), newest first.
+
+Rings are filled from the database on a miss and then kept up to date as
+the author posts (the newest message pushes the oldest out) and deletes.
+After a delete a full ring is one short; a reader that needs more than a
+ring holds refills it, unless the ring already has all the author's
+messages.
+
+A ring can miss changes made by another process that doesn't share its
+backend; readers catch a missed post by checking the ring's newest message
+against the database's (see users_show, and `newest_ids` for timelines).
+
+Locally, rings are evicted least recently used once they take up more
+than RECENT_MESSAGES_CACHE_BYTES. Set RECENT_MESSAGES_CACHE_URL to a Redis
+URL to share them between worker processes. RECENT_MESSAGES_TTL bounds
+how long a ring can miss any other change.
+"""
+
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import select, tuple_
+
+from cache import Cache, make_backend
+from models import db, Message, User
+
+RecentMessage = namedtuple('RecentMessage', ['id', 'timestamp', 'text', 'user_id'])
+
+# A ring: newest-first messages, and whether they are all the author has
+Ring = namedtuple('Ring', ['messages', 'complete'])
+
+cache = Cache('recent')
+
+
+def init_app(app):
+    """Set up the recent-messages cache from the app's config."""
+
+    cache.backend = make_backend(app.config.get('RECENT_MESSAGES_CACHE_URL'),
+                                 max_size=app.config.get('RECENT_MESSAGES_CACHE_SIZE', 100000),
+                                 max_bytes=app.config.get('RECENT_MESSAGES_CACHE_BYTES'))
+    cache.ttl = app.config.get('RECENT_MESSAGES_TTL', 3600)
+
+
+def ring_size():
+    """How many messages each author's ring holds."""
+
+    return current_app.config.get('RECENT_MESSAGES_PER_AUTHOR', 100)
+
+
+def load(author_id):
+    """Read an author's ring from the database and cache it."""
+
+    size = ring_size()
+    rows = (db.session
+            .query(Message.id, Message.timestamp, Message.text, Message.user_id)
+            .filter(Message.user_id == author_id)
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(size)
+            .all())
+
+    ring = Ring([RecentMessage(*row) for row in rows], len(rows) < size)
+    cache.set(author_id, ring)
+    return ring
+
+
+def messages(author_id, limit=None, before=None, newest_id=None):
+    """An author's newest `limit` messages (by default, a ring's worth),
+    optionally only those older than `before`, a (timestamp, id) pair.
+
+    If the caller knows the id of the author's newest message, a ring that
+    disagrees (changed by another process) is reloaded.
+
+    Returns None when the ring can't answer: then query the database.
+    """
+
+    limit = limit or ring_size()
+    if limit > ring_size():
+        return None
+
+    ring = cache.get(author_id)
+    if ring is None or (len(ring.messages) < limit and not ring.complete) or (
+            newest_id is not None and newest(ring) != newest_id):
+        ring = load(author_id)
+
+    found = ring.messages
+    if before is not None:
+        found = [m for m in found if (m.timestamp, m.id) < tuple(before)]
+
+    if len(found) < limit and not ring.complete:
+        return None
+
+    return found[:limit]
+
+
+def newest(ring):
+    """The id of a ring's newest message, or None if it's empty."""
+
+    return ring.messages[0].id if ring.messages else None
+
+
+def add(message):
+    """Push a new (committed) message onto its author's ring, if cached."""
+
+    ring = cache.get(message.user_id)
+    if ring is None:
+        return
+
+    latest = RecentMessage(message.id, message.timestamp, message.text, message.user_id)
+    newest = sorted(ring.messages + [latest], key=lambda m: (m.timestamp, m.id), reverse=True)
+
+    size = ring_size()
+    cache.set(message.user_id, Ring(newest[:size], ring.complete and len(newest) <= size))
+
+
+def remove(author_id, message_id):
+    """Take a deleted message out of its author's ring, if cached."""
+
+    ring = cache.get(author_id)
+    if ring is None:
+        return
+
+    cache.set(author_id, Ring([m for m in ring.messages if m.id != message_id],
+                              ring.complete))
+
+
+def forget(author_id):
+    """Drop an author's ring (e.g. when the author is deleted)."""
+
+    cache.delete(author_id)
+
+
+def newest_ids(author_ids):
+    """{author id: id of their newest message} for several authors, in one
+    query, to validate their rings with."""
+
+    if not author_ids:
+        return {}
+
+    newest = (select([Message.id])
+              .where(Message.user_id == User.id)
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(1)
+              .as_scalar())
+
+    return dict(db.session.query(User.id, newest).filter(User.id.in_(author_ids)))
+
+
+def entries(author_id, after=None, limit=20, newest_id=None):
+    """(timestamp, id) pairs of an author's newest messages before `after`,
+    from the ring when it covers them (and, given `newest_id`, agrees with
+    the database), else from the database."""
+
+    found = messages(author_id, limit=limit, before=after, newest_id=newest_id)
+    if found is not None:
+        return [(m.timestamp, m.id) for m in found]
+
+    query = (db.session
+             .query(Message.timestamp, Message.id)
+             .filter(Message.user_id == author_id))
+    if after:
+        query = query.filter(tuple_(Message.timestamp, Message.id) < tuple_(*after))
+
+    return query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit).all()
@@ -0,0 +1,119 @@
+"""Connection pool settings and read-replica routing.
+
+Writes always go to the primary (SQLALCHEMY_DATABASE_URI). Reads made
+while handling a GET/HEAD request go to a read replica, when replicas are
+configured (DATABASE_REPLICA_URLS, comma separated), except:
+
+- once a request has written anything, the rest of it reads the primary
+- after a POST (or other unsafe request), the same browser session reads
+  the primary for REPLICA_STICKY_SECONDS, so people see their own changes
+  even while the replicas lag behind
+
+Each replica is registered as a Flask-SQLAlchemy bind named `replica-N`;
+no models are bound to them, so `db.create_all()` and migrations only
+touch the primary.
+"""
+
+import random
+import time
+
+from flask import current_app, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_PREFIX = 'replica-'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# session key: read the primary until this time (epoch seconds)
+STICKY_KEY = '_primary_until'
+
+
+class RoutingSession(SignallingSession):
+    """A session that reads from `info['replica']` when one is chosen."""
+
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        event.listen(self, 'after_flush', pin_to_primary)
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+
+        if replica and isinstance(clause, UpdateBase):
+            pin_to_primary(self)
+        elif replica and not self._flushing:
+            return get_state(self.app).db.get_engine(self.app, bind=replica)
+
+        return super().get_bind(mapper, clause)
+
+
+def pin_to_primary(session, *args):
+    """Send the rest of this session's queries to the primary."""
+
+    session.info['replica'] = None
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with replica routing and pre-pinged pools."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_pool_defaults(self, app, options):
+        options = super().apply_pool_defaults(app, options) or options
+        if app.config.get('SQLALCHEMY_POOL_PRE_PING'):
+            options['pool_pre_ping'] = True
+        return options
+
+
+def init_app(app):
+    """Register replica binds and the request hooks that route to them."""
+
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {}) or {}
+    for i, url in enumerate(app.config.get('DATABASE_REPLICA_URLS') or (), 1):
+        binds[f"{REPLICA_PREFIX}{i}"] = url
+    app.config['SQLALCHEMY_BINDS'] = binds or None
+
+    app.before_request(route_reads)
+    app.after_request(stick_to_primary)
+
+
+def replicas(app):
+    """The bind keys of `app`'s read replicas."""
+
+    binds = app.config.get('SQLALCHEMY_BINDS') or {}
+    return sorted(key for key in binds if key.startswith(REPLICA_PREFIX))
+
+
+def is_sticky():
+    """Did this browser session write recently enough to need the primary?"""
+
+    return session.get(STICKY_KEY, 0) > time.time()
+
+
+def route_reads():
+    """Read this request from a random replica, if it's safe to."""
+
+    keys = replicas(current_app)
+
+    if keys and request.method in SAFE_METHODS and not is_sticky():
+        get_state(current_app).db.session.info['replica'] = random.choice(keys)
+
+
+def stick_to_primary(response):
+    """After an unsafe request, read the primary for a while."""
+
+    if request.method not in SAFE_METHODS and replicas(current_app):
+        session[STICKY_KEY] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+
+    return response
+
+
+def pool_stats(app):
+    """Checked-out / idle / overflow status of each engine's pool."""
+
+    db = get_state(app).db
+    stats = {'primary': db.get_engine(app).pool.status()}
+    for key in replicas(app):
+        stats[key] = db.get_engine(app, bind=key).pool.status()
+    return stats
@@ -0,0 +1,60 @@
+"""Username search for the /users page.
+
+On PostgreSQL, searches use the pg_trgm GIN index on users.username (see
+models.py), so a substring match is an index scan rather than a sequential
+scan of the whole table, and results are ranked by trigram similarity.
+Other databases (SQLite in development) fall back to a plain LIKE with the
+same ranking rules apart from similarity.
+
+Ranking: usernames starting with the search term come first, then closer
+matches, then alphabetical.
+"""
+
+from sqlalchemy import case, func
+
+from models import db, User
+
+LIKE_ESCAPE = '\\'
+
+
+def escape_like(term):
+    """Escape LIKE wildcards in user input so they match literally."""
+
+    return (term
+            .replace(LIKE_ESCAPE, LIKE_ESCAPE * 2)
+            .replace('%', LIKE_ESCAPE + '%')
+            .replace('_', LIKE_ESCAPE + '_'))
+
+
+def search_users(term, page=1, per_page=24, query=None):
+    """Find users whose username contains `term`, best matches first.
+
+    `query` is the query to filter and order (User.query by default), so
+    callers can choose which columns to load.
+
+    Returns (users, has_next) for the 1-based `page`.
+    """
+
+    if query is None:
+        query = User.query
+
+    escaped = escape_like(term)
+    is_prefix = User.username.ilike(f"{escaped}%", escape=LIKE_ESCAPE)
+
+    query = query.filter(User.username.ilike(f"%{escaped}%", escape=LIKE_ESCAPE))
+
+    ranking = [case([(is_prefix, 0)], else_=1)]
+    if db.engine.dialect.name == 'postgresql':
+        ranking.append(func.similarity(User.username, term).desc())
+    else:
+        ranking.append(func.length(User.username))
+    ranking.append(User.username)
+
+    # grab one extra row to find out if there is another page
+    rows = (query
+            .order_by(*ranking)
+            .offset((page - 1) * per_page)
+            .limit(per_page + 1)
+            .all())
+
+    return rows[:per_page], len(rows) > per_page
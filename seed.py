@@ -1,20 +1,20 @@
 """Seed database with sample data from CSV Files."""
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follows
+from flask_migrate import upgrade
 
+from app import app, db
+import bulk_load
+import counters
 
-db.drop_all()
-db.create_all()
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+with app.app_context():
+    db.drop_all()
+    # drop_all leaves Alembic's version table behind; without dropping it
+    # too, upgrade would skip the migrations that build the schema
+    db.engine.execute('DROP TABLE IF EXISTS alembic_version')
+    upgrade()
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+    bulk_load.load('generator')
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
-
-db.session.commit()
\ No newline at end of file
+    counters.reconcile()
+    db.session.commit()
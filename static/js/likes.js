@@ -0,0 +1,25 @@
+// Toggle likes in place, without reloading the whole timeline.
+// Falls back to a normal form post if the request fails.
+
+document.addEventListener('submit', async function (evt) {
+  const form = evt.target;
+  if (!form.matches('form[action$="/like"]')) return;
+
+  evt.preventDefault();
+
+  try {
+    const resp = await fetch(form.action, {
+      method: 'POST',
+      headers: {'Accept': 'application/json'},
+      credentials: 'same-origin',
+    });
+    if (!resp.ok) throw new Error(resp.statusText);
+
+    const {liked} = await resp.json();
+    const button = form.querySelector('button');
+    button.classList.toggle('btn-primary', liked);
+    button.classList.toggle('btn-secondary', !liked);
+  } catch (err) {
+    form.submit();
+  }
+});
@@ -0,0 +1,35 @@
+// Add new warbles from people you follow to the top of the timeline as
+// they're posted, instead of reloading the whole page.
+// Long-polls /timeline/updates from the newest message shown.
+
+(function () {
+  const list = document.getElementById('messages');
+  if (!list || !list.dataset.updatesSince) return;
+
+  let since = list.dataset.updatesSince;
+
+  async function poll() {
+    let delay = 1000;
+
+    try {
+      const resp = await fetch(`/timeline/updates?since=${encodeURIComponent(since)}`, {
+        headers: {'Accept': 'application/json'},
+        credentials: 'same-origin',
+      });
+      if (!resp.ok) throw new Error(resp.statusText);
+
+      const {messages, cursor} = await resp.json();
+      for (const msg of messages.slice().reverse()) {
+        list.insertAdjacentHTML('afterbegin', msg.html);
+      }
+      since = cursor;
+    } catch (err) {
+      // back off while the server is unhappy
+      delay = 30000;
+    }
+
+    setTimeout(poll, delay);
+  }
+
+  poll();
+})();
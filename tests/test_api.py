@@ -0,0 +1,186 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest tests/test_api.py
+
+
+import gzip
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+import timeline
+app.config['TESTING'] = True
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ApiTestCase(TestCase):
+    """Test the /api/v1 endpoints."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        db.session.add_all([
+            User(id=i, username=f"user{i}", email=f"user{i}@test.com",
+                 password="unused", bio="x" * 200)
+            for i in range(1, 6)
+        ])
+        db.session.commit()
+
+        start = datetime(2020, 1, 1)
+        db.session.add_all([
+            Message(id=100 + i, text=f"warble {i}", user_id=2,
+                    timestamp=start + timedelta(minutes=i))
+            for i in range(5)
+        ])
+        db.session.add_all([
+            Follows(user_being_followed_id=i, user_following_id=1)
+            for i in range(2, 6)
+        ])
+        db.session.commit()
+
+        db.session.add(Likes(user_id=1, message_id=104))
+        db.session.commit()
+
+        counters.reconcile()
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['TIMELINE_FANOUT'] = False
+        db.session.rollback()
+
+    def get(self, url, user_id=1, **kwargs):
+        with self.client as c:
+            if user_id:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = user_id
+            return c.get(url, **kwargs)
+
+    def page_through(self, url):
+        """Follow next_cursor links; return every item's id."""
+
+        ids = []
+        cursor = None
+        while True:
+            sep = '&' if '?' in url else '?'
+            resp = self.get(url + (f"{sep}cursor={cursor}" if cursor else ""))
+            self.assertEqual(resp.status_code, 200)
+            body = resp.get_json()
+            ids.extend(item['id'] for item in body['data'])
+            cursor = body['next_cursor']
+            if not cursor:
+                return ids
+
+    def test_timeline(self):
+        """Does the timeline page newest first, with liked flags?"""
+
+        resp = self.get("/api/v1/timeline?limit=2")
+        body = resp.get_json()
+
+        self.assertEqual([m['id'] for m in body['data']], [104, 103])
+        self.assertEqual(body['data'][0]['user'], {'id': 2, 'username': "user2",
+                                                   'image_url': "/static/images/default-pic.png"})
+        self.assertTrue(body['data'][0]['liked'])
+        self.assertFalse(body['data'][1]['liked'])
+
+        self.assertEqual(self.page_through("/api/v1/timeline?limit=2"),
+                         [104, 103, 102, 101, 100])
+
+    def test_timeline_fanout(self):
+        """Does the timeline read materialized timelines when fan-out is on?"""
+
+        app.config['TIMELINE_FANOUT'] = True
+        with app.app_context():
+            timeline.rebuild()
+
+        self.assertEqual(self.page_through("/api/v1/timeline?limit=3"),
+                         [104, 103, 102, 101, 100])
+
+    def test_timeline_requires_login(self):
+        """Do anonymous clients get a JSON 401?"""
+
+        resp = self.get("/api/v1/timeline", user_id=None)
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(resp.get_json(), {'error': "Access unauthorized."})
+
+    def test_profile(self):
+        """Does a profile carry counts, but nothing private?"""
+
+        data = self.get("/api/v1/users/1").get_json()['data']
+
+        self.assertEqual(data['username'], "user1")
+        self.assertEqual(data['following_count'], 4)
+        self.assertEqual(data['likes_count'], 1)
+        self.assertNotIn('password', data)
+        self.assertNotIn('email', data)
+
+    def test_user_messages(self):
+        """Can a user's messages be paged through?"""
+
+        self.assertEqual(self.page_through("/api/v1/users/2/messages?limit=2"),
+                         [104, 103, 102, 101, 100])
+
+    def test_following_and_followers(self):
+        """Do follow lists page in id order with follow state?"""
+
+        self.assertEqual(self.page_through("/api/v1/users/1/following?limit=3"),
+                         [2, 3, 4, 5])
+
+        data = self.get("/api/v1/users/3/followers").get_json()['data']
+        self.assertEqual([u['id'] for u in data], [1])
+        self.assertFalse(data[0]['is_following'])
+
+    def test_likes(self):
+        """Does the likes list show liked messages?"""
+
+        data = self.get("/api/v1/users/1/likes").get_json()['data']
+        self.assertEqual([m['id'] for m in data], [104])
+
+    def test_message(self):
+        """Is a single message served, and a missing one a JSON 404?"""
+
+        self.assertEqual(self.get("/api/v1/messages/101").get_json()['data']['text'],
+                         "warble 1")
+
+        resp = self.get("/api/v1/messages/999")
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.get_json(), {'error': "Not found."})
+
+        self.assertEqual(self.get("/api/v1/users/999/messages").status_code, 404)
+
+    def test_compression(self):
+        """Are large responses gzipped for clients that accept it?"""
+
+        resp = self.get("/api/v1/users/1/following",
+                        headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertIn(b'"username"', gzip.decompress(resp.data))
+
+        resp = self.get("/api/v1/users/1/following")
+        self.assertNotIn('Content-Encoding', resp.headers)
@@ -0,0 +1,129 @@
+"""Async read path tests.
+
+These need requirements-async.txt installed and a PostgreSQL test database
+(asyncpg only speaks PostgreSQL); they are skipped otherwise.
+"""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest tests/test_async_app.py
+
+
+import importlib.util
+import os
+from datetime import datetime, timedelta
+from unittest import IsolatedAsyncioTestCase, skipUnless
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+app.config['TESTING'] = True
+
+db.create_all()
+
+ASYNC_INSTALLED = all(importlib.util.find_spec(name) for name in ('quart', 'asyncpg'))
+ON_POSTGRES = db.engine.dialect.name == 'postgresql'
+
+
+@skipUnless(ASYNC_INSTALLED and ON_POSTGRES, "needs Quart, asyncpg and PostgreSQL")
+class AsyncAppTestCase(IsolatedAsyncioTestCase):
+    """Test that the async endpoints answer like /api/v1 does."""
+
+    def setUp(self):
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        db.session.add_all([
+            User(id=i, username=f"user{i}", email=f"user{i}@test.com", password="unused")
+            for i in (1, 2, 3)
+        ])
+        db.session.commit()
+
+        start = datetime(2020, 1, 1)
+        db.session.add_all([
+            Message(id=100 + i, text=f"warble {i}", user_id=2 if i < 4 else 3,
+                    timestamp=start + timedelta(minutes=i))
+            for i in range(6)
+        ])
+        db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+        db.session.commit()
+
+        db.session.add(Likes(user_id=1, message_id=103))
+        db.session.commit()
+
+        serializer = app.session_interface.get_signing_serializer(app)
+        self.cookie = {'Cookie': f"session={serializer.dumps({CURR_USER_KEY: 1})}"}
+
+    async def asyncSetUp(self):
+        import async_app
+
+        async_app.app.config['SECRET_KEY'] = app.config['SECRET_KEY']
+        async_app.app.config['DATABASE_URL'] = app.config['SQLALCHEMY_DATABASE_URI']
+        await async_app.open_pool()
+
+        self.async_app = async_app
+        self.client = async_app.app.test_client()
+
+    async def asyncTearDown(self):
+        await self.async_app.close_pool()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    async def get_json(self, url, headers=None):
+        resp = await self.client.get(url, headers=headers or {})
+        return resp.status_code, await resp.get_json()
+
+    async def test_timeline_matches_sync_api(self):
+        """Does the async timeline page exactly like the Flask API?"""
+
+        status, body = await self.get_json("/api/v1/timeline?limit=2", self.cookie)
+        self.assertEqual(status, 200)
+        self.assertEqual([m['id'] for m in body['data']], [103, 102])
+        self.assertTrue(body['data'][0]['liked'])
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+            self.assertEqual(c.get("/api/v1/timeline?limit=2").get_json(), body)
+
+        status, body = await self.get_json(
+            f"/api/v1/timeline?limit=2&cursor={body['next_cursor']}", self.cookie)
+        self.assertEqual([m['id'] for m in body['data']], [101, 100])
+
+    async def test_timeline_requires_login(self):
+        """Do anonymous clients get a 401?"""
+
+        status, body = await self.get_json("/api/v1/timeline")
+        self.assertEqual(status, 401)
+
+    async def test_profile(self):
+        """Does a profile include the viewer's follow state?"""
+
+        status, body = await self.get_json("/api/v1/users/2", self.cookie)
+        self.assertEqual(status, 200)
+        self.assertEqual(body['data']['username'], "user2")
+        self.assertTrue(body['data']['is_following'])
+
+        status, body = await self.get_json("/api/v1/users/999", self.cookie)
+        self.assertEqual(status, 404)
+
+    async def test_message(self):
+        """Is a single message served with its author?"""
+
+        status, body = await self.get_json("/api/v1/messages/104")
+        self.assertEqual(status, 200)
+        self.assertEqual(body['data']['user']['id'], 3)
+        self.assertNotIn('liked', body['data'])
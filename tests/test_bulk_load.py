@@ -0,0 +1,104 @@
+"""Bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_bulk_load.py
+
+
+import csv
+import io
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import bulk_load
+app.config['TESTING'] = True
+
+db.create_all()
+
+
+def write_csv(path, headers, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        writer.writerows(rows)
+
+
+class BulkLoadTestCase(TestCase):
+    """Test loading CSVs in batches."""
+
+    def setUp(self):
+        """Write a small set of CSVs to a temporary directory."""
+
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+        write_csv(os.path.join(self.dir, 'users.csv'),
+                  ['email', 'username', 'image_url', 'password', 'bio',
+                   'header_image_url', 'location'],
+                  [[f"u{i}@test.com", f"user{i}", "/a.png", "hash", "", "/b.jpg", "Here"]
+                   for i in range(1, 6)])
+        self.write_messages()
+        write_csv(os.path.join(self.dir, 'follows.csv'),
+                  ['user_being_followed_id', 'user_following_id'],
+                  [[1, 2], [1, 3], [2, 1]])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        db.session.rollback()
+
+    def write_messages(self, bad_row=None):
+        rows = [[f"message {i}", f"2020-01-0{i} 10:00:00.123456", i] for i in range(1, 6)]
+        if bad_row:
+            rows[bad_row][1] = "yesterday"
+        write_csv(os.path.join(self.dir, 'messages.csv'),
+                  ['text', 'timestamp', 'user_id'], rows)
+
+    def test_load(self):
+        """Are all rows loaded, with ids by row number and typed timestamps?"""
+
+        loaded = bulk_load.load(self.dir, batch_size=2, out=io.StringIO())
+
+        self.assertEqual(loaded, {'users': 5, 'messages': 5, 'follows': 3})
+        self.assertEqual(User.query.get(3).username, "user3")
+        self.assertEqual(Message.query.get(2).timestamp,
+                         datetime(2020, 1, 2, 10, 0, 0, 123456))
+        self.assertEqual(Follows.query.count(), 3)
+
+    def test_resume(self):
+        """Does --resume pick up after the last committed batch, without duplicates?"""
+
+        self.write_messages(bad_row=3)
+
+        with self.assertRaises(ValueError):
+            bulk_load.load(self.dir, batch_size=2, out=io.StringIO())
+
+        # the first batch of messages committed; the failed one didn't
+        self.assertEqual(Message.query.count(), 2)
+
+        self.write_messages()
+        loaded = bulk_load.load(self.dir, batch_size=2, resume=True, out=io.StringIO())
+
+        self.assertEqual(loaded, {'users': 0, 'messages': 3, 'follows': 3})
+        self.assertEqual(User.query.count(), 5)
+        self.assertEqual(sorted(m.id for m in Message.query), [1, 2, 3, 4, 5])
@@ -0,0 +1,142 @@
+"""Conditional request and cache policy tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest tests/test_conditional.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import conditional
+app.config['TESTING'] = True
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ConditionalRequestTestCase(TestCase):
+    """Test ETags and 304s on profile and message pages."""
+
+    def setUp(self):
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        db.session.add_all([
+            User(id=1, username="reader", email="reader@test.com", password="unused"),
+            User(id=2, username="author", email="author@test.com", password="unused"),
+        ])
+        db.session.commit()
+
+        db.session.add(Message(id=10, text="first", user_id=2,
+                               timestamp=datetime(2020, 1, 1)))
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def get(self, url, etag=None):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+            headers = {'If-None-Match': f'"{etag}"'} if etag else {}
+            return c.get(url, headers=headers)
+
+    def test_profile_not_modified(self):
+        """Does an unchanged profile answer 304 to its own ETag?"""
+
+        resp = self.get("/users/2")
+        etag = resp.get_etag()[0]
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+
+        resp = self.get("/users/2", etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b"")
+
+    def test_profile_modified_by_new_message(self):
+        """Does a new message change the profile's ETag?"""
+
+        etag = self.get("/users/2").get_etag()[0]
+
+        db.session.add(Message(id=11, text="second", user_id=2,
+                               timestamp=datetime(2020, 1, 2)))
+        db.session.commit()
+
+        resp = self.get("/users/2", etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("second", str(resp.data))
+
+    def test_profile_modified_by_follow(self):
+        """Does following the user change what the viewer is sent?"""
+
+        etag = self.get("/users/2").get_etag()[0]
+
+        db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+        db.session.commit()
+
+        resp = self.get("/users/2", etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Unfollow", str(resp.data))
+
+    def test_message_not_modified(self):
+        """Does a message page answer 304 until its author changes?"""
+
+        etag = self.get("/messages/10").get_etag()[0]
+        self.assertEqual(self.get("/messages/10", etag).status_code, 304)
+
+        User.query.filter_by(id=2).update({'version': User.version + 1})
+        db.session.commit()
+
+        self.assertEqual(self.get("/messages/10", etag).status_code, 200)
+
+    def test_missing_pages(self):
+        """Are missing users and messages still 404s?"""
+
+        self.assertEqual(self.get("/users/99").status_code, 404)
+        self.assertEqual(self.get("/messages/99").status_code, 404)
+
+
+class StaticCacheTestCase(TestCase):
+    """Test caching headers on static files."""
+
+    def test_fingerprinted_static_immutable(self):
+        """Are fingerprinted static URLs cached for good?"""
+
+        with app.test_request_context():
+            url = conditional.static_url('js/likes.js')
+        self.assertIn("?v=", url)
+
+        resp = app.test_client().get(url)
+        self.assertIn("immutable", resp.headers['Cache-Control'])
+        resp.close()
+
+    def test_plain_static_revalidated(self):
+        """Are static URLs without a fingerprint revalidated?"""
+
+        resp = app.test_client().get("/static/js/likes.js")
+        self.assertEqual(resp.headers['Cache-Control'], 'public, no-cache')
+        resp.close()
+
+        resp = app.test_client().get("/static/js/likes.js?v=stale")
+        self.assertEqual(resp.headers['Cache-Control'], 'public, no-cache')
+        resp.close()
@@ -0,0 +1,116 @@
+"""Fragment cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest tests/test_fragments.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import fragments
+app.config['TESTING'] = True
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test cached message and user cards."""
+
+    def setUp(self):
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        db.session.add_all([
+            User(id=1, username="reader", email="reader@test.com", password="unused"),
+            User(id=2, username="author", email="author@test.com", password="unused"),
+        ])
+        db.session.commit()
+
+        db.session.add(Message(id=10, text="cached warble", user_id=2,
+                               timestamp=datetime(2020, 1, 1)))
+        db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+        db.session.commit()
+
+        fragments.cache.clear()
+        fragments.cache.hits = fragments.cache.misses = 0
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def get(self, url, user_id=1):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+            return c.get(url)
+
+    def test_card_reused(self):
+        """Is a card rendered once, then served from the cache?"""
+
+        self.get("/")
+        self.assertEqual(fragments.cache.misses, 1)
+
+        resp = self.get("/")
+        self.assertEqual(fragments.cache.hits, 1)
+        self.assertIn("cached warble", str(resp.data))
+
+    def test_viewer_flags_in_key(self):
+        """Do liked and unliked cards of a message get separate entries?"""
+
+        self.get("/")
+        db.session.add(Likes(user_id=1, message_id=10))
+        db.session.commit()
+
+        resp = self.get("/")
+        self.assertEqual(fragments.cache.misses, 2)
+        self.assertIn("btn-primary", str(resp.data))
+
+    def test_profile_edit_new_version(self):
+        """Do an author's cards change once their profile changes?"""
+
+        self.get("/")
+        User.query.filter_by(id=2).update({'username': "renamed",
+                                            'version': User.version + 1})
+        db.session.commit()
+
+        resp = self.get("/")
+        self.assertIn("@renamed", str(resp.data))
+
+    def test_message_delete_forgets(self):
+        """Are a deleted message's cards dropped from the cache?"""
+
+        self.get("/messages/10", user_id=2)
+        self.assertIsNotNone(fragments.cache.get("message-detail:10:1:own"))
+
+        with self.client as c:
+            resp = c.post("/messages/10/delete")
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertIsNone(fragments.cache.get("message-detail:10:1:own"))
+
+    def test_user_cards(self):
+        """Do user cards carry the viewer's follow button?"""
+
+        resp = self.get("/users/1/following")
+        self.assertIn("/users/stop-following/2", str(resp.data))
+        self.assertIsNotNone(fragments.cache.get("user:2:1:unfollow"))
@@ -0,0 +1,60 @@
+"""CSV generator tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_generator.py
+
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from unittest import TestCase
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'generator'))
+
+import create_csvs
+
+
+class GeneratorTestCase(TestCase):
+    """Test that generated CSVs are repeatable."""
+
+    def setUp(self):
+        self.chunk_size = create_csvs.CHUNK_SIZE
+        self.tz = os.environ.get('TZ')
+        # several chunks per table, so several processes get work
+        create_csvs.CHUNK_SIZE = 20
+
+    def tearDown(self):
+        create_csvs.CHUNK_SIZE = self.chunk_size
+        if self.tz is None:
+            os.environ.pop('TZ', None)
+        else:
+            os.environ['TZ'] = self.tz
+        time.tzset()
+
+    def generate(self, out, processes, tz):
+        os.environ['TZ'] = tz
+        time.tzset()
+
+        opts = dict(users=50, messages=200, follows=300, likes=100, alpha=1.0,
+                    seed=7, until=datetime(2020, 3, 1), out=out)
+        create_csvs.generate(opts, processes=processes)
+
+        files = {}
+        for filename in sorted(os.listdir(out)):
+            with open(os.path.join(out, filename)) as f:
+                files[filename] = f.read()
+        return files
+
+    def test_same_seed_same_csvs(self):
+        """Does a seed give identical CSVs for any process count and timezone?"""
+
+        with tempfile.TemporaryDirectory() as one, tempfile.TemporaryDirectory() as many:
+            serial = self.generate(one, 1, 'UTC')
+            parallel = self.generate(many, 3, 'America/New_York')
+
+        self.assertEqual(sorted(serial), ['follows.csv', 'likes.csv',
+                                          'messages.csv', 'users.csv'])
+        self.assertEqual(serial, parallel)
@@ -0,0 +1,102 @@
+"""Password hashing pool tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_hashing.py
+
+
+import os
+import threading
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import hashing
+app.config['TESTING'] = True
+
+db.create_all()
+
+
+class HashingPoolTestCase(TestCase):
+    """Test the bounded hashing pool."""
+
+    def test_run_and_stats(self):
+        """Does the pool run work and count it?"""
+
+        pool = hashing.HashingPool(workers=1, max_queue=1)
+        self.assertEqual(pool.run(sum, [1, 2]), 3)
+        self.assertEqual(pool.stats()['completed'], 1)
+        pool.shutdown()
+
+    def test_overloaded(self):
+        """Are callers turned away once the workers and queue are full?"""
+
+        pool = hashing.HashingPool(workers=1, max_queue=0, queue_timeout=0.01)
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        busy = threading.Thread(target=pool.run, args=(block,))
+        busy.start()
+
+        try:
+            # the busy job is running, so it holds the pool's only slot
+            self.assertTrue(started.wait(5))
+            with self.assertRaises(hashing.HashingOverloaded):
+                pool.run(sum, [1])
+            self.assertEqual(pool.stats()['rejected'], 1)
+        finally:
+            release.set()
+            busy.join()
+            pool.shutdown()
+
+    def test_needs_rehash(self):
+        """Are hashes with a different work factor spotted?"""
+
+        self.assertFalse(hashing.needs_rehash(f"$2b${hashing.pool.rounds:02d}$abc"))
+        self.assertTrue(hashing.needs_rehash("$2b$04$abc"))
+        self.assertTrue(hashing.needs_rehash("not a hash"))
+
+
+class RehashTestCase(TestCase):
+    """Test upgrading password hashes at login."""
+
+    def setUp(self):
+        User.query.delete()
+        db.session.commit()
+
+        self.rounds = hashing.pool.rounds
+
+    def tearDown(self):
+        hashing.pool.rounds = self.rounds
+        db.session.rollback()
+
+    def test_rehash_on_login(self):
+        """Is a hash made with an old work factor replaced when the user logs in?"""
+
+        hashing.pool.rounds = 4
+        user = User.signup("testuser", "test@test.com", "password", None)
+        user.id = 123
+        db.session.commit()
+        self.assertTrue(user.password.startswith("$2b$04$"))
+
+        hashing.pool.rounds = 5
+        user = User.authenticate("testuser", "password")
+        db.session.commit()
+
+        self.assertTrue(user.password.startswith("$2b$05$"))
+        self.assertTrue(User.authenticate("testuser", "password"))
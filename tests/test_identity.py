@@ -0,0 +1,205 @@
+"""Identity cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest tests/test_identity.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Follows, Likes, Message, TimelineEntry, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from cache import LocalBackend
+import counters
+import identity
+app.config['TESTING'] = True
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LocalBackendTestCase(TestCase):
+    """Test the in-process LRU backend."""
+
+    def test_lru_eviction(self):
+        """Are the least recently used keys evicted past max_size?"""
+
+        backend = LocalBackend(max_size=2)
+        backend.set("a", 1)
+        backend.set("b", 2)
+        backend.get("a")
+        backend.set("c", 3)
+
+        self.assertEqual(backend.get("a"), 1)
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("c"), 3)
+
+    def test_byte_budget(self):
+        """Are the least recently used keys evicted past max_bytes?"""
+
+        backend = LocalBackend(max_bytes=2500)
+        backend.set("a", "x" * 1000)
+        backend.set("b", "x" * 1000)
+        backend.get("a")
+        backend.set("c", "x" * 1000)
+
+        self.assertIsNotNone(backend.get("a"))
+        self.assertIsNone(backend.get("b"))
+        self.assertIsNotNone(backend.get("c"))
+        self.assertLessEqual(backend.bytes, 2500)
+
+        backend.delete("a")
+        backend.delete("c")
+        self.assertEqual(backend.bytes, 0)
+
+    def test_ttl(self):
+        """Do expired keys read as missing?"""
+
+        backend = LocalBackend()
+        backend.set("a", 1, ttl=-1)
+        backend.set("b", 2, ttl=60)
+
+        self.assertIsNone(backend.get("a"))
+        self.assertEqual(backend.get("b"), 2)
+
+    def test_clear_prefix(self):
+        """Does clear only drop keys in the given namespace?"""
+
+        backend = LocalBackend()
+        backend.set("identity:1", 1)
+        backend.set("other:1", 2)
+        backend.clear(prefix="identity:")
+
+        self.assertIsNone(backend.get("identity:1"))
+        self.assertEqual(backend.get("other:1"), 2)
+
+
+class IdentityTestCase(TestCase):
+    """Test the cached current user."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        for model in (TimelineEntry, Likes, Follows, Message, User):
+            model.query.delete()
+
+        self.u1 = User.signup("testuser1", "test1@test.com", "password", None)
+        self.u1.id = 111
+        db.session.commit()
+
+        identity.cache.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        db.session.rollback()
+
+    def test_cache_hit(self):
+        """Is the current user loaded from the cache on later requests?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 111
+
+            hits, misses = identity.cache.hits, identity.cache.misses
+            c.get("/users")
+            c.get("/users")
+
+            self.assertEqual(identity.cache.misses - misses, 1)
+            self.assertEqual(identity.cache.hits - hits, 1)
+
+    def test_missing_user(self):
+        """Is a session for a deleted user treated as logged out?"""
+
+        self.assertIsNone(identity.load(99999))
+
+    def test_profile_edit_invalidates(self):
+        """Does editing the profile show the new username straight away?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 111
+
+            c.get("/users")
+            c.post("/users/profile", data={"username": "renamed",
+                                           "email": "test1@test.com",
+                                           "password": "password"})
+            resp = c.get("/users/profile")
+
+            self.assertIn('alt="renamed"', str(resp.data))
+
+    def test_counters_invalidate_after_commit(self):
+        """Is a counter change only dropped from the cache once committed?"""
+
+        identity.load(111)
+        counters.adjust(111, likes_count=1)
+
+        # a request reading now would still see (and re-cache) the old row
+        self.assertIsNotNone(identity.cache.get(111))
+
+        db.session.commit()
+        self.assertIsNone(identity.cache.get(111))
+        self.assertEqual(identity.load(111).likes_count, 1)
+
+        counters.adjust(111, likes_count=-1)
+        db.session.rollback()
+        db.session.commit()
+        self.assertIsNotNone(identity.cache.get(111))
+
+    def test_delete_invalidates_others(self):
+        """Are the counters of a deleted user's followers, followees and
+        likers fresh straight away?"""
+
+        u2 = User.signup("testuser2", "test2@test.com", "password", None)
+        u2.id = 222
+        db.session.commit()
+        db.session.add_all([Follows(user_following_id=222, user_being_followed_id=111),
+                            Follows(user_following_id=111, user_being_followed_id=222),
+                            Message(id=1, text="hello", user_id=111)])
+        db.session.commit()
+        db.session.add(Likes(user_id=222, message_id=1))
+        db.session.commit()
+        counters.reconcile()
+        db.session.commit()
+
+        self.assertEqual(identity.load(222).following_count, 1)
+
+        counters.user_deleted(111)
+        # what the database's ON DELETE CASCADEs would take with the user
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.filter_by(id=111).delete()
+        db.session.commit()
+
+        u2 = identity.load(222)
+        self.assertEqual((u2.following_count, u2.followers_count, u2.likes_count),
+                         (0, 0, 0))
+
+        db.session.add(Message(id=2, text="hello", user_id=222))
+        db.session.commit()
+        db.session.add(Likes(user_id=222, message_id=2))
+        db.session.commit()
+        counters.reconcile()
+        db.session.commit()
+        self.assertEqual(identity.load(222).likes_count, 1)
+
+        msg = Message.query.get(2)
+        counters.message_deleted(msg)
+        db.session.delete(msg)
+        db.session.commit()
+
+        self.assertEqual(identity.load(222).likes_count, 0)
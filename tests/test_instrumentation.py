@@ -0,0 +1,125 @@
+"""SQL instrumentation and metrics endpoint tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest tests/test_instrumentation.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy.exc import DBAPIError
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import instrumentation
+app.config['TESTING'] = True
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class InstrumentationTestCase(TestCase):
+    """Test per-request query stats."""
+
+    def setUp(self):
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        db.session.add(User(id=1, username="reader", email="reader@test.com",
+                            password="unused"))
+        db.session.commit()
+
+        instrumentation.stats.reset()
+        app.config['METRICS_TOKEN'] = "s3cret"
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_stats_header(self):
+        """Does every response say how many queries it ran?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            resp = c.get("/users/1")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertRegex(resp.headers['X-DB-Stats'], r"^queries=[1-9]\d*, time_ms=")
+        self.assertIn("db;dur=", resp.headers['Server-Timing'])
+
+    def test_stats_by_endpoint(self):
+        """Are requests totalled under their endpoint?"""
+
+        self.client.get("/users/1")
+        self.client.get("/users/1")
+        self.client.get("/no-such-page")
+
+        endpoints = instrumentation.stats.snapshot()
+        self.assertEqual(endpoints['users_show']['requests'], 2)
+        self.assertGreater(endpoints['users_show']['queries_per_request'], 0)
+        self.assertIn("users", endpoints['users_show']['slowest_statement'])
+        self.assertEqual(endpoints['unmatched']['requests'], 1)
+
+    def test_slow_query_log(self):
+        """Are statements over the threshold logged with their endpoint?"""
+
+        instrumentation.slow_query_seconds = 0
+        try:
+            with self.assertLogs('warbler.slow_queries', level='WARNING') as logs:
+                self.client.get("/users/1")
+        finally:
+            instrumentation.slow_query_seconds = None
+
+        self.assertIn("[users_show]", logs.output[0])
+
+    def test_failed_statement_leaves_no_timer(self):
+        """Does a statement that errors leave no timing state on its
+        (pooled) connection?"""
+
+        with db.engine.connect() as conn:
+            with self.assertRaises(DBAPIError):
+                conn.execute("SELECT * FROM no_such_table")
+            self.assertFalse(conn.info.get('query_started'))
+
+            self.assertEqual(conn.execute("SELECT 1").scalar(), 1)
+            self.assertFalse(conn.info.get('query_started'))
+
+    def test_metrics_requires_token(self):
+        """Is the metrics endpoint hidden without the right token?"""
+
+        self.assertEqual(self.client.get("/admin/metrics").status_code, 404)
+
+        resp = self.client.get("/admin/metrics",
+                               headers={'Authorization': "Bearer wrong"})
+        self.assertEqual(resp.status_code, 404)
+
+    def test_metrics(self):
+        """Does the metrics endpoint report endpoints, caches and hashing?"""
+
+        self.client.get("/users/1")
+        resp = self.client.get("/admin/metrics",
+                               headers={'Authorization': "Bearer s3cret"})
+
+        self.assertEqual(resp.status_code, 200)
+        data = resp.get_json()
+        self.assertEqual(data['endpoints']['users_show']['requests'], 1)
+        self.assertIn('hit_rate', data['identity_cache'])
+        self.assertIn('queued', data['password_hashing'])
@@ -0,0 +1,218 @@
+"""Live timeline update tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest tests/test_live.py
+
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Message, User, Follows, Likes, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import fragments
+import live
+from pagination import encode_cursor
+app.config['TESTING'] = True
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LocalBrokerTestCase(TestCase):
+    """Test the in-process broker."""
+
+    def test_since(self):
+        """Are only followed authors' newer events returned, newest first?"""
+
+        broker = live.LocalBroker()
+        now = datetime.utcnow() + timedelta(seconds=1)
+        for i, author in enumerate((1, 2, 1), 1):
+            broker.publish(live.Event(now + timedelta(seconds=i), i, author))
+
+        self.assertEqual([e.message_id for e in broker.since((now, 0), {1})], [3, 1])
+        self.assertEqual(broker.since((now + timedelta(seconds=1), 1), {1, 2})[-1].message_id, 2)
+
+        # from before the broker started: it can't say
+        self.assertIsNone(broker.since((now - timedelta(days=1), 0), {1}))
+
+    def test_history_overflow(self):
+        """Once events fall out of the history, are older cursors refused?"""
+
+        broker = live.LocalBroker(history=2)
+        now = datetime.utcnow() + timedelta(seconds=1)
+        for i in range(1, 4):
+            broker.publish(live.Event(now + timedelta(seconds=i), i, 1))
+
+        self.assertIsNone(broker.since((now, 0), {1}))
+        self.assertEqual([e.message_id for e in
+                          broker.since((now + timedelta(seconds=1), 1), {1})], [3, 2])
+
+    def test_wait(self):
+        """Does a waiting client wake up when an event arrives?"""
+
+        broker = live.LocalBroker()
+        now = datetime.utcnow()
+        publisher = threading.Timer(0.1, broker.publish, [live.Event(now, 7, 1)])
+        publisher.start()
+
+        started = time.monotonic()
+        events = broker.wait((now - timedelta(microseconds=1), 0), {1}, timeout=5)
+
+        self.assertEqual([e.message_id for e in events], [7])
+        self.assertLess(time.monotonic() - started, 5)
+
+
+class TimelineUpdatesTestCase(TestCase):
+    """Test the /timeline/updates endpoint."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        db.session.add_all([User(id=i, username=f"user{i}", email=f"user{i}@test.com",
+                                 password="unused") for i in (1, 2, 3)])
+        db.session.commit()
+
+        db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+        db.session.add(Message(id=1, text="old news", user_id=2,
+                               timestamp=datetime(2020, 1, 1)))
+        db.session.commit()
+
+        live.broker = live.LocalBroker()
+        fragments.cache.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def poll(self, c, since, wait=0):
+        resp = c.get(f"/timeline/updates?since={since}&wait={wait}")
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_json()
+
+    def test_new_messages(self):
+        """Are new messages by followed users delivered once, with cards?"""
+
+        with self.client as c:
+            self.login(c, 1)
+            since = c.get("/").get_data(as_text=True) \
+                     .split('data-updates-since="')[1].split('"')[0]
+
+            self.login(c, 3)
+            c.post("/messages/new", data={"text": "not followed"})
+            self.login(c, 2)
+            c.post("/messages/new", data={"text": "hot off the press"})
+
+            self.login(c, 1)
+            body = self.poll(c, since)
+            self.assertEqual(len(body['messages']), 1)
+            self.assertIn("hot off the press", body['messages'][0]['html'])
+
+            self.assertEqual(self.poll(c, body['cursor'])['messages'], [])
+
+    def test_catch_up_from_database(self):
+        """Is a client that's behind the broker's history caught up from the
+        database, and then moved onto the history?"""
+
+        since = encode_cursor([datetime(2019, 1, 1), 0])
+
+        with self.client as c:
+            self.login(c, 1)
+            body = self.poll(c, since)
+            self.assertEqual([m['id'] for m in body['messages']], [1])
+
+            body = self.poll(c, body['cursor'])
+            self.assertEqual(body['messages'], [])
+            after, seen = live.decode_cursor(body['cursor'])
+            self.assertGreaterEqual(after, live.broker.covers_from())
+
+    def test_waits_for_message(self):
+        """Does a poll with nothing new wait for the next message?"""
+
+        since = encode_cursor(live.broker.covers_from())
+        msg = Message(id=2, text="worth the wait", user_id=2)
+        db.session.add(msg)
+        db.session.commit()
+        event = live.Event(msg.timestamp, msg.id, msg.user_id)
+
+        publisher = threading.Timer(0.2, live.broker.publish, [event])
+        publisher.start()
+
+        with self.client as c:
+            self.login(c, 1)
+            body = self.poll(c, since, wait=5)
+
+        self.assertEqual([m['id'] for m in body['messages']], [2])
+
+    def test_late_commit(self):
+        """Is a message committed after a newer one was delivered still
+        delivered, and only once?"""
+
+        since = encode_cursor(live.broker.covers_from())
+        now = datetime.utcnow()
+        early = live.Event(now, 2, 2)
+        late = live.Event(now + timedelta(seconds=1), 3, 2)
+        db.session.add_all([Message(id=e.message_id, text=f"m{e.message_id}", user_id=2,
+                                    timestamp=e.timestamp) for e in (early, late)])
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, 1)
+
+            live.broker.publish(late)
+            body = self.poll(c, since)
+            self.assertEqual([m['id'] for m in body['messages']], [3])
+
+            live.broker.publish(early)
+            body = self.poll(c, body['cursor'])
+            self.assertEqual([m['id'] for m in body['messages']], [2])
+
+            self.assertEqual(self.poll(c, body['cursor'])['messages'], [])
+
+    def test_backlog_oldest_first(self):
+        """With more new messages than fit in one response, are the oldest
+        sent first and the rest on the next poll?"""
+
+        since = encode_cursor(live.broker.covers_from())
+        now = datetime.utcnow()
+        for i in range(2, 6):
+            live.broker.publish(live.Event(now + timedelta(seconds=i), i, 2))
+
+        with app.test_request_context():
+            ids, cursor = live.updates({2}, live.decode_cursor(since)[0], limit=3)
+            self.assertEqual(ids, [4, 3, 2])
+
+            ids, cursor = live.updates({2}, *live.decode_cursor(cursor), limit=3)
+            self.assertEqual(ids, [5])
+
+    def test_requires_login(self):
+        """Are anonymous and malformed polls refused?"""
+
+        with self.client as c:
+            self.assertEqual(c.get("/timeline/updates?since=x").status_code, 401)
+
+            self.login(c, 1)
+            self.assertEqual(c.get("/timeline/updates?since=x").status_code, 400)
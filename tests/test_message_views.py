@@ -6,9 +6,11 @@
 
 
 import os
+from datetime import datetime, timedelta
 from unittest import TestCase
 
 from models import db, connect_db, Message, User
+from bs4 import BeautifulSoup
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -184,3 +186,64 @@ class MessageViewTestCase(TestCase):
             m = Message.query.get(222)
             self.assertIsNotNone(m)
 
+
+    ##################################################
+    # Homepage Timeline Tests
+
+    def setup_timeline(self, count):
+        """Add `count` messages from u1, one minute apart, newest last."""
+
+        start = datetime(2020, 1, 1)
+        msgs = [Message(id=1000 + i,
+                        text=f"warble number {i}",
+                        timestamp=start + timedelta(minutes=i),
+                        user_id=self.u1.id)
+                for i in range(count)]
+        db.session.add_all(msgs)
+        db.session.commit()
+
+    def test_homepage_first_page(self):
+        """Does the homepage show only the newest page of messages?"""
+
+        self.setup_timeline(5)
+        app.config['TIMELINE_PAGE_SIZE'] = 2
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1.id
+
+                resp = c.get("/")
+                html = str(resp.data)
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("warble number 4", html)
+                self.assertIn("warble number 3", html)
+                self.assertNotIn("warble number 2", html)
+                self.assertIn("Load older warbles", html)
+        finally:
+            app.config['TIMELINE_PAGE_SIZE'] = 20
+
+    def test_homepage_load_older(self):
+        """Does following the cursor walk through every message exactly once?"""
+
+        self.setup_timeline(5)
+        app.config['TIMELINE_PAGE_SIZE'] = 2
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1.id
+
+                seen = []
+                url = "/"
+                while url:
+                    resp = c.get(url)
+                    soup = BeautifulSoup(resp.data, "html.parser")
+                    seen += [p.text for p in soup.select("#messages p")]
+                    older = soup.find("a", string=lambda t: t and "Load older" in t)
+                    url = older["href"] if older else None
+
+                self.assertEqual(seen, [f"warble number {i}" for i in range(4, -1, -1)])
+        finally:
+            app.config['TIMELINE_PAGE_SIZE'] = 20
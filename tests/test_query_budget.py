@@ -0,0 +1,140 @@
+"""Query budget tests: catch N+1 queries on pages that list messages."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest tests/test_query_budget.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Message, User, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+import fragments
+import identity
+import recent
+from instrumentation import capture_queries
+app.config['TESTING'] = True
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+# Most SQL statements a single page may run, no matter how many messages
+# (or message authors) it lists.
+QUERY_BUDGET = 8
+
+NUM_AUTHORS = 10
+
+
+class QueryBudgetTestCase(TestCase):
+    """Pages listing messages run a fixed number of queries."""
+
+    def setUp(self):
+        """Create a reader who follows NUM_AUTHORS authors and likes the
+        messages of NUM_AUTHORS strangers."""
+
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        # nobody logs in with a password here, so skip the slow bcrypt hashing
+        db.session.add(User(id=1, username="reader", email="reader@test.com",
+                            password="unused"))
+        others = [User(id=i, username=f"other{i}", email=f"other{i}@test.com",
+                       password="unused")
+                  for i in range(2, NUM_AUTHORS * 2 + 2)]
+        db.session.add_all(others)
+        db.session.commit()
+
+        start = datetime(2020, 1, 1)
+        for i, other in enumerate(others):
+            db.session.add(Message(id=100 + i, text=f"warble {i}", user_id=other.id,
+                                   timestamp=start + timedelta(minutes=i)))
+        db.session.commit()
+
+        for i, other in enumerate(others):
+            if i < NUM_AUTHORS:
+                db.session.add(Follows(user_being_followed_id=other.id, user_following_id=1))
+            else:
+                db.session.add(Likes(user_id=1, message_id=100 + i))
+        db.session.commit()
+
+        counters.reconcile()
+        db.session.commit()
+
+        # start requests from an empty identity map, like a real request would
+        db.session.expunge_all()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        db.session.rollback()
+
+    def assert_within_budget(self, url):
+        """Request `url` from cold caches; returns how many queries it ran."""
+
+        for cache in (identity.cache, fragments.cache, recent.cache):
+            cache.clear()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            with capture_queries(db.engine) as queries:
+                resp = c.get(url)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertLessEqual(
+                len(queries), QUERY_BUDGET,
+                f"{url} ran {len(queries)} queries:\n" + "\n".join(queries))
+
+        return len(queries)
+
+    def test_homepage_budget(self):
+        """Does the homepage load message authors without a query each?"""
+
+        self.assert_within_budget("/")
+
+    def test_user_show_budget(self):
+        """Does a profile page's query count stay the same however many
+        messages it lists?"""
+
+        few = self.assert_within_budget("/users/2")
+
+        start = datetime(2021, 1, 1)
+        db.session.add_all([Message(id=1000 + i, text=f"more {i}", user_id=2,
+                                    timestamp=start + timedelta(minutes=i))
+                            for i in range(NUM_AUTHORS * 2)])
+        db.session.commit()
+        counters.reconcile()
+        db.session.commit()
+        db.session.expunge_all()
+
+        many = self.assert_within_budget("/users/2")
+        self.assertEqual(many, few)
+
+    def test_user_likes_budget(self):
+        """Does the likes page load message authors without a query each?"""
+
+        self.assert_within_budget("/users/1/likes")
+
+    def test_following_budget(self):
+        """Does the following page look up every card's follow state at once?"""
+
+        self.assert_within_budget("/users/1/following")
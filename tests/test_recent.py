@@ -0,0 +1,127 @@
+"""Recent-messages cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest tests/test_recent.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Message, User, Follows, Likes, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+import recent
+from instrumentation import capture_queries
+app.config['TESTING'] = True
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class RecentMessagesTestCase(TestCase):
+    """Test the per-author rings of recent messages."""
+
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        db.session.add(User(id=1, username="author", email="author@test.com",
+                            password="unused"))
+        db.session.commit()
+
+        start = datetime(2020, 1, 1)
+        db.session.add_all([Message(id=i, text=f"warble {i}", user_id=1,
+                                    timestamp=start + timedelta(minutes=i))
+                            for i in range(1, 6)])
+        db.session.commit()
+        counters.reconcile()
+        db.session.commit()
+
+        recent.cache.clear()
+        app.config['RECENT_MESSAGES_PER_AUTHOR'] = 3
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['RECENT_MESSAGES_PER_AUTHOR'] = 100
+        db.session.rollback()
+
+    def ring_ids(self):
+        with app.app_context():
+            return [m.id for m in recent.messages(1)]
+
+    def test_ring_holds_newest(self):
+        """Does a ring hold its author's newest messages, newest first?"""
+
+        self.assertEqual(self.ring_ids(), [5, 4, 3])
+
+        with app.app_context():
+            self.assertEqual([m.id for m in recent.messages(1, limit=2, before=(
+                datetime(2020, 1, 1, 0, 5), 5))], [4, 3])
+
+            # past the end of the ring: the caller has to query
+            self.assertIsNone(recent.messages(1, limit=2, before=(
+                datetime(2020, 1, 1, 0, 4), 4)))
+            self.assertEqual([e[1] for e in recent.entries(1, limit=2, after=(
+                datetime(2020, 1, 1, 0, 4), 4))], [3, 2])
+
+    def test_post_and_delete(self):
+        """Do posting and deleting keep the ring up to date?"""
+
+        self.ring_ids()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            c.post("/messages/new", data={"text": "brand new"})
+            new_id = Message.query.filter_by(text="brand new").one().id
+            self.assertEqual(recent.cache.get(1).messages[0].id, new_id)
+            self.assertEqual(len(recent.cache.get(1).messages), 3)
+
+            c.post(f"/messages/{new_id}/delete")
+            self.assertEqual([m.id for m in recent.cache.get(1).messages], [5, 4])
+
+        # one short after the delete, so the next full read refills it
+        self.assertEqual(self.ring_ids(), [5, 4, 3])
+
+    def test_profile_from_ring(self):
+        """Does a repeat profile view list messages without querying them?"""
+
+        app.config['RECENT_MESSAGES_PER_AUTHOR'] = 100
+        self.client.get("/users/1")
+
+        with capture_queries(db.engine) as queries:
+            resp = self.client.get("/users/1")
+
+        self.assertIn("warble 5", str(resp.data))
+        self.assertFalse([q for q in queries if "messages.text" in q])
+
+    def test_stale_ring_reloaded(self):
+        """Does a profile notice a post the ring missed?"""
+
+        app.config['RECENT_MESSAGES_PER_AUTHOR'] = 100
+        self.client.get("/users/1")
+
+        # posted by some other process
+        db.session.add(Message(id=6, text="from elsewhere", user_id=1,
+                               timestamp=datetime(2020, 1, 2)))
+        db.session.commit()
+
+        self.assertIn("from elsewhere", str(self.client.get("/users/1").data))
@@ -0,0 +1,153 @@
+"""Read-replica routing tests.
+
+These use a second database as the "replica"; create it like the test
+database:
+
+    createdb warbler-test-replica
+"""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest tests/test_replicas.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import func, select
+
+from models import db, User, Message, Follows, Likes, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import fragments
+import identity
+import live
+import replicas
+from pagination import encode_cursor
+app.config['TESTING'] = True
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+REPLICA_URL = "postgresql:///warbler-test-replica"
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Test that reads go to the replica and writes to the primary."""
+
+    def setUp(self):
+        app.config['SQLALCHEMY_BINDS'] = {'replica-1': REPLICA_URL}
+        self.replica = db.get_engine(app, bind='replica-1')
+        db.Model.metadata.create_all(bind=self.replica)
+
+        for model in (TimelineEntry, Likes, Follows, Message, User):
+            model.query.delete()
+            self.replica.execute(model.__table__.delete())
+
+        users = [{'id': i, 'username': f"user{i}", 'email': f"user{i}@test.com",
+                  'password': "unused"} for i in (1, 2)]
+        db.session.add_all([User(**row) for row in users])
+        db.session.commit()
+
+        # the replica lags behind: user 2's rename hasn't reached it yet
+        users[1]['username'] = "user2-stale"
+        self.replica.execute(User.__table__.insert(), users)
+
+        identity.cache.clear()
+        fragments.cache.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['SQLALCHEMY_BINDS'] = None
+        db.session.rollback()
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+
+    def test_reads_go_to_replica(self):
+        """Do GET pages read from the replica?"""
+
+        with self.client as c:
+            self.login(c)
+            resp = c.get("/users/2")
+
+        self.assertIn(b"@user2-stale", resp.data)
+
+    def test_no_replicas(self):
+        """Without replicas, do reads stay on the primary?"""
+
+        app.config['SQLALCHEMY_BINDS'] = None
+
+        with self.client as c:
+            self.login(c)
+            resp = c.get("/users/2")
+
+        self.assertIn(b"@user2<", resp.data)
+
+    def test_writes_go_to_primary(self):
+        """Do POSTs write to the primary, and then read it back?"""
+
+        with self.client as c:
+            self.login(c)
+            resp = c.post("/users/follow/2")
+            self.assertEqual(resp.status_code, 302)
+
+            # read-your-writes: this session now reads the primary
+            resp = c.get("/users/2")
+            self.assertIn(b"@user2<", resp.data)
+
+            with c.session_transaction() as sess:
+                sess[replicas.STICKY_KEY] = 0
+
+            # ...until the window passes
+            resp = c.get("/users/2")
+            self.assertIn(b"@user2-stale", resp.data)
+
+        self.assertEqual(Follows.query.count(), 1)
+        self.assertEqual(self.replica.execute(
+            select([func.count()]).select_from(Follows.__table__)).scalar(), 0)
+
+    def test_live_updates_read_the_primary(self):
+        """Are announced messages loaded even before the replica has them?"""
+
+        live.broker = live.LocalBroker()
+        since = encode_cursor(live.broker.covers_from())
+
+        db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+        msg = Message(text="not replicated yet", user_id=2)
+        db.session.add(msg)
+        db.session.commit()
+        live.publish(msg)
+
+        with self.client as c:
+            self.login(c)
+            body = c.get(f"/timeline/updates?since={since}&wait=0").get_json()
+
+        self.assertEqual([m['id'] for m in body['messages']], [msg.id])
+
+    def test_writes_in_a_read_request_pin_the_primary(self):
+        """Once a request has written, does it read back from the primary?"""
+
+        with app.test_request_context("/users/2"):
+            app.preprocess_request()
+            self.assertEqual(db.session.query(User.username).filter_by(id=2).scalar(),
+                             "user2-stale")
+
+            db.session.add(Message(text="hello", user_id=2))
+            db.session.flush()
+
+            self.assertEqual(db.session.query(User.username).filter_by(id=2).scalar(),
+                             "user2")
+            db.session.rollback()
@@ -0,0 +1,268 @@
+"""Materialized timeline tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest tests/test_timeline.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Message, User, Follows, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+import timeline
+app.config['TESTING'] = True
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineTestCase(TestCase):
+    """Test fan-out-on-write timelines."""
+
+    def setUp(self):
+        """Create test client, add sample data, turn fan-out on."""
+
+        TimelineEntry.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.u1 = User.signup("testuser1", "test1@test.com", "password", None)
+        self.u2 = User.signup("testuser2", "test2@test.com", "password", None)
+        self.u1.id = 111
+        self.u2.id = 222
+        db.session.commit()
+
+        app.config['TIMELINE_FANOUT'] = True
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        app.config['TIMELINE_FANOUT'] = False
+        app.config['TIMELINE_CELEBRITY_FOLLOWERS'] = 10000
+        app.config['TIMELINE_MAX_LENGTH'] = 800
+        db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def timeline_ids(self, user_id):
+        return {e.message_id for e in TimelineEntry.query.filter_by(user_id=user_id)}
+
+    def test_post_fans_out_to_followers(self):
+        """Does posting a message push it into the author's and followers' timelines?"""
+
+        db.session.add(Follows(user_being_followed_id=222, user_following_id=111))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, 222)
+            c.post("/messages/new", data={"text": "fan me out"})
+
+        msg = Message.query.one()
+        self.assertEqual(self.timeline_ids(111), {msg.id})
+        self.assertEqual(self.timeline_ids(222), {msg.id})
+
+        with self.client as c:
+            self.login(c, 111)
+            resp = c.get("/")
+            self.assertIn("fan me out", str(resp.data))
+
+    def test_trim_all(self):
+        """Does the sweep cut timelines that posts took past
+        TIMELINE_MAX_LENGTH back to their newest entries?"""
+
+        app.config['TIMELINE_MAX_LENGTH'] = 3
+        db.session.add(Follows(user_being_followed_id=222, user_following_id=111))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, 222)
+            for i in range(5):
+                c.post("/messages/new", data={"text": f"post {i}"})
+
+        # posting doesn't trim
+        self.assertEqual(len(self.timeline_ids(111)), 5)
+
+        with app.app_context():
+            self.assertEqual(timeline.trim_all(batch_size=1), 2)
+
+        newest = {id for (id,) in (db.session
+                                   .query(Message.id)
+                                   .order_by(Message.timestamp.desc(), Message.id.desc())
+                                   .limit(3))}
+        self.assertEqual(self.timeline_ids(111), newest)
+        self.assertEqual(self.timeline_ids(222), newest)
+
+    def test_delete_removes_from_timelines(self):
+        """Does deleting a message remove it from every timeline?"""
+
+        db.session.add(Follows(user_being_followed_id=222, user_following_id=111))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, 222)
+            c.post("/messages/new", data={"text": "short lived"})
+            msg = Message.query.one()
+            c.post(f"/messages/{msg.id}/delete")
+
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_follow_and_unfollow(self):
+        """Are an author's messages backfilled on follow and removed on unfollow?"""
+
+        m = Message(id=1, text="old news", user_id=222)
+        db.session.add(m)
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, 111)
+
+            c.post("/users/follow/222")
+            self.assertEqual(self.timeline_ids(111), {1})
+
+            c.post("/users/stop-following/222")
+            self.assertEqual(self.timeline_ids(111), set())
+
+    def test_trim(self):
+        """Are timelines cut back to TIMELINE_MAX_LENGTH on follow?"""
+
+        start = datetime(2020, 1, 1)
+        db.session.add_all([Message(id=i, text=f"m{i}", user_id=222,
+                                    timestamp=start + timedelta(minutes=i))
+                            for i in range(1, 6)])
+        db.session.commit()
+
+        app.config['TIMELINE_MAX_LENGTH'] = 3
+        try:
+            with self.client as c:
+                self.login(c, 111)
+                c.post("/users/follow/222")
+        finally:
+            app.config['TIMELINE_MAX_LENGTH'] = 800
+
+        self.assertEqual(self.timeline_ids(111), {3, 4, 5})
+
+    def test_rebuild(self):
+        """Does rebuild backfill timelines from follows and messages?"""
+
+        db.session.add(Follows(user_being_followed_id=222, user_following_id=111))
+        db.session.add_all([Message(id=1, text="mine", user_id=111),
+                            Message(id=2, text="theirs", user_id=222)])
+        db.session.commit()
+
+        with app.app_context():
+            self.assertEqual(timeline.rebuild(), 2)
+
+        self.assertEqual(self.timeline_ids(111), {1, 2})
+        self.assertEqual(self.timeline_ids(222), {2})
+
+    def test_celebrity_not_pushed(self):
+        """Are celebrities' messages merged in at read time instead of pushed?"""
+
+        app.config['TIMELINE_CELEBRITY_FOLLOWERS'] = 1
+
+        with self.client as c:
+            self.login(c, 111)
+            c.post("/users/follow/222")
+
+            self.login(c, 222)
+            c.post("/messages/new", data={"text": "too famous to push"})
+
+            msg = Message.query.one()
+            self.assertEqual(self.timeline_ids(111), set())
+            self.assertEqual(self.timeline_ids(222), {msg.id})
+
+            self.login(c, 111)
+            resp = c.get("/")
+            self.assertIn("too famous to push", str(resp.data))
+            self.assertIn("path=hybrid, authors=1", resp.headers['X-Timeline'])
+
+    def test_hybrid_merge(self):
+        """Does the k-way merge interleave pushed and celebrity messages, page
+        cleanly, and skip messages pushed before the author got famous?"""
+
+        db.session.add(User(id=333, username="testuser3", email="test3@test.com",
+                            password="unused"))
+        db.session.commit()
+
+        db.session.add_all([Follows(user_being_followed_id=222, user_following_id=111),
+                            Follows(user_being_followed_id=333, user_following_id=111)])
+        start = datetime(2020, 1, 1)
+        db.session.add_all([Message(id=i, text=f"m{i}", user_id=222 if i % 2 else 333,
+                                    timestamp=start + timedelta(minutes=i))
+                            for i in range(1, 8)])
+        db.session.commit()
+
+        with app.app_context():
+            counters.reconcile()
+            timeline.rebuild()
+
+        # 222 became a celebrity after their messages were pushed
+        app.config['TIMELINE_CELEBRITY_FOLLOWERS'] = 1
+        timeline.stats.reset()
+
+        ids = []
+        cursor = None
+        with app.test_request_context():
+            while True:
+                page = timeline.timeline_page(111, cursor=cursor, limit=3)
+                ids.extend(msg.id for msg in page.items)
+                cursor = page.next_cursor
+                if not cursor:
+                    break
+
+        self.assertEqual(ids, [7, 6, 5, 4, 3, 2, 1])
+        self.assertEqual(timeline.stats.snapshot()['hybrid']['requests'], 3)
+
+    def test_hybrid_sees_posts_from_other_processes(self):
+        """Does a celebrity's cached ring get reloaded when another process
+        (which doesn't share the cache) posts?"""
+
+        db.session.add(Follows(user_being_followed_id=222, user_following_id=111))
+        db.session.add(Message(id=1, text="m1", user_id=222, timestamp=datetime(2020, 1, 1)))
+        db.session.commit()
+        app.config['TIMELINE_CELEBRITY_FOLLOWERS'] = 1
+        with app.app_context():
+            counters.reconcile()
+            db.session.commit()
+
+        with app.test_request_context():
+            self.assertEqual([m.id for m in timeline.timeline_page(111).items], [1])
+
+        # posted elsewhere: this process's ring doesn't hear about it
+        db.session.execute(Message.__table__.insert(), [
+            {'id': 2, 'text': "m2", 'user_id': 222, 'timestamp': datetime(2020, 1, 2)}])
+        db.session.commit()
+
+        with app.test_request_context():
+            self.assertEqual([m.id for m in timeline.timeline_page(111).items], [2, 1])
+
+    def test_pull_path_recorded(self):
+        """Is the pull path counted when fan-out is off?"""
+
+        app.config['TIMELINE_FANOUT'] = False
+        timeline.stats.reset()
+
+        with self.client as c:
+            self.login(c, 111)
+            resp = c.get("/")
+
+        self.assertIn("path=pull", resp.headers['X-Timeline'])
+        self.assertEqual(timeline.stats.snapshot()['pull']['requests'], 1)
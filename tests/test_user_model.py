@@ -8,7 +8,7 @@
 import os
 from unittest import TestCase
 from sqlalchemy import exc
-from models import db, User, Message, Follows
+from models import db, User, Message, Follows, Likes
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -21,6 +21,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 # Now we can import app
 
 from app import app
+import counters
 app.config['TESTING'] = True
 
 # Create our tables (we do this here, so we only create the tables
@@ -99,6 +100,16 @@ class UserModelTestCase(TestCase):
         self.assertTrue(self.u2.is_followed_by(self.u1))
         self.assertFalse(self.u1.is_followed_by(self.u2))
 
+    def test_following_ids_among(self):
+        """Does following_ids_among pick out just the followed users from a batch?"""
+
+        self.u1.following.append(self.u2)
+        db.session.commit()
+
+        self.assertEqual(self.u1.following_ids_among([123, 456, 789]), {456})
+        self.assertEqual(self.u2.following_ids_among([123, 456]), set())
+        self.assertEqual(self.u1.following_ids_among([]), set())
+
     def test_user_follows(self):
         """Are follows being counted correctly?"""
 
@@ -114,6 +125,20 @@ class UserModelTestCase(TestCase):
         self.assertEqual(self.u1.following[0].id, self.u2.id)
     
 
+    def test_liked_ids_among(self):
+        """Does liked_ids_among pick out just the liked messages from a batch?"""
+
+        db.session.add_all([Message(id=1, text="one", user_id=456),
+                            Message(id=2, text="two", user_id=456)])
+        db.session.commit()
+        db.session.add(Likes(user_id=123, message_id=2))
+        db.session.commit()
+
+        self.assertEqual(self.u1.liked_ids_among([1, 2, 3]), {2})
+        self.assertEqual(self.u2.liked_ids_among([1, 2]), set())
+        self.assertEqual(self.u1.liked_ids_among([]), set())
+
+
 ##################################################
 # Signup Tests
 
@@ -167,4 +192,44 @@ class UserModelTestCase(TestCase):
 
     def test_invalid_password(self):
         """Does User.authenticate fail with an incorrect password?"""
-        self.assertFalse(User.authenticate(self.u1.username, "wrongpassword"))
\ No newline at end of file
+        self.assertFalse(User.authenticate(self.u1.username, "wrongpassword"))
+
+
+##################################################
+# Counter Tests
+
+    def test_reconcile_counters(self):
+        """Does reconcile repair counters that drifted from the source tables?"""
+
+        db.session.add(Follows(user_being_followed_id=456, user_following_id=123))
+        db.session.add(Message(id=1, text="hello", user_id=123))
+        db.session.commit()
+        db.session.add(Likes(user_id=456, message_id=1))
+        db.session.commit()
+
+        self.assertEqual(counters.reconcile(), 2)
+        db.session.commit()
+
+        u1, u2 = User.query.get(123), User.query.get(456)
+        self.assertEqual((u1.messages_count, u1.following_count, u1.likes_count), (1, 1, 0))
+        self.assertEqual((u2.messages_count, u2.followers_count, u2.likes_count), (0, 1, 1))
+
+        # nothing left to repair
+        self.assertEqual(counters.reconcile(), 0)
+
+    def test_user_deleted_counters(self):
+        """Are other users' counters adjusted when a user is deleted?"""
+
+        db.session.add(Follows(user_being_followed_id=456, user_following_id=123))
+        db.session.add(Message(id=1, text="hello", user_id=456))
+        db.session.commit()
+        db.session.add(Likes(user_id=123, message_id=1))
+        db.session.commit()
+        counters.reconcile()
+        db.session.commit()
+
+        counters.user_deleted(456)
+        db.session.commit()
+
+        u1 = User.query.get(123)
+        self.assertEqual((u1.following_count, u1.likes_count), (0, 0))
@@ -22,6 +22,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 # Now we can import app
 
 from app import app, CURR_USER_KEY
+import counters
 app.config['TESTING'] = True
 
 # Create our tables (we do this here, so we only create the tables
@@ -96,6 +97,32 @@ class MessageViewTestCase(TestCase):
             self.assertIn(f"@{self.u3.username}", str(resp.data))
             self.assertIn(f"@{self.u4.username}", str(resp.data))
 
+    def test_users_index_pages(self):
+        """Can the user directory be paged forwards and back?"""
+
+        app.config['USERS_PER_PAGE'] = 3
+        try:
+            with self.client as c:
+                resp = c.get("/users")
+                soup = BeautifulSoup(resp.data, "html.parser")
+                self.assertIn("@testuser3", soup.text)
+                self.assertNotIn("@testuser4", soup.text)
+                self.assertIsNone(soup.find("a", string="Previous"))
+
+                resp = c.get(soup.find("a", string="Next")["href"])
+                soup = BeautifulSoup(resp.data, "html.parser")
+                self.assertIn("@testuser4", soup.text)
+                self.assertNotIn("@testuser3", soup.text)
+                self.assertIsNone(soup.find("a", string="Next"))
+
+                resp = c.get(soup.find("a", string="Previous")["href"])
+                soup = BeautifulSoup(resp.data, "html.parser")
+                self.assertIn("@testuser1", soup.text)
+                self.assertIn("@testuser3", soup.text)
+                self.assertNotIn("@testuser4", soup.text)
+        finally:
+            app.config['USERS_PER_PAGE'] = 24
+
     def test_users_search(self):
         """Does search display the desired username? Does search not display undesired usernames?"""
         with self.client as c:
@@ -106,6 +133,47 @@ class MessageViewTestCase(TestCase):
             self.assertNotIn(f"@{self.u3.username}", str(resp.data))
             self.assertNotIn(f"@{self.u4.username}", str(resp.data))
 
+    def test_users_search_ranking(self):
+        """Do usernames starting with the search term come before other matches?"""
+
+        other = User(id=555, username="a_testuser", email="a@test.com", password="unused")
+        db.session.add(other)
+        db.session.commit()
+
+        with self.client as c:
+            resp = c.get("/users?q=testuser")
+            html = str(resp.data)
+
+            self.assertIn("@a_testuser", html)
+            self.assertLess(html.index(f"@{self.u4.username}"), html.index("@a_testuser"))
+
+    def test_users_search_wildcards(self):
+        """Are LIKE wildcards in the search term matched literally?"""
+
+        with self.client as c:
+            resp = c.get("/users?q=%25")
+
+            self.assertIn("Sorry, no users found", str(resp.data))
+
+    def test_users_search_pages(self):
+        """Are search results split into pages?"""
+
+        app.config['USERS_PER_PAGE'] = 3
+        try:
+            with self.client as c:
+                resp = c.get("/users?q=testuser")
+                html = str(resp.data)
+                self.assertIn("@testuser3", html)
+                self.assertNotIn("@testuser4", html)
+                self.assertIn("page=2", html)
+
+                resp = c.get("/users?q=testuser&page=2")
+                html = str(resp.data)
+                self.assertIn("@testuser4", html)
+                self.assertNotIn("@testuser1", html)
+        finally:
+            app.config['USERS_PER_PAGE'] = 24
+
     def test_user_show(self):
         with self.client as c:
             resp = c.get(f"/users/{self.u1.id}")
@@ -130,6 +198,10 @@ class MessageViewTestCase(TestCase):
         db.session.add(l1)
         db.session.commit()
 
+        # rows were added directly, not through the routes
+        counters.reconcile()
+        db.session.commit()
+
     def test_user_show_with_likes(self):
         """Does app show correct amount of user's messages, followers, following, and likes?"""
 
@@ -197,6 +269,47 @@ class MessageViewTestCase(TestCase):
             likes = Likes.query.filter(Likes.message_id==m.id).all()
             self.assertEqual(len(likes), 0)
 
+    def test_like_by_two_users(self):
+        """Can two users like the same message, and unlike it independently?"""
+
+        self.setup_likes()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 222
+
+            c.post("/messages/333/like")
+            self.assertEqual(Likes.query.filter_by(message_id=333).count(), 2)
+
+            c.post("/messages/333/like")
+            likes = Likes.query.filter_by(message_id=333).all()
+            self.assertEqual([l.user_id for l in likes], [111])
+
+    def test_like_json(self):
+        """Does the like endpoint answer JSON clients without a redirect?"""
+
+        self.setup_likes()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 222
+
+            resp = c.post("/messages/111/like", headers={"Accept": "application/json"})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.get_json(), {"message_id": 111, "liked": True})
+
+            resp = c.post("/messages/111/like", headers={"Accept": "application/json"})
+            self.assertEqual(resp.get_json(), {"message_id": 111, "liked": False})
+
+    def test_like_json_unauthorized(self):
+        """Do JSON clients get a 401 when not logged in?"""
+
+        self.setup_likes()
+
+        with self.client as c:
+            resp = c.post("/messages/111/like", headers={"Accept": "application/json"})
+            self.assertEqual(resp.status_code, 401)
+
     def test_unauthenticated_like(self):
         """Does the app fail to toggle like if user is not authorized?"""
 
@@ -228,6 +341,10 @@ class MessageViewTestCase(TestCase):
         db.session.add_all([f1,f2,f3])
         db.session.commit()
 
+        # rows were added directly, not through the routes
+        counters.reconcile()
+        db.session.commit()
+
     
     def test_user_show_with_follows(self):
         """Does the app show the correct amount of user's messages, following, followers, and likes?"""
@@ -304,15 +421,46 @@ class MessageViewTestCase(TestCase):
             self.assertNotIn("@testuser2", str(resp.data))
             self.assertIn("Access unauthorized", str(resp.data))
 
+    def test_follow_counters(self):
+        """Do follow and unfollow keep both users' counters up to date?"""
 
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 111
 
+            c.post(f"/users/follow/{222}")
+            u1, u2 = User.query.get(111), User.query.get(222)
+            self.assertEqual((u1.following_count, u2.followers_count), (1, 1))
 
+            c.post(f"/users/stop-following/{222}")
+            u1, u2 = User.query.get(111), User.query.get(222)
+            self.assertEqual((u1.following_count, u2.followers_count), (0, 0))
 
+    def test_like_counters(self):
+        """Does toggling a like keep the user's like counter up to date?"""
 
+        self.setup_likes()
 
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 222
 
-        
+            c.post("/messages/111/like")
+            self.assertEqual(User.query.get(222).likes_count, 1)
 
-            
+            c.post("/messages/111/like")
+            self.assertEqual(User.query.get(222).likes_count, 0)
+
+    def test_delete_message_counters(self):
+        """Does deleting a liked message bring down the author's and likers' counters?"""
+
+        self.setup_likes()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 222
 
+            c.post("/messages/333/delete")
 
+        self.assertEqual(User.query.get(222).messages_count, 0)
+        self.assertEqual(User.query.get(111).likes_count, 0)
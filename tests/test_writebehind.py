@@ -0,0 +1,226 @@
+"""Write-behind queue tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest tests/test_writebehind.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, Message, User, Follows, Likes, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import identity
+import writebehind
+from writebehind import FOLLOW, LIKE
+app.config['TESTING'] = True
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class WriteBehindTestCase(TestCase):
+    """Test queued likes and follows."""
+
+    def setUp(self):
+        for model in (TimelineEntry, Likes, Follows, Message, User):
+            model.query.delete()
+        db.session.commit()
+
+        db.session.add_all([User(id=i, username=f"user{i}", email=f"user{i}@test.com",
+                                 password="unused") for i in (1, 2, 3)])
+        db.session.commit()
+        db.session.add_all([Message(id=10 + i, text=f"message {i}", user_id=2)
+                            for i in (1, 2, 3)])
+        db.session.commit()
+
+        app.config['WRITE_BEHIND'] = True
+        # flush by hand, not from the background thread
+        writebehind.queue = writebehind.WriteBehind()
+        writebehind.queue.app = app
+        writebehind.queue.window = 0
+
+        identity.cache.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['WRITE_BEHIND'] = False
+        writebehind.queue = writebehind.WriteBehind()
+        db.session.rollback()
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+
+    def like(self, c, message_id):
+        return c.post(f"/messages/{message_id}/like",
+                      headers={'Accept': 'application/json'}).get_json()['liked']
+
+    def test_toggles_coalesce(self):
+        """Do repeated toggles of one pair collapse into one (or no) write?"""
+
+        with self.client as c:
+            self.login(c)
+            self.assertEqual([self.like(c, 11) for i in range(5)],
+                             [True, False, True, False, True])
+            self.like(c, 12)
+            self.like(c, 12)
+
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(writebehind.queue.stats()['pending'], 2)
+        self.assertEqual(writebehind.queue.stats()['coalesced'], 5)
+
+        with app.app_context():
+            self.assertEqual(writebehind.queue.flush(), 2)
+
+        # only the net change was written: one like, on message 11
+        self.assertEqual([(l.user_id, l.message_id) for l in Likes.query], [(1, 11)])
+        self.assertEqual(User.query.get(1).likes_count, 1)
+
+    def test_batched_flush(self):
+        """Does one flush apply every pending like and follow?"""
+
+        queue = writebehind.queue
+        for user_id in (1, 3):
+            queue.set(LIKE, user_id, 11, True)
+            queue.set(LIKE, user_id, 13, True)
+            queue.set(FOLLOW, user_id, 2, True)
+        queue.set(LIKE, 1, 99, True)  # no such message
+
+        self.assertEqual(Likes.query.count(), 0)
+        with app.app_context():
+            queue.flush()
+
+        self.assertEqual(Likes.query.count(), 4)
+        self.assertEqual(Follows.query.count(), 2)
+        self.assertEqual(User.query.get(1).likes_count, 2)
+        self.assertEqual(User.query.get(2).followers_count, 2)
+        self.assertEqual(User.query.get(3).following_count, 1)
+        self.assertEqual(queue.stats()['flushes'], 1)
+
+        # unlike and unfollow: counters come back down
+        queue.set(LIKE, 1, 11, False)
+        queue.set(FOLLOW, 3, 2, False)
+        queue.set(FOLLOW, 3, 1, False)  # wasn't following: nothing to do
+        with app.app_context():
+            queue.flush()
+
+        self.assertEqual(Likes.query.count(), 3)
+        self.assertEqual(Follows.query.count(), 1)
+        self.assertEqual(User.query.get(1).likes_count, 1)
+        self.assertEqual(User.query.get(2).followers_count, 1)
+        self.assertEqual(User.query.get(3).following_count, 0)
+
+    def test_read_your_writes(self):
+        """Does the acting user see their queued changes before the flush?"""
+
+        db.session.add(Likes(user_id=1, message_id=12))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c)
+            c.post("/messages/11/like")
+            c.post("/messages/12/like")
+            resp = c.post("/users/follow/2")
+            self.assertEqual(resp.status_code, 302)
+
+        me = identity.load(1)
+        self.assertEqual(me.liked_ids_among([11, 12, 13]), {11})
+        self.assertEqual(me.following_ids(), [2])
+        self.assertTrue(me.is_following(User.query.get(2)))
+
+        # other users don't see them (nor does the database) yet
+        self.assertEqual(identity.load(3).liked_ids_among([11, 12]), set())
+        self.assertEqual(Follows.query.count(), 0)
+
+        with self.client as c:
+            self.login(c)
+            c.post("/users/stop-following/2")
+
+        self.assertEqual(me.following_ids(), [])
+
+    def new_queue(self, journal_dir):
+        queue = writebehind.WriteBehind()
+        queue.app = app
+        queue.window = 0
+        self.adopted = queue.open_journal(journal_dir)
+        return queue
+
+    def test_journal_replay(self):
+        """After a crash, are journaled clicks adopted and applied?"""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            crashed = self.new_queue(tmp)
+            crashed.set(LIKE, 1, 11, True)
+            crashed.set(LIKE, 1, 12, True)
+            crashed.set(LIKE, 1, 12, False)
+            crashed.set(FOLLOW, 1, 2, True)
+            crashed.close()  # never flushed: its journal stays
+
+            restarted = self.new_queue(tmp)
+            self.assertEqual(self.adopted, 3)
+            with app.app_context():
+                restarted.flush()
+            restarted.close()
+
+            self.assertEqual([(l.user_id, l.message_id) for l in Likes.query], [(1, 11)])
+            self.assertEqual(Follows.query.count(), 1)
+            self.assertEqual(os.listdir(tmp), ['replay.lock'])
+
+            # replaying states that were already applied changes nothing
+            with open(os.path.join(tmp, 'gone.journal'), 'w') as f:
+                f.write('["like", 1, 11, true]\n["like", 1, 1')  # torn write
+            open(os.path.join(tmp, 'gone.owner'), 'w').close()
+
+            again = self.new_queue(tmp)
+            self.assertEqual(self.adopted, 1)
+            with app.app_context():
+                again.flush()
+
+            self.assertEqual(Likes.query.count(), 1)
+            self.assertEqual(User.query.get(1).likes_count, 1)
+
+    def test_shared_journal_dir(self):
+        """Do workers sharing a journal directory keep out of each other's
+        journals while alive, and adopt them once dead?"""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            first = self.new_queue(tmp)
+            second = self.new_queue(tmp)
+            first.set(LIKE, 1, 11, True)
+            second.set(LIKE, 3, 12, True)
+
+            # a flush only clears the flushing worker's own journal
+            with app.app_context():
+                first.flush()
+            self.assertEqual([(l.user_id, l.message_id) for l in Likes.query], [(1, 11)])
+
+            # a worker starting up doesn't take a live worker's journal...
+            third = self.new_queue(tmp)
+            self.assertEqual(self.adopted, 0)
+
+            # ...only a dead one's
+            second.close()
+            fourth = self.new_queue(tmp)
+            self.assertEqual(self.adopted, 1)
+            with app.app_context():
+                fourth.flush()
+
+            self.assertEqual(Likes.query.count(), 2)
+
+            for queue in (first, third, fourth):
+                queue.close()
+            self.assertEqual(os.listdir(tmp), ['replay.lock'])
@@ -0,0 +1,425 @@
+"""Home timelines: pulled, pushed (fan-out on write) or a hybrid of both.
+
+When TIMELINE_FANOUT is on, every new message is copied into a
+`timeline_entries` row for each of its author's followers (and the author),
+so the homepage reads a precomputed, ordered list of message ids instead of
+running an IN-list query across everyone the user follows.
+
+Authors with TIMELINE_CELEBRITY_FOLLOWERS or more followers are never
+pushed: copying each of their messages to every follower costs too much.
+A reader who follows any of them gets a hybrid timeline instead, a k-way
+merge of their pushed entries with each celebrity's recent messages.
+An author who drops back under the threshold is only pushed again for new
+messages; `flask rebuild-timelines` backfills the rest.
+
+Timelines are cut back to TIMELINE_MAX_LENGTH entries when an author is
+followed and by `trim_all` (`flask trim-timelines`, run it periodically);
+in between, posts can take them past it. Apart from the batch jobs
+(`rebuild`, `trim_all`), none of these functions commit; they run inside
+the caller's transaction.
+
+Which path each home timeline request took (pull, push or hybrid) is
+counted in `stats` and sent in an X-Timeline response header.
+"""
+
+import heapq
+import threading
+import time
+from collections import namedtuple
+
+from flask import current_app, g
+from sqlalchemy import literal, or_, tuple_
+from sqlalchemy.orm import joinedload
+
+import instrumentation
+import recent
+from models import db, Follows, Message, TimelineEntry, User
+from pagination import Page, decode_cursor, encode_cursor, keyset_page
+
+ENTRY_COLUMNS = ['user_id', 'message_id', 'author_id', 'timestamp']
+
+ENTRY_ORDER = (TimelineEntry.timestamp, TimelineEntry.message_id)
+
+# One message's place in a timeline; what the k-way merge works on.
+Entry = namedtuple('Entry', ['timestamp', 'message_id'])
+
+
+class PathStats:
+    """Thread-safe counts of which path home timeline requests took."""
+
+    PATHS = ('pull', 'push', 'hybrid')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def record(self, path, authors, elapsed):
+        with self._lock:
+            totals = self._paths[path]
+            totals['requests'] += 1
+            totals['time'] += elapsed
+            totals['merged_authors'] += authors
+            totals['max_merged_authors'] = max(totals['max_merged_authors'], authors)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                path: {
+                    'requests': t['requests'],
+                    'ms_per_request': t['time'] / (t['requests'] or 1) * 1000,
+                    'merged_authors_per_request':
+                        t['merged_authors'] / (t['requests'] or 1),
+                    'max_merged_authors': t['max_merged_authors'],
+                }
+                for path, t in self._paths.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._paths = {path: {'requests': 0, 'time': 0.0, 'merged_authors': 0,
+                                  'max_merged_authors': 0}
+                           for path in self.PATHS}
+
+
+stats = PathStats()
+
+
+def init_app(app):
+    """Report each request's timeline path in an X-Timeline header."""
+
+    app.after_request(add_path_header)
+
+
+def add_path_header(response):
+    path = g.get('timeline_path')
+    if path and instrumentation.send_headers:
+        response.headers['X-Timeline'] = path
+    return response
+
+
+def record(path, authors, started):
+    elapsed = time.perf_counter() - started
+    stats.record(path, authors, elapsed)
+    g.timeline_path = f"path={path}, authors={authors}, time_ms={elapsed * 1000:.2f}"
+
+
+def enabled():
+    """Is fan-out on write turned on for this app?"""
+
+    return current_app.config.get('TIMELINE_FANOUT', False)
+
+
+def max_length():
+    """How many entries each materialized timeline keeps."""
+
+    return current_app.config.get('TIMELINE_MAX_LENGTH', 800)
+
+
+def celebrity_threshold():
+    """Follower count from which authors are merged at read time (0: never)."""
+
+    return current_app.config.get('TIMELINE_CELEBRITY_FOLLOWERS', 0)
+
+
+def is_celebrity(author_id):
+    """Is this author's fan-out too big to push?"""
+
+    threshold = celebrity_threshold()
+    if not threshold:
+        return False
+
+    followers = (db.session
+                 .query(User.followers_count)
+                 .filter(User.id == author_id)
+                 .scalar())
+    return (followers or 0) >= threshold
+
+
+def fan_out(message):
+    """Push a new (flushed) message into its author's and followers' timelines.
+
+    A celebrity's message only goes into their own timeline; followers
+    merge it in when they read theirs.
+    """
+
+    if not enabled():
+        return
+
+    entries = TimelineEntry.__table__
+
+    followers = (db.session
+                 .query(Follows.user_following_id,
+                        literal(message.id),
+                        literal(message.user_id),
+                        literal(message.timestamp))
+                 .filter(Follows.user_being_followed_id == message.user_id)
+                 .filter(Follows.user_following_id != message.user_id))
+
+    db.session.execute(entries.insert().values(
+        user_id=message.user_id,
+        message_id=message.id,
+        author_id=message.user_id,
+        timestamp=message.timestamp,
+    ))
+
+    if is_celebrity(message.user_id):
+        return
+
+    db.session.execute(
+        entries.insert().from_select(ENTRY_COLUMNS, followers.statement))
+
+
+def remove_message(message_id):
+    """Drop a deleted message from every timeline it was pushed to."""
+
+    if not enabled():
+        return
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.message_id == message_id)
+     .delete(synchronize_session=False))
+
+
+def add_author(follower_id, author_id):
+    """Backfill a newly-followed author's recent messages into a timeline."""
+
+    if not enabled() or follower_id == author_id or is_celebrity(author_id):
+        return
+
+    recent = (db.session
+              .query(literal(follower_id),
+                     Message.id,
+                     Message.user_id,
+                     Message.timestamp)
+              .filter(Message.user_id == author_id)
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(max_length()))
+
+    db.session.execute(
+        TimelineEntry.__table__.insert().from_select(ENTRY_COLUMNS, recent.statement))
+    trim(follower_id)
+
+
+def remove_author(follower_id, author_id):
+    """Remove an unfollowed author's messages from a timeline."""
+
+    if not enabled() or follower_id == author_id:
+        return
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.user_id == follower_id,
+             TimelineEntry.author_id == author_id)
+     .delete(synchronize_session=False))
+
+
+def trim(user_id):
+    """Cut a timeline back down to its newest TIMELINE_MAX_LENGTH entries;
+    returns how many were removed."""
+
+    cutoff = (db.session
+              .query(TimelineEntry.timestamp, TimelineEntry.message_id)
+              .filter(TimelineEntry.user_id == user_id)
+              .order_by(TimelineEntry.timestamp.desc(),
+                        TimelineEntry.message_id.desc())
+              .offset(max_length())
+              .first())
+
+    if not cutoff:
+        return 0
+
+    return (TimelineEntry
+            .query
+            .filter(TimelineEntry.user_id == user_id,
+                    tuple_(TimelineEntry.timestamp, TimelineEntry.message_id)
+                    <= tuple_(*cutoff))
+            .delete(synchronize_session=False))
+
+
+def trim_all(batch_size=500):
+    """Trim every timeline, one reader at a time.
+
+    Posting doesn't trim (that would mean ranking every follower's timeline
+    on every post), so timelines grow past TIMELINE_MAX_LENGTH until this
+    runs. Each reader costs one index lookup for their Nth entry and a
+    delete of what's older. Commits every `batch_size` readers; returns the
+    number of timelines trimmed.
+    """
+
+    user_ids = [uid for (uid,) in db.session.query(User.id).order_by(User.id)]
+
+    trimmed = 0
+    for count, user_id in enumerate(user_ids, 1):
+        if trim(user_id):
+            trimmed += 1
+        if count % batch_size == 0:
+            db.session.commit()
+
+    db.session.commit()
+    return trimmed
+
+
+def home_page(user, cursor=None, limit=20, query=None):
+    """One page of `user`'s home timeline, from whichever path is on.
+
+    Messages are loaded with `query` (by default, Message objects with their
+    authors); pass a query of columns including Message.id to project.
+    """
+
+    if enabled():
+        return timeline_page(user.id, cursor=cursor, limit=limit, query=query)
+
+    started = time.perf_counter()
+
+    if query is None:
+        query = Message.query.options(joinedload(Message.user))
+
+    following_ids = user.following_ids() + [user.id]
+    page = keyset_page(query.filter(Message.user_id.in_(following_ids)),
+                       (Message.timestamp, Message.id),
+                       cursor=cursor,
+                       limit=limit)
+
+    record('pull', 0, started)
+    return page
+
+
+def celebrities_followed(user_id):
+    """Ids of the celebrities `user_id` follows (whose messages aren't pushed)."""
+
+    threshold = celebrity_threshold()
+    if not threshold:
+        return []
+
+    return [uid for (uid,) in (db.session
+                               .query(Follows.user_being_followed_id)
+                               .join(User, User.id == Follows.user_being_followed_id)
+                               .filter(Follows.user_following_id == user_id,
+                                       Follows.user_being_followed_id != user_id,
+                                       User.followers_count >= threshold))]
+
+
+def pushed_entries(user_id, after=None, limit=20):
+    """The newest `limit` entries of a materialized timeline, before `after`."""
+
+    query = (db.session
+             .query(*ENTRY_ORDER)
+             .filter(TimelineEntry.user_id == user_id))
+    if after:
+        query = query.filter(tuple_(*ENTRY_ORDER) < tuple_(*after))
+
+    return [Entry(*row) for row in
+            query.order_by(*[c.desc() for c in ENTRY_ORDER]).limit(limit)]
+
+
+def author_entries(author_id, after=None, limit=20, newest_id=None):
+    """An author's newest `limit` messages, before `after`, as entries.
+
+    Pass the id of the author's newest message (see recent.newest_ids) so a
+    ring that missed a post made through another process gets reloaded.
+    """
+
+    return [Entry(*row) for row in recent.entries(author_id, after, limit, newest_id)]
+
+
+def merge_newest(sources, limit):
+    """K-way merge newest-first entry lists into one, dropping repeats.
+
+    Each source must already be newest first. A message can be in more than
+    one (an author who became a celebrity after it was pushed).
+    """
+
+    merged = []
+    seen = set()
+
+    for entry in heapq.merge(*sources, reverse=True):
+        if entry.message_id not in seen:
+            seen.add(entry.message_id)
+            merged.append(entry)
+            if len(merged) == limit:
+                break
+
+    return merged
+
+
+def timeline_page(user_id, cursor=None, limit=20, query=None):
+    """Read one page of a user's materialized timeline, merging in the
+    recent messages of any celebrities they follow.
+
+    Cursors are interchangeable with the ones the pull-based homepage query
+    hands out, since both page on (timestamp, message id).
+
+    Messages are loaded with `query` (by default, Message objects with their
+    authors); pass a query of columns including Message.id to project.
+    """
+
+    started = time.perf_counter()
+    after = decode_cursor(cursor, ENTRY_ORDER) if cursor else None
+    celebrities = celebrities_followed(user_id)
+
+    # one extra entry tells us whether there is another page
+    sources = [pushed_entries(user_id, after, limit + 1)]
+    newest = recent.newest_ids(celebrities)
+    sources.extend(author_entries(author_id, after, limit + 1, newest.get(author_id))
+                   for author_id in celebrities)
+    entries = merge_newest(sources, limit + 1)
+
+    next_cursor = encode_cursor(entries[limit - 1]) if len(entries) > limit else None
+    ids = [entry.message_id for entry in entries[:limit]]
+
+    if not ids:
+        items = []
+    else:
+        if query is None:
+            query = Message.query.options(joinedload(Message.user))
+
+        by_id = {msg.id: msg for msg in query.filter(Message.id.in_(ids))}
+        items = [by_id[i] for i in ids if i in by_id]
+
+    record('hybrid' if celebrities else 'push', len(celebrities), started)
+    return Page(items, next_cursor)
+
+
+def rebuild(batch_size=500):
+    """Rebuild every timeline from the `follows` and `messages` tables.
+
+    Commits every `batch_size` users so a large backfill doesn't hold a
+    single huge transaction. Returns the number of timelines built.
+    """
+
+    entries = TimelineEntry.__table__
+    TimelineEntry.query.delete(synchronize_session=False)
+    db.session.commit()
+
+    user_ids = [uid for (uid,) in db.session.query(User.id).order_by(User.id)]
+
+    threshold = celebrity_threshold()
+
+    for count, user_id in enumerate(user_ids, 1):
+        followed = (db.session
+                    .query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == user_id))
+        if threshold:
+            # celebrities are merged in at read time
+            followed = (followed
+                        .join(User, User.id == Follows.user_being_followed_id)
+                        .filter(User.followers_count < threshold))
+
+        recent = (db.session
+                  .query(literal(user_id),
+                         Message.id,
+                         Message.user_id,
+                         Message.timestamp)
+                  .filter(or_(Message.user_id == user_id,
+                              Message.user_id.in_(followed.subquery())))
+                  .order_by(Message.timestamp.desc(), Message.id.desc())
+                  .limit(max_length()))
+
+        db.session.execute(entries.insert().from_select(ENTRY_COLUMNS, recent.statement))
+
+        if count % batch_size == 0:
+            db.session.commit()
+
+    db.session.commit()
+    return len(user_ids)
@@ -0,0 +1,423 @@
+"""Write-behind queue for likes and follows.
+
+With WRITE_BEHIND on, liking and following don't commit per click. Each
+click records the state the user wants (liked or not, following or not) for
+its (user, target) pair; a later click on the same pair replaces the earlier
+one, so a burst of toggles collapses into at most one change. Every
+WRITE_BEHIND_WINDOW seconds a background thread applies everything pending
+in one transaction, a few batched statements per kind, adjusting counters
+and timelines for the rows that actually changed.
+
+Until then the acting user's reads go through an overlay of their pending
+states (see identity.CurrentUser), so their buttons flip immediately.
+Overlays are per process: other users, and requests served by other
+worker processes, see the change once it's flushed.
+
+Crash safety: pending states are only in memory, so a crash loses up to one
+window of clicks, unless WRITE_BEHIND_JOURNAL_DIR names a directory. Then
+each process appends every state to a journal of its own there before the
+click is answered (fsynced with WRITE_BEHIND_FSYNC), and holds a lock on an
+`.owner` file for as long as it lives. At startup a process adopts the
+journals of owners that died (their lock is free) and flushes them. States,
+not toggles, are journaled, so replaying ones that were already applied
+changes nothing.
+"""
+
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from glob import glob
+
+from sqlalchemy import tuple_
+
+import counters
+import timeline
+from models import db, Follows, Likes, Message, User
+
+log = logging.getLogger('warbler.writebehind')
+
+LIKE = 'like'
+FOLLOW = 'follow'
+
+
+class WriteBehind:
+    """Pending like/follow states, coalesced per (kind, user, target)."""
+
+    def __init__(self):
+        self.app = None
+        self.window = 0.5
+        self.journal_dir = None
+        self.journal_name = None
+        self.fsync = False
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._journal = None
+        self._owner = None
+        self._thread = None
+        self.queued = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.applied = 0
+        self.failures = 0
+        self.last_flush = 0.0
+
+    def set(self, kind, user_id, target_id, state):
+        """Record that `user_id` wants (state=True) or doesn't want a like
+        of / follow of `target_id`."""
+
+        key = (kind, user_id, target_id)
+
+        with self._lock:
+            self._write_journal([key + (state,)])
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = state
+            self.queued += 1
+
+        self._start()
+
+    def pending(self, kind, user_id):
+        """{target id: wanted state} of `user_id`'s unflushed changes."""
+
+        with self._lock:
+            return {target: state for (k, user, target), state in self._pending.items()
+                    if k == kind and user == user_id}
+
+    def flush(self):
+        """Apply everything pending in one transaction; returns how many
+        (user, target) states were applied."""
+
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            flushing = self._rotate_journal()
+
+        if not batch:
+            return 0
+
+        started = time.perf_counter()
+        try:
+            apply_likes({key[1:]: state for key, state in batch.items() if key[0] == LIKE})
+            apply_follows({key[1:]: state for key, state in batch.items() if key[0] == FOLLOW})
+            db.session.commit()
+
+        except Exception:
+            db.session.rollback()
+            log.exception("Write-behind flush of %d states failed; will retry", len(batch))
+
+            with self._lock:
+                self.failures += 1
+                # newer clicks win over the batch we're putting back
+                retry = {key: state for key, state in batch.items() if key not in self._pending}
+                self._pending.update(retry)
+                self._write_journal([key + (state,) for key, state in retry.items()])
+            self._remove(flushing)
+            return 0
+
+        self._remove(flushing)
+        with self._lock:
+            self.flushes += 1
+            self.applied += len(batch)
+            self.last_flush = time.perf_counter() - started
+        return len(batch)
+
+    def open_journal(self, directory):
+        """Journal to `directory`, first adopting the journals left there by
+        processes that died before flushing; returns how many states were
+        adopted."""
+
+        os.makedirs(directory, exist_ok=True)
+        self.journal_dir = directory
+
+        # one process adopts at a time, so no journal is adopted twice
+        with open(os.path.join(directory, 'replay.lock'), 'a') as guard:
+            fcntl.flock(guard, fcntl.LOCK_EX)
+
+            states = {}
+            for owner_path in sorted(glob(os.path.join(directory, '*.owner'))):
+                states.update(adopt(owner_path[:-len('.owner')]))
+
+            with self._lock:
+                for key, state in states.items():
+                    self._pending.setdefault(key, state)
+                self._write_journal([key + (state,) for key, state in states.items()])
+
+        return len(states)
+
+    def close(self):
+        """Stop journaling. Our journal is removed if nothing is pending;
+        otherwise it's left, unlocked, for the next process to adopt."""
+
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if self._owner is not None:
+                if not self._pending:
+                    for suffix in ('.flushing', '.journal', '.owner'):
+                        self._remove(self._path(suffix))
+                self._owner.close()
+                self._owner = None
+
+    def stats(self):
+        """Queue depth and flush numbers, e.g. for a metrics page."""
+
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'queued': self.queued,
+                'coalesced': self.coalesced,
+                'flushes': self.flushes,
+                'applied': self.applied,
+                'failures': self.failures,
+                'last_flush_ms': self.last_flush * 1000,
+            }
+
+    # journal (call with the lock held)
+
+    def _path(self, suffix):
+        return os.path.join(self.journal_dir, self.journal_name + suffix)
+
+    def _write_journal(self, states):
+        if not self.journal_dir or not states:
+            return
+
+        if self._owner is None:
+            # a name of our own, locked for as long as this process lives
+            self.journal_name = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            self._owner = open(self._path('.owner'), 'a')
+            fcntl.flock(self._owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        if self._journal is None:
+            self._journal = open(self._path('.journal'), 'a')
+
+        self._journal.write(''.join(json.dumps(list(s)) + '\n' for s in states))
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _rotate_journal(self):
+        """Set the journal being flushed aside; returns its path."""
+
+        if self._journal is None:
+            return None
+
+        self._journal.close()
+        self._journal = None
+
+        flushing = self._path('.flushing')
+        if os.path.exists(flushing):
+            # a failed flush's leftovers are back in the new journal already
+            os.remove(flushing)
+        os.rename(self._path('.journal'), flushing)
+        return flushing
+
+    def _forked(self):
+        """In a freshly forked worker: the parent's lock, journal and flusher
+        thread aren't ours, so start on our own."""
+
+        self._lock = threading.Lock()
+        self._journal = self._owner = self._thread = None
+        if self._pending:
+            self._write_journal([key + (state,) for key, state in self._pending.items()])
+            self._start()
+
+    @staticmethod
+    def _remove(path):
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    # background flushing
+
+    def _start(self):
+        if self._thread is None and self.app is not None and self.window > 0:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True,
+                                                    name='write-behind')
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.window)
+            with self.app.app_context():
+                self.flush()
+
+
+def adopt(prefix):
+    """The states in a journal (`prefix` + .flushing/.journal) whose owner
+    died, removing it; {} if its owner is still alive."""
+
+    try:
+        owner = open(prefix + '.owner', 'a')
+    except FileNotFoundError:
+        return {}
+
+    with owner:
+        try:
+            fcntl.flock(owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return {}
+
+        states = {}
+        for path in (prefix + '.flushing', prefix + '.journal'):
+            if os.path.exists(path):
+                with open(path) as f:
+                    for line in f:
+                        try:
+                            kind, user_id, target_id, state = json.loads(line)
+                        except ValueError:
+                            continue  # a torn last line
+                        states[(kind, user_id, target_id)] = state
+
+        for suffix in ('.flushing', '.journal', '.owner'):
+            WriteBehind._remove(prefix + suffix)
+
+    return states
+
+
+queue = WriteBehind()
+
+
+def init_app(app):
+    """Configure the queue and adopt any journals a crash left behind."""
+
+    queue.app = app
+    queue.window = app.config.get('WRITE_BEHIND_WINDOW', 0.5)
+    queue.fsync = app.config.get('WRITE_BEHIND_FSYNC', False)
+
+    if app.config.get('WRITE_BEHIND'):
+        atexit.register(flush_at_exit)
+        journal_dir = app.config.get('WRITE_BEHIND_JOURNAL_DIR')
+        if journal_dir and queue.open_journal(journal_dir):
+            queue._start()
+
+
+def flush_at_exit():
+    """On a clean shutdown, don't leave the last window's clicks behind."""
+
+    with queue.app.app_context():
+        queue.flush()
+    queue.close()
+
+
+def after_fork():
+    """Give each forked worker (e.g. gunicorn --preload) its own journal."""
+
+    queue._forked()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=after_fork)
+
+
+def enabled():
+    """Is write-behind on for this app?"""
+
+    return bool(queue.app and queue.app.config.get('WRITE_BEHIND'))
+
+
+def overlay(kind, user_id, found, among=None):
+    """Apply `user_id`'s pending states to `found`, the targets the
+    database says they like/follow (out of `among`, if given)."""
+
+    result = set(found)
+    for target_id, state in queue.pending(kind, user_id).items():
+        if among is not None and target_id not in among:
+            continue
+        if state:
+            result.add(target_id)
+        else:
+            result.discard(target_id)
+    return result
+
+
+##############################################################################
+# Applying batches
+
+
+def _existing(user_column, target_column, pairs):
+    """Which (user, target) pairs already have a row."""
+
+    if not pairs:
+        return set()
+
+    rows = (db.session
+            .query(user_column, target_column)
+            .filter(tuple_(user_column, target_column).in_(list(pairs))))
+    return set(rows)
+
+
+def _split(user_column, target_column, states):
+    """(pairs to insert, pairs to delete), skipping ones already in place."""
+
+    existing = _existing(user_column, target_column, set(states))
+    wanted = {pair for pair, state in states.items() if state}
+    return wanted - existing, (set(states) - wanted) & existing
+
+
+def apply_likes(states):
+    """Insert/delete likes for {(user_id, message_id): liked} and adjust
+    likes_count for the rows that changed."""
+
+    add, remove = _split(Likes.user_id, Likes.message_id, states)
+
+    if add:
+        # users and messages deleted since the click can't like/be liked
+        users = {uid for (uid,) in db.session.query(User.id)
+                 .filter(User.id.in_({uid for uid, _ in add}))}
+        messages = {mid for (mid,) in db.session.query(Message.id)
+                    .filter(Message.id.in_({mid for _, mid in add}))}
+        add = {(uid, mid) for uid, mid in add if uid in users and mid in messages}
+
+    if add:
+        db.session.execute(Likes.__table__.insert(),
+                           [{'user_id': uid, 'message_id': mid} for uid, mid in add])
+    if remove:
+        (Likes
+         .query
+         .filter(tuple_(Likes.user_id, Likes.message_id).in_(list(remove)))
+         .delete(synchronize_session=False))
+
+    deltas = {}
+    for uid, _ in add:
+        deltas[uid] = deltas.get(uid, 0) + 1
+    for uid, _ in remove:
+        deltas[uid] = deltas.get(uid, 0) - 1
+    for uid, delta in deltas.items():
+        if delta:
+            counters.adjust(uid, likes_count=delta)
+
+
+def apply_follows(states):
+    """Insert/delete follows for {(follower_id, followed_id): following},
+    with their counters and timeline backfill/removal."""
+
+    add, remove = _split(Follows.user_following_id, Follows.user_being_followed_id, states)
+
+    if add:
+        alive = {uid for (uid,) in db.session.query(User.id)
+                 .filter(User.id.in_({uid for pair in add for uid in pair}))}
+        add = {(a, b) for a, b in add if a in alive and b in alive}
+
+    if add:
+        db.session.execute(Follows.__table__.insert(),
+                           [{'user_following_id': a, 'user_being_followed_id': b}
+                            for a, b in add])
+    if remove:
+        (Follows
+         .query
+         .filter(tuple_(Follows.user_following_id,
+                        Follows.user_being_followed_id).in_(list(remove)))
+         .delete(synchronize_session=False))
+
+    for follower_id, followed_id in add:
+        counters.follow_added(follower_id, followed_id)
+        timeline.add_author(follower_id, followed_id)
+    for follower_id, followed_id in remove:
+        counters.follow_removed(follower_id, followed_id)
+        timeline.remove_author(follower_id, followed_id)